@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 
-def runLittleMan(mem):
+def readInput():
+    return int(input('Input: '))
+
+def runLittleMan(mem, read=readInput, write=print, trace=None):
 
     # Initialiser
     ac = 0
@@ -10,6 +13,10 @@ def runLittleMan(mem):
     # Kjør instruksjonssyklus
     while running:
 
+        # before every instruction
+        if trace is not None:
+            trace(pc, ac)
+
         # Fetch
         instr = mem[pc]
         pc += 1
@@ -32,9 +39,9 @@ def runLittleMan(mem):
             if ac > 0:
                 pc = instr % 100
         elif instr == 901:      # INP
-            ac = int(input('Input: '))
+            ac = read()
         elif instr == 902:      # OUT
-            print(ac)
+            write(ac)
         elif instr == 000:      # HLT
             running = False
         else:                   # ERROR
@@ -57,4 +64,5 @@ demo4 = [ 901, 321, 518, 902, 519,
           319, 606,   0,   1,   1,
           0, 0]
 
-runLittleMan(demo1)
\ No newline at end of file
+if __name__ == "__main__":
+    runLittleMan(demo1)
@@ -0,0 +1,32 @@
+import argparse, sys
+from compiler.benchmark import Benchmark, Comparator
+
+if __name__ == "__main__":
+
+	parser = argparse.ArgumentParser(description="Benchmark every phase of the compiler and assembler")
+	parser.add_argument("--quick", action="store_true", help="only run the smaller programs")
+	parser.add_argument("--repeat", type=int, default=3, help="runs of every program, the best is kept")
+	parser.add_argument("--opt-level", type=int, default=2, help="the opt_level of the compiler")
+	parser.add_argument("--save", metavar="FILE", help="write the results as JSON")
+	parser.add_argument("--compare", metavar="FILE", help="flag regressions against saved results")
+	parser.add_argument("--threshold", type=float, default=1.5,
+		help="how many times slower a phase can get before it's a regression")
+	args = parser.parse_args()
+
+	bench = Benchmark(repeat=args.repeat, quick=args.quick, opt_level=args.opt_level)
+	results = bench.run()
+	print(Benchmark.format(results))
+
+	if args.save is not None:
+		Benchmark.save(results, args.save)
+		print("Wrote {0}".format(args.save))
+
+	if args.compare is not None:
+		comparator = Comparator(Benchmark.load(args.compare), threshold=args.threshold)
+		regressions = comparator.compare(results)
+		if len(regressions) != 0:
+			print("\nRegressions:")
+			for r in regressions:
+				print("   " + r)
+			sys.exit(1)
+		print("\nNo regressions")
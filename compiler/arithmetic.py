@@ -0,0 +1,352 @@
+import heapq
+from compiler.instruction import Instruction, JumpFlag
+
+# Dividends are assumed to fit in a Little Man word when picking how
+# to divide by a constant, larger values are still divided correctly.
+WORD_MAX = 999
+
+# Cycles for one iteration of a division loop, and for
+# entering and leaving it.
+DIV_LOOP_CYCLES = 7
+DIV_LOOP_OVERHEAD = 4
+
+# Constants above this are multiplied with a plain double-and-add chain
+# instead of searching for the shortest one.
+MAX_SEARCH = 4096
+
+class Arithmetic:
+    """
+    Code generation for multiplication and division, which the
+    Little Man Computer has no instructions for.
+
+    Multiplication and division by a constant is lowered to straight-line
+    addition chains and bounded subtraction loops, picked to use as few
+    cycles as possible. Anything else falls back to a loop at runtime.
+
+    Division truncates towards zero, and dividing by zero gives zero.
+    """
+
+    _chains = {}
+    _levels = {}
+
+    def __init__(self, *, compact=False):
+        """
+        With 'compact' every division by a constant is a single loop,
+        which is slower but less than half the size.
+        """
+        self.compact = compact
+        # divisions by a constant that used more than one loop
+        self.expanded = 0
+
+    def gen_mul_const(self, asm, memory, src, c):
+        """
+        AC = AC * c, where 'src' holds the same value as the AC.
+        """
+        temp = None
+        for step in Arithmetic.mul_chain(c):
+            if step == "add":
+                asm.add(Instruction("ADD", variable=src))
+            elif step == "sub":
+                asm.add(Instruction("SUB", variable=src))
+            else:
+                if temp is None:
+                    temp = memory.gen_temp_name()
+                    memory.add_reference(temp)
+                asm.store(temp)
+                if step == 0:
+                    asm.add(Instruction("SUB", variable=temp, comment="* 0"))
+                elif step == -1:
+                    asm.add(Instruction("SUB", variable=temp, comment="* -1"))
+                    asm.add(Instruction("SUB", variable=temp))
+                else:
+                    for n in range(step - 1):
+                        asm.add(Instruction("ADD", variable=temp, comment="* {0}".format(step)))
+
+    def gen_div_const(self, asm, memory, src, c):
+        """
+        AC = AC / c, where 'src' holds the same value as the AC.
+        """
+        if c == 1:
+            return
+        elif c == 0:
+            asm.add(Instruction("SUB", variable=src, comment="/ 0"))
+            return
+        elif c == -1:
+            asm.add(Instruction("SUB", variable=src, comment="/ -1"))
+            asm.add(Instruction("SUB", variable=src))
+            return
+
+        d = abs(c)
+        zero = self._const(memory, 0)
+        one = self._const(memory, 1)
+        rem = self._temp(memory)
+        quotient = self._temp(memory)
+
+        # rem = |x| + 1, the remainder is off by one so that 'BRP' can
+        # be used to test if it's larger than or equal to the divisor.
+        positive = memory.gen_jump_name()
+        asm.add(Instruction("BRP", jump=positive))
+        asm.load(zero)
+        asm.add(Instruction("SUB", variable=src))
+        asm.add(JumpFlag(positive))
+        asm.add(Instruction("ADD", variable=one))
+        asm.store(rem)
+        asm.load(zero)
+        asm.store(quotient)
+
+        levels = [1] if self.compact else Arithmetic.div_levels(d)
+        if len(levels) > 1:
+            self.expanded += 1
+        for m in levels:
+            self._gen_div_loop(asm, memory, rem, quotient,
+                self._const(memory, d * m), self._const(memory, m))
+
+        # the quotient is negative if only one of the operands is
+        self._gen_sign(asm, memory, src, quotient, zero, negate_if_positive=c < 0)
+
+    def gen_mul(self, asm, memory, a, b):
+        """
+        AC = a * b, by adding 'a' to the result 'b' times.
+        """
+        zero = self._const(memory, 0)
+        one = self._const(memory, 1)
+        result = self._temp(memory)
+        count = self._temp(memory)
+        addend = self._temp(memory)
+
+        positive = memory.gen_jump_name()
+        body = memory.gen_jump_name()
+        test = memory.gen_jump_name()
+
+        asm.load(zero)
+        asm.store(result)
+        asm.load(b)
+        asm.add(Instruction("BRP", jump=positive))
+        # count with -b and add -a instead
+        asm.load(zero)
+        asm.add(Instruction("SUB", variable=b))
+        asm.store(count)
+        asm.load(zero)
+        asm.add(Instruction("SUB", variable=a))
+        asm.store(addend)
+        asm.add(Instruction("BRA", jump=test))
+        asm.add(JumpFlag(positive))
+        asm.store(count)
+        asm.load(a)
+        asm.store(addend)
+        asm.add(Instruction("BRA", jump=test))
+        asm.add(JumpFlag(body))
+        asm.add(Instruction("SUB", variable=one))
+        asm.store(count)
+        asm.load(result)
+        asm.add(Instruction("ADD", variable=addend))
+        asm.store(result)
+        asm.add(JumpFlag(test))
+        asm.load(count)
+        asm.add(Instruction("BRP", jump=body, comment="multiply loop"))
+        asm.load(result)
+
+    def gen_div(self, asm, memory, a, b):
+        """
+        AC = a / b, by subtracting |b| from |a| until it's smaller than |b|.
+        """
+        zero = self._const(memory, 0)
+        one = self._const(memory, 1)
+        rem = self._temp(memory)
+        quotient = self._temp(memory)
+        divisor = self._temp(memory)
+
+        b_positive = memory.gen_jump_name()
+        a_positive = memory.gen_jump_name()
+        done = memory.gen_jump_name()
+        end = memory.gen_jump_name()
+
+        asm.load(zero)
+        asm.store(quotient)
+        asm.load(b)
+        asm.add(Instruction("BRP", jump=b_positive))
+        asm.load(zero)
+        asm.add(Instruction("SUB", variable=b))
+        asm.add(JumpFlag(b_positive))
+        asm.store(divisor)
+        asm.add(Instruction("BRZ", jump=done, comment="divide by zero"))
+        asm.load(a)
+        asm.add(Instruction("BRP", jump=a_positive))
+        asm.load(zero)
+        asm.add(Instruction("SUB", variable=a))
+        asm.add(JumpFlag(a_positive))
+        asm.add(Instruction("ADD", variable=one))
+        asm.store(rem)
+
+        self._gen_div_loop(asm, memory, rem, quotient, divisor, one)
+
+        negate = memory.gen_jump_name()
+        b_check = memory.gen_jump_name()
+        asm.load(a)
+        asm.add(Instruction("BRP", jump=b_check))
+        asm.load(b)
+        asm.add(Instruction("BRP", jump=negate))
+        asm.add(Instruction("BRA", jump=done))
+        asm.add(JumpFlag(b_check))
+        asm.load(b)
+        asm.add(Instruction("BRP", jump=done))
+        asm.add(JumpFlag(negate))
+        asm.load(zero)
+        asm.add(Instruction("SUB", variable=quotient))
+        asm.add(Instruction("BRA", jump=end))
+        asm.add(JumpFlag(done))
+        asm.load(quotient)
+        asm.add(JumpFlag(end))
+
+    def _gen_div_loop(self, asm, memory, rem, quotient, stride, step):
+        """
+        while rem - 1 >= stride: rem -= stride, quotient += step
+        """
+        body = memory.gen_jump_name()
+        test = memory.gen_jump_name()
+
+        asm.add(Instruction("BRA", jump=test))
+        asm.add(JumpFlag(body))
+        asm.store(rem)
+        asm.load(quotient)
+        asm.add(Instruction("ADD", variable=step))
+        asm.store(quotient)
+        asm.add(JumpFlag(test))
+        asm.load(rem)
+        asm.add(Instruction("SUB", variable=stride))
+        asm.add(Instruction("BRP", jump=body, comment="divide loop"))
+
+    def _gen_sign(self, asm, memory, src, quotient, zero, *, negate_if_positive):
+        """
+        AC = quotient, negated if 'src' is negative, or the other
+        way around if 'negate_if_positive' is set.
+        """
+        positive = memory.gen_jump_name()
+        end = memory.gen_jump_name()
+
+        asm.load(src)
+        asm.add(Instruction("BRP", jump=positive))
+        if negate_if_positive:
+            asm.load(quotient)
+        else:
+            asm.load(zero)
+            asm.add(Instruction("SUB", variable=quotient))
+        asm.add(Instruction("BRA", jump=end))
+        asm.add(JumpFlag(positive))
+        if negate_if_positive:
+            asm.load(zero)
+            asm.add(Instruction("SUB", variable=quotient))
+        else:
+            asm.load(quotient)
+        asm.add(JumpFlag(end))
+
+    def _const(self, memory, value):
+        name = memory.gen_temp_name()
+        memory.add_reference(name, str(value))
+        return name
+
+    def _temp(self, memory):
+        name = memory.gen_temp_name()
+        memory.add_reference(name)
+        return name
+
+    @staticmethod
+    def mul_chain(c):
+        """
+        Find the shortest list of steps that turns x into x * c.
+
+        The steps are "add" (add x), "sub" (subtract x) or an int 'k'
+        to store the AC and multiply it by 'k' with 'k - 1' additions.
+        Every step is one instruction, except multiplying which costs
+        'k' instructions, 2 for 'k == 0' and 3 for 'k == -1'.
+        """
+        if c in Arithmetic._chains:
+            return Arithmetic._chains[c]
+
+        if abs(c) > MAX_SEARCH:
+            chain = Arithmetic._binary_chain(c)
+        else:
+            chain = Arithmetic._search_chain(c)
+
+        Arithmetic._chains[c] = chain
+        return chain
+
+    @staticmethod
+    def _search_chain(c):
+        bound = 2 * abs(c) + 4
+        dist = { 1: 0 }
+        prev = {}
+        heap = [(0, 1)]
+
+        while len(heap) != 0:
+            (cost, n) = heapq.heappop(heap)
+            if n == c:
+                break
+            if cost > dist[n]:
+                continue
+
+            edges = [(n + 1, "add", 1), (n - 1, "sub", 1), (0, 0, 2), (-n, -1, 3)]
+            edges += [(n * k, k, k) for k in range(2, 9)]
+            for (m, step, step_cost) in edges:
+                if abs(m) > bound:
+                    continue
+                if m not in dist or cost + step_cost < dist[m]:
+                    dist[m] = cost + step_cost
+                    prev[m] = (n, step)
+                    heapq.heappush(heap, (cost + step_cost, m))
+
+        chain = []
+        n = c
+        while n != 1:
+            (n, step) = prev[n]
+            chain.append(step)
+        chain.reverse()
+        return chain
+
+    @staticmethod
+    def _binary_chain(c):
+        chain = []
+        for bit in bin(abs(c))[3:]:
+            chain.append(2)
+            if bit == "1":
+                chain.append("add")
+        if c < 0:
+            chain.append(-1)
+        return chain
+
+    @staticmethod
+    def div_levels(d):
+        """
+        Pick the strides for dividing by 'd' with subtraction loops.
+
+        Returns a list of multipliers 'm', largest first and always ending
+        with 1. Each one is a loop that subtracts 'd * m' from the
+        remainder and adds 'm' to the quotient, so the bigger strides
+        bound the number of iterations of the smaller ones.
+        """
+        if d in Arithmetic._levels:
+            return Arithmetic._levels[d]
+
+        limit = WORD_MAX // d
+        candidates = [[1]]
+        candidates += [[m, 1] for m in range(2, limit + 1)]
+        for m2 in range(2, min(limit, 40) + 1):
+            candidates += [[m1, m2, 1] for m1 in range(2 * m2, limit + 1, m2)]
+
+        best = min(candidates, key=lambda levels: (Arithmetic.div_cycles(d, levels), len(levels)))
+        Arithmetic._levels[d] = best
+        return best
+
+    @staticmethod
+    def div_cycles(d, levels):
+        """
+        The worst case number of cycles for the division loops
+        when the dividend is at most 'WORD_MAX'.
+        """
+        bound = WORD_MAX + 1
+        cycles = 0
+        for m in levels:
+            stride = d * m
+            cycles += ((bound - 1) // stride) * DIV_LOOP_CYCLES + DIV_LOOP_OVERHEAD
+            bound = stride
+        return cycles
@@ -1,6 +1,9 @@
 import os
 from compiler.executor import Executor
+from compiler.bytecode import Bytecode
+from compiler.stats import PipelineStats
 from compiler.error import AssemblerError, ParseError, ExtensionError
+from compiler.opcodes import encode
 
 class AsmExpression():
     def __init__(self, token, address=None):
@@ -13,17 +16,21 @@ class Assembler(Executor):
     instructions that can be understood by the 'Executor' class.
     """
 
-    def __init__(self, *, mem_size=100, testing=False):
+    def __init__(self, *, mem_size=100, testing=False, test_input=7, stats=None, banked=False,
+            accelerate=True):
         """
-        Set memory size
+        Set memory size, the time spent assembling and running
+        is added to 'stats'. With 'banked', 'mem_size' is the size of a bank.
+        Without 'accelerate' every loop is run one instruction at a time.
         """
         self.mem_size = mem_size
         self.testing = testing
-        super().__init__(testing=testing)
+        self.stats = PipelineStats() if stats is None else stats
+        super().__init__(testing=testing, test_input=test_input, banked=banked, accelerate=accelerate)
 
     def run(self, filename, read_from_file=False):
         """
-        Load from file
+        Load from file, either assembler ('.man') or bytecode ('.lmc')
         """
         path = os.path.abspath(filename)
         ext = os.path.splitext(path)[1]
@@ -34,6 +41,10 @@ class Assembler(Executor):
                 contents = f.read()
 
             return self.load(contents, read_from_file)
+        elif ext == ".lmc":
+            (bcode, mem_size, banked, prefix) = Bytecode.load(path, prefix=True)
+            self.banked = banked
+            return self._execute(bcode, mem_size, prefix)
         else:
             # Error unknown extension
             raise ExtensionError("Unknown extension: \'{0}\'".format(ext))
@@ -43,13 +54,49 @@ class Assembler(Executor):
         """
         Load from string
         """
-        exprs = self._interpret(string)
-        bcode = self._parse(exprs, decrement_adr=read_from_file)
+        bcode = self.assemble(string, read_from_file)
+        return self._execute(bcode, self.mem_size)
+
+
+    def _execute(self, bcode, mem_size, prefix=None):
+        with self.stats.phase("execute") as p:
+            output = self.execute_bytecode(bcode, mem_size, prefix=prefix)
+            p.items = self.cycles
+        return output
+
+
+    def assemble(self, string, read_from_file=False):
+        """
+        Turn a string of assembler into bytecode without running it
+        """
+        with self.stats.phase("assemble") as p:
+            exprs = self._interpret(string)
+            bcode = self._parse(exprs, decrement_adr=read_from_file)
+            p.items = len(bcode)
 
         # Print the new bytecode
         print("\nBytecode: [{0}]\n".format(",".join([str(b) for b in bcode])))
 
-        return self.execute_bytecode(bcode, self.mem_size)
+        return bcode
+
+
+    def encode(self, instructions):
+        """
+        Turn bound 'Instruction's into bytecode, with the same table as
+        assembler text, but without writing and reading the text.
+        """
+        with self.stats.phase("assemble") as p:
+            bcode = []
+            for idx, i in enumerate(instructions):
+                if i.invalidate_binding or i.invalidate_jump_bindings:
+                    raise AssemblerError("Unbound instruction: '{0}' Line: {1}".format(i.asm(), idx + 1))
+                bcode.append(encode(i.instruction, i.adr if i.has_adr else None, self.mem_size,
+                    line=idx + 1))
+            p.items = len(bcode)
+
+        print("\nBytecode: [{0}]\n".format(",".join([str(b) for b in bcode])))
+
+        return bcode
 
 
     def _interpret(self, string):
@@ -101,34 +148,9 @@ class Assembler(Executor):
         adr_decrement = 1 if decrement_adr else 0
 
         for idx, ex in enumerate(expressions):
-            token = ex.token
-            has_adr = ex.adr is not None
-            adr  = int(ex.adr) if has_adr else None
-
-            if token == "": continue # if we find an empty token, skip it
-
-            # Check if the instruction is missing an address
-            if not has_adr and token in ["ADD", "SUB", "STA", "LDA", "BRA", "BRZ", "BRP", "MEM"]:
-                raise ParseError("Expected address for instruction: '{0}' Line: {1}"
-                    .format(token, str(idx + 1)))
-
-            if   token == "ADD": bytecode.append((1 * self.mem_size) + adr - adr_decrement) # add X to AC
-            elif token == "SUB": bytecode.append((2 * self.mem_size) + adr - adr_decrement) # sub X from AC
-
-            elif token == "STA": bytecode.append((3 * self.mem_size)  + adr - adr_decrement) # Store AC in X
-            elif token == "LDA": bytecode.append((5 * self.mem_size)  + adr - adr_decrement) # Load X into AC
-
-            elif token == "BRA": bytecode.append((6 * self.mem_size)  + adr - adr_decrement) # Set PC to X
-            elif token == "BRZ": bytecode.append((7 * self.mem_size)  + adr - adr_decrement) # Set PC to X if AC=0
-            elif token == "BRP": bytecode.append((8 * self.mem_size)  + adr - adr_decrement) # Set PC to X if AC>0
-
-            elif token == "INP": bytecode.append((9 * self.mem_size) + 1) # Read input to AC
-            elif token == "OUT": bytecode.append((9 * self.mem_size) + 2) # Write output from AC
-
-            elif token == "MEM": bytecode.append(adr) # Reserve a memory slot with value==adr
-            elif token == "HLT": bytecode.append(000) # Exit
+            if ex.token == "": continue # if we find an empty token, skip it
 
-            else: # unknown token
-                raise ParseError("Unknown token: '{0}'".format(token))
+            bytecode.append(encode(ex.token, ex.adr, self.mem_size, decrement=adr_decrement,
+                line=idx + 1))
 
         return bytecode
@@ -0,0 +1,97 @@
+from compiler.instruction import Instruction
+from compiler.error import CompileError
+
+ADDRESSED = ["ADD", "SUB", "STA", "LDA", "BRA", "BRZ", "BRP"]
+
+class BankLayout:
+    """
+    Lays out a bound program over banks of 'mem_size' words.
+
+    The program is placed as it is, from bank 0 and on. An instruction
+    that addresses a word in another bank than its own gets a 'BNK'
+    in front of it, which selects the bank for that instruction only:
+
+            BNK 0
+            LDA 12      # reads word 12 of bank 0
+
+    A jump to the instruction lands on the 'BNK'. Adding a 'BNK' moves
+    the instructions after it, so it's repeated until nothing changes.
+    """
+
+    def __init__(self, mem_size=100):
+        self.mem_size = mem_size
+        self.prefixes = 0
+
+    def layout(self, instructions):
+        """
+        'instructions' have their addresses bound to indexes in the list,
+        returns the instructions with addresses within their banks.
+        """
+        targets = {}
+        for idx, inst in enumerate(instructions):
+            target = self._target(inst)
+            if target is not None:
+                targets[idx] = target
+
+        prefixed = set()
+        while True:
+            start = self._positions(len(instructions), prefixed)
+            # a 'MEM' is only read as a value, it needs no bank
+            added = [idx for (idx, target) in targets.items() if idx not in prefixed
+                and instructions[idx].instruction != "MEM"
+                and start[target] // self.mem_size != start[idx] // self.mem_size]
+            if len(added) == 0:
+                break
+            prefixed.update(added)
+
+        size = start[len(instructions)]
+        if size > self.mem_size * self.mem_size:
+            raise CompileError("The program needs {0} words of memory, but there is only {1}"
+                .format(size, self.mem_size * self.mem_size))
+
+        result = []
+        for idx, inst in enumerate(instructions):
+            if idx in targets:
+                position = start[targets[idx]]
+                if idx in prefixed:
+                    result.append(self._prefix(inst, position // self.mem_size))
+                if inst.instruction == "MEM" and inst.bank:
+                    inst.adr = inst.adr_offset + position // self.mem_size
+                else:
+                    inst.adr = inst.adr_offset + position % self.mem_size
+            result.append(inst)
+
+        self.prefixes = len(prefixed)
+        return result
+
+    def _target(self, inst):
+        """
+        returns the index that the instruction addresses, or None.
+        """
+        if inst.instruction == "MEM":
+            return inst.adr - inst.adr_offset if inst.jump is not None else None
+        if inst.instruction not in ADDRESSED or len(inst.targets) != 0:
+            # the address of a 'BRA' with targets is patched
+            # together with the 'BNK' in front of it.
+            return None
+        return inst.adr - inst.adr_offset
+
+    @staticmethod
+    def _positions(count, prefixed):
+        """
+        returns where every instruction, or its 'BNK', starts.
+        """
+        start = []
+        position = 0
+        for idx in range(count):
+            start.append(position)
+            position += 2 if idx in prefixed else 1
+        start.append(position)
+        return start
+
+    def _prefix(self, inst, bank):
+        prefix = Instruction("BNK", adr=bank, comment="bank")
+        # jumps to the instruction land on the 'BNK'
+        (prefix.is_jump_endpoint, prefix.jumps) = (inst.is_jump_endpoint, inst.jumps)
+        (inst.is_jump_endpoint, inst.jumps) = (False, [])
+        return prefix
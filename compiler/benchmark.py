@@ -0,0 +1,238 @@
+import contextlib, gc, io, json, math, platform
+from compiler.compiler import ScriptCompiler
+from compiler.assembler import Assembler
+from compiler.stats import PipelineStats
+
+# large enough for the biggest generated program
+MEM_SIZE = 10000
+
+# phases faster than this are too noisy to tell how they scale
+MIN_SCALING_SECONDS = 0.002
+
+# the phases that are compared, the rest is still recorded
+PHASES = ["tokenize", "parse", "codegen", "optimize", "bind_jumps", "assemble", "execute"]
+
+class Generator:
+    """
+    Synthetic programs for the benchmarks, each one grows with its argument.
+    """
+
+    @staticmethod
+    def statements(n):
+        """
+        'n' statements that assign and print a handful of variables.
+        """
+        lines = ["v{0} = 0;".format(v) for v in range(8)]
+        lines += ["read(v{0});".format(v) for v in range(8)]
+        for i in range(n):
+            if i % 4 == 3:
+                lines.append("print(v{0});".format(i % 8))
+            else:
+                lines.append("v{0} = v{1} + {2};".format(i % 8, (i + 3) % 8, i))
+        return "\n".join(lines)
+
+    @staticmethod
+    def nesting(d):
+        """
+        'if' blocks nested 'd' deep, with a statement on every level.
+        """
+        lines = ["x = 0;", "read(x);"]
+        for i in range(d):
+            lines.append("    " * i + "if (x) {")
+            lines.append("    " * (i + 1) + "x = x - 1;")
+            lines.append("    " * (i + 1) + "print(x);")
+        for i in reversed(range(d)):
+            lines.append("    " * i + "}")
+        return "\n".join(lines)
+
+    @staticmethod
+    def width(w):
+        """
+        one expression with 'w' operands.
+        """
+        names = ["a", "b", "c", "d"]
+        lines = ["{0} = 0; read({0});".format(n) for n in names]
+        terms = [names[i % len(names)] for i in range(w)]
+        ops = ["+", "-"]
+        expr = terms[0] + "".join([" {0} {1}".format(ops[i % 2], t) for i, t in enumerate(terms[1:])])
+        lines.append("x = {0};".format(expr))
+        lines.append("print(x);")
+        return "\n".join(lines)
+
+    @staticmethod
+    def man_loop(k):
+        """
+        hand-written assembler that loops 'k' times.
+        """
+        return "\n".join([
+            "LDA 8   # count",
+            "BRZ 6",
+            "SUB 9   # one",
+            "STA 8",
+            "BRA 1",
+            "OUT",
+            "HLT",
+            "MEM {0}".format(k),
+            "MEM 1"
+        ])
+
+
+# (name, generator, kind, sizes, quick sizes)
+SUITE = [
+    ("statements", Generator.statements, "script", [100, 200, 400], [50, 100]),
+    ("nesting", Generator.nesting, "script", [10, 20, 40], [5, 10]),
+    ("width", Generator.width, "script", [20, 40, 80], [10, 20]),
+    ("man_loop", Generator.man_loop, "man", [10000, 100000, 1000000], [1000, 10000]),
+]
+
+class Benchmark:
+    """
+    Runs the programs in 'SUITE' and measures every phase separately,
+    using the best of 'repeat' runs. Like 'timeit', the garbage
+    collector is turned off while a program runs.
+
+    The results has the seconds and items of every phase for every
+    program, and how each phase scales with the size of the programs,
+    as the exponent 'k' in 'time = size ** k'.
+
+    The programs run without the loop accelerator, so "execute" measures
+    the executor running every instruction.
+    """
+
+    def __init__(self, *, repeat=3, quick=False, opt_level=2):
+        self.repeat = repeat
+        self.quick = quick
+        self.opt_level = opt_level
+
+    def run(self):
+        results = {
+            "python": platform.python_version(),
+            "opt_level": self.opt_level,
+            "cases": {},
+            "scaling": {}
+        }
+
+        # warm up, the first compile is slower than the rest
+        (name, generator, kind, sizes, quick_sizes) = SUITE[0]
+        self.run_case(kind, generator(quick_sizes[0]))
+
+        for (name, generator, kind, sizes, quick_sizes) in SUITE:
+            sizes = quick_sizes if self.quick else sizes
+            for size in sizes:
+                case = "{0}_{1}".format(name, size)
+                results["cases"][case] = self.run_case(kind, generator(size))
+
+            results["scaling"][name] = self._scaling(results["cases"], name, sizes)
+
+        return results
+
+    def run_case(self, kind, source):
+        """
+        returns { phase: { "seconds": ..., "items": ... } } with the
+        best time of every phase.
+        """
+        best = {}
+        for n in range(self.repeat):
+            stats = PipelineStats()
+            gc.collect()
+            gc.disable()
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    if kind == "script":
+                        c = ScriptCompiler(testing=True, test_input=7, opt_level=self.opt_level,
+                            mem_size=MEM_SIZE, accelerate=False)
+                        c.compile(source)
+                        stats = c.stats
+                    else:
+                        a = Assembler(testing=True, stats=stats, accelerate=False)
+                        a.load(source, read_from_file=True)
+            finally:
+                gc.enable()
+
+            for p in stats.phases.values():
+                if p.name not in best or p.seconds < best[p.name]["seconds"]:
+                    best[p.name] = { "seconds": p.seconds, "items": p.items }
+
+        return best
+
+    def _scaling(self, cases, name, sizes):
+        first = cases["{0}_{1}".format(name, sizes[0])]
+        last = cases["{0}_{1}".format(name, sizes[len(sizes) - 1])]
+
+        scaling = {}
+        for phase in first:
+            if phase in last and first[phase]["seconds"] >= MIN_SCALING_SECONDS \
+                    and last[phase]["seconds"] >= MIN_SCALING_SECONDS:
+                scaling[phase] = math.log(last[phase]["seconds"] / first[phase]["seconds"]) \
+                    / math.log(sizes[len(sizes) - 1] / sizes[0])
+        return scaling
+
+    @staticmethod
+    def save(results, filename):
+        with open(filename, "w") as f:
+            json.dump(results, f, indent=4)
+
+    @staticmethod
+    def load(filename):
+        with open(filename, "r") as f:
+            return json.load(f)
+
+    @staticmethod
+    def format(results):
+        lines = []
+        for case, phases in results["cases"].items():
+            lines.append(case)
+            for phase in PHASES:
+                if phase in phases:
+                    p = phases[phase]
+                    rate = p["items"] / p["seconds"] if p["seconds"] > 0 else 0
+                    lines.append("   {0:<12} {1:>10.3f} ms {2:>12.0f} items/s".format(
+                        phase, p["seconds"] * 1000, rate))
+        lines.append("scaling (time = size ** k)")
+        for name, scaling in results["scaling"].items():
+            lines.append("   {0:<12} ".format(name) + "  ".join(["{0} {1:.2f}".format(phase, k)
+                for phase, k in scaling.items() if phase in PHASES]))
+        return "\n".join(lines)
+
+
+class Comparator:
+    """
+    Compares benchmark results against a baseline.
+
+    A phase regressed if it got 'threshold' times slower, and at least
+    'min_seconds' slower, or if it scales worse by more than 'max_slope'.
+    """
+
+    def __init__(self, baseline, *, threshold=1.5, min_seconds=0.002, max_slope=0.3):
+        self.baseline = baseline
+        self.threshold = threshold
+        self.min_seconds = min_seconds
+        self.max_slope = max_slope
+
+    def compare(self, results):
+        """
+        returns a list of the regressions, as strings.
+        """
+        regressions = []
+
+        for case, phases in results["cases"].items():
+            base = self.baseline["cases"].get(case)
+            if base is None:
+                continue
+            for phase in PHASES:
+                if phase not in phases or phase not in base:
+                    continue
+                now = phases[phase]["seconds"]
+                before = base[phase]["seconds"]
+                if now > before * self.threshold and now - before > self.min_seconds:
+                    regressions.append("{0} {1}: {2:.3f} ms -> {3:.3f} ms ({4:.1f}x slower)".format(
+                        case, phase, before * 1000, now * 1000, now / before))
+
+        for name, scaling in results["scaling"].items():
+            base = self.baseline["scaling"].get(name, {})
+            for phase in PHASES:
+                if phase in scaling and phase in base and scaling[phase] > base[phase] + self.max_slope:
+                    regressions.append("{0} {1}: scales as size ** {2:.2f}, was size ** {3:.2f}".format(
+                        name, phase, scaling[phase], base[phase]))
+
+        return regressions
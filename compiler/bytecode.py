@@ -0,0 +1,86 @@
+import os, struct
+from compiler.error import AssemblerError, ExtensionError
+from compiler.prefix import Prefix
+
+MAGIC = b"LMC\x01"
+MAGIC_BANKED = b"LMC\x02" # the program uses banked memory
+MAGIC_PREFIX = b"LMC\x03" # the program was run ahead to its first input
+HEADER = "<4sHI" # magic, memory size and the number of words
+PREFIX = "<HII" # where the program starts, the cycles run ahead and the number of outputs
+WORD = "<i"
+
+class Bytecode:
+    """
+    Reads and writes packed bytecode files ('.lmc'), so a program can be
+    compiled once and run many times without being assembled again.
+
+    The file starts with 'MAGIC' (or 'MAGIC_BANKED'), the memory size and
+    the number of words, followed by the words as signed 32-bit little-endian
+    integers.
+
+    A program with a 'Prefix' starts with 'MAGIC_PREFIX', and the words
+    are the memory after the prefix. They are followed by 'PREFIX' and
+    the output of the prefix, as words as well. Banked programs are never
+    run ahead.
+    """
+
+    @staticmethod
+    def pack(words, mem_size=100, banked=False, prefix=None):
+        magic = MAGIC_BANKED if banked else MAGIC if prefix is None else MAGIC_PREFIX
+        data = struct.pack(HEADER, magic, mem_size, len(words))
+        try:
+            data += b"".join([struct.pack(WORD, w) for w in words])
+            if prefix is not None:
+                data += struct.pack(PREFIX, prefix.start, prefix.cycles, len(prefix.output))
+                data += b"".join([struct.pack(WORD, v) for v in prefix.output])
+            return data
+        except struct.error:
+            raise AssemblerError("A word does not fit in 32 bits")
+
+    @staticmethod
+    def unpack(data, *, prefix=False):
+        """
+        returns the words, the memory size and if the memory is banked,
+        and the 'Prefix' or None as well with 'prefix'.
+        """
+        size = struct.calcsize(HEADER)
+        if len(data) < size:
+            raise AssemblerError("Not a bytecode file")
+
+        (magic, mem_size, count) = struct.unpack(HEADER, data[:size])
+        if magic not in [MAGIC, MAGIC_BANKED, MAGIC_PREFIX]:
+            raise AssemblerError("Not a bytecode file")
+        end = size + count * struct.calcsize(WORD)
+        if len(data) < end or (len(data) != end and magic != MAGIC_PREFIX):
+            raise AssemblerError("Expected {0} words of bytecode".format(count))
+
+        words = [w for (w,) in struct.iter_unpack(WORD, data[size:end])]
+        result = (words, mem_size, magic == MAGIC_BANKED)
+        if not prefix:
+            return result
+
+        p = None
+        if magic == MAGIC_PREFIX:
+            header = struct.calcsize(PREFIX)
+            if len(data) < end + header:
+                raise AssemblerError("Expected the output of the prefix")
+            (start, cycles, outputs) = struct.unpack(PREFIX, data[end:end + header])
+            if len(data) != end + header + outputs * struct.calcsize(WORD):
+                raise AssemblerError("Expected {0} outputs of the prefix".format(outputs))
+            output = [v for (v,) in struct.iter_unpack(WORD, data[end + header:])]
+            p = Prefix(start, words, output, cycles)
+        return result + (p,)
+
+    @staticmethod
+    def save(filename, words, mem_size=100, banked=False, prefix=None):
+        with open(filename, "wb") as f:
+            f.write(Bytecode.pack(words, mem_size, banked, prefix))
+
+    @staticmethod
+    def load(filename, *, prefix=False):
+        ext = os.path.splitext(filename)[1]
+        if ext != ".lmc":
+            raise ExtensionError("Unknown extension: \'{0}\'".format(ext))
+
+        with open(filename, "rb") as f:
+            return Bytecode.unpack(f.read(), prefix=prefix)
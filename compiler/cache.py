@@ -0,0 +1,104 @@
+import copy, threading
+from compiler.instruction import Instruction, JumpFlag
+from compiler.memory import Memory
+
+class CacheEntry:
+    def __init__(self, code, memory, constants, statement=None):
+        self.code = code
+        self.memory = memory
+        self.constants = constants
+        # the 'Expression' the code was generated for
+        self.statement = statement
+
+
+class StatementCache:
+    """
+    Remembers the code generated for top-level statements, so that
+    compiling a script again only generates code for the statements
+    that changed, or that depend on something that changed.
+
+    The key of a statement is made by the compiler from its tokens and
+    the state it depends on. An entry holds the code, the memory
+    references the statement added and the constants it left behind.
+    The temps and jumps are given new names every time the code is used.
+
+    A cache can be shared by compilers running in different threads.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.used = set()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def lookup(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.used.add(key)
+            return entry
+
+    def store(self, key, code, memory, constants, statement=None):
+        """
+        'memory' is a list of (name, reference) for the references that
+        was added, 'constants' a list of (name, value or None).
+        """
+        entry = CacheEntry(self._copy(code, {}),
+            [(name, dict(ref)) for (name, ref) in memory], constants, statement)
+        with self.lock:
+            self.entries[key] = entry
+            self.used.add(key)
+
+    def replay(self, entry, memory):
+        """
+        add the memory references of an entry and
+        returns a copy of its code with new names.
+        """
+        names = {}
+        for (name, ref) in entry.memory:
+            if Memory.is_temp_name(name):
+                names[name] = memory.gen_temp_name()
+            memory.add_reference(names.get(name, name), ref["value"])
+        return self._copy(entry.code, names, memory)
+
+    def prune(self):
+        """
+        forget the statements that were not used since the last prune.
+        """
+        with self.lock:
+            self.entries = { k: v for k, v in self.entries.items() if k in self.used }
+            self.used = set()
+
+    def _copy(self, code, names, memory=None):
+        """
+        copy the code, the jumps get new names from 'memory' if it's given.
+        """
+        jumps = {}
+        def jump_name(alias):
+            if memory is None or alias is None:
+                return alias
+            if alias not in jumps:
+                jumps[alias] = memory.gen_jump_name()
+            return jumps[alias]
+
+        result = []
+        for inst in code:
+            if isinstance(inst, JumpFlag):
+                result.append(JumpFlag(jump_name(inst.alias)))
+                continue
+
+            i = copy.copy(inst)
+            i.variable = names.get(inst.variable, inst.variable)
+            i.jump = jump_name(inst.jump)
+            i.jumps = [JumpFlag(jump_name(j.alias)) for j in inst.jumps]
+            i.targets = [jump_name(alias) for alias in inst.targets]
+            i.flags = list(inst.flags)
+            result.append(i)
+        return result
+
+    def __str__(self):
+        return "Cache: {0} statements reused, {1} generated".format(self.hits, self.misses)
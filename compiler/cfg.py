@@ -0,0 +1,106 @@
+BRANCHES = ["BRA", "BRZ", "BRP"]
+
+class BasicBlock:
+    """
+    A run of instructions that is always executed from the first
+    to the last instruction, with no jumps in or out of the middle.
+    """
+
+    def __init__(self, index, instructions):
+        self.index = index
+        self.instructions = instructions
+        self.successors = []
+        self.predecessors = []
+
+    @property
+    def last(self):
+        return self.instructions[len(self.instructions) - 1]
+
+    def __str__(self):
+        return "<block {0}: {1} instructions, successors: {2}>".format(self.index,
+            len(self.instructions), ",".join([str(b.index) for b in self.successors]))
+
+
+class ControlFlowGraph:
+    """
+    Control-flow graph over a list of 'Instruction' where the JumpFlags
+    have been merged into the instructions, but before the jumps are bound.
+    """
+
+    def __init__(self, instructions):
+        self.blocks = []
+        self.entry = None
+        self._build(list(instructions))
+
+    def _build(self, instructions):
+        if len(instructions) == 0:
+            return
+
+        # find the first instruction of every block
+        leaders = set([0])
+        for idx, inst in enumerate(instructions):
+            if inst.is_jump_endpoint:
+                leaders.add(idx)
+            if inst.instruction in BRANCHES or inst.instruction == "HLT":
+                if idx + 1 < len(instructions):
+                    leaders.add(idx + 1)
+
+        starts = sorted(leaders)
+        for n, start in enumerate(starts):
+            end = starts[n + 1] if n + 1 < len(starts) else len(instructions)
+            self.blocks.append(BasicBlock(n, instructions[start:end]))
+
+        labels = {}
+        for block in self.blocks:
+            for j in block.instructions[0].jumps:
+                labels[j.alias] = block
+
+        for n, block in enumerate(self.blocks):
+            last = block.last
+            targets = []
+
+            if self.is_branch(last):
+                targets.append(labels[last.jump])
+            # a target can be gone if the code that returns there was unreachable
+            targets.extend([labels[alias] for alias in last.targets if alias in labels])
+
+            falls_through = last.instruction not in ["BRA", "HLT"]
+            if falls_through and n + 1 < len(self.blocks):
+                targets.append(self.blocks[n + 1])
+
+            for t in targets:
+                if t not in block.successors:
+                    block.successors.append(t)
+                    t.predecessors.append(block)
+
+        self.entry = self.blocks[0]
+
+    @staticmethod
+    def is_branch(inst):
+        return inst.instruction in BRANCHES and inst.jump is not None
+
+    def reachable(self):
+        """
+        returns the set of blocks that can be reached from the entry.
+        """
+        if self.entry is None:
+            return set()
+
+        seen = set([self.entry])
+        stack = [self.entry]
+        while len(stack) != 0:
+            block = stack.pop()
+            for s in block.successors:
+                if s not in seen:
+                    seen.add(s)
+                    stack.append(s)
+        return seen
+
+    def instructions(self):
+        """
+        returns all the instructions in their original order.
+        """
+        return [inst for block in self.blocks for inst in block.instructions]
+
+    def __str__(self):
+        return "\n".join([str(b) for b in self.blocks])
@@ -1,25 +1,125 @@
 # -*- coding: utf-8 -*-
 import os, inspect
-from compiler.error import AssemblerError, ParseError, ExtensionError
+from compiler.error import AssemblerError, ParseError, ExtensionError, CompileError, SizeError
 from compiler.executor import Executor
 from compiler.tokenizer import Tokenizer, Token
-from compiler.token import TokenType, SYMBOLS, KEYWORDS
+from compiler.token import TokenType, SYMBOLS, KEYWORDS, COMPARISONS
 from compiler.assembler import Assembler
+from compiler.bytecode import Bytecode
 from compiler.expression import Stack, Expression, ExpressionSolver
 from compiler.instruction import Instruction, AsmExpressionContainer, JumpFlag
 from compiler.memory import Memory
+from compiler.peephole import PeepholeOptimizer
+from compiler.globalopt import GlobalOptimizer
+from compiler.outline import Outliner
+from compiler.banks import BankLayout
+from compiler.estimate import CycleEstimator
+from compiler.prefix import PrefixEvaluator
+from compiler.sourcemap import SourceMap, SourceProfiler
+from compiler.function import Function
+from compiler.cache import StatementCache
+from compiler.context import CompileContext
+from compiler.stats import PipelineStats
 from compiler.utils import Utils
 
 class ScriptCompiler(Executor):
 
-    def __init__(self, *, testing=False):
+    def __init__(self, *, testing=False, test_input=7, opt_level=2, peephole=None, opt_size=False,
+            cache=None, trace_memory=False, mem_size=100, banked=False, partial_eval=None,
+            accelerate=True):
+        """
+        opt_level 0: no optimizations.
+        opt_level 1: constant folding and the peephole optimizer.
+        opt_level 2: dead code elimination, copy propagation and
+                     removal of unreachable code as well.
+
+        From opt_level 1, repeated code is moved into subroutines if the
+        program does not fit in memory, or always with 'opt_size'. A
+        program that still doesn't fit is compiled again with the smaller
+        and slower code for dividing by constants, which 'opt_size' always
+        uses.
+
+        The code of every top-level statement is kept in 'cache', so
+        compiling an edited script again only generates code for what
+        changed. A 'StatementCache' can be shared between compilers.
+
+        The state of a compilation is kept in a new 'CompileContext' for
+        every compile, so the output only depends on the script. A
+        compiler runs one compilation at a time, but any number of
+        compilers can run in parallel threads.
+
+        The time spent in every phase is kept in 'stats', with the peak
+        memory allocated if 'trace_memory' is set.
+
+        'mem_size' is the number of words of memory, the instructions
+        are encoded as 'opcode * mem_size + address'.
+
+        With 'banked' there are up to 'mem_size' banks of 'mem_size' words,
+        and the program is laid out over as many as it needs. Code is not
+        moved into subroutines then, since it doesn't have to fit.
+
+        With 'partial_eval', from opt_level 1, the program is run up to
+        its first input when it's compiled, see 'PrefixEvaluator'. Running
+        it and bytecode start from there, assembler is not run ahead.
+
+        Without 'accelerate' the program is run one instruction at a time,
+        the loops are not skipped ahead, see 'Executor'.
+        """
         self.testing = testing
+        self.testing_output = test_input
         self.debug = False
-        self.mem = Memory()
+        self.opt_level = opt_level
+        self.opt_size = opt_size
+        self.mem_size = mem_size
+        self.banked = banked
+        self.use_peephole = opt_level >= 1 if peephole is None else peephole
+        self.partial_eval = opt_level >= 1 and not banked if partial_eval is None else partial_eval
+        self.cache = StatementCache() if cache is None else cache
+        self.trace_memory = trace_memory
+        self.accelerate = accelerate
+        self._reset()
+
+    def _reset(self):
+        """
+        forget everything from the last compilation, except the cache.
+        """
+        self.peephole_stats = None
+        self.global_stats = None
+        self.outline_stats = None
+        self.estimate = None
+        self.prefix = None
+        self.source_map = None
+        self.cycles = 0
         self.jump_table = {}
         self.solver = ExpressionSolver()
+        self.instructions = []
+        self.context = CompileContext()
+        self.stats = PipelineStats(trace_memory=self.trace_memory)
+
+    # the state of the current compilation
+
+    @property
+    def mem(self): return self.context.memory
+
+    @property
+    def constants(self): return self.context.constants
+
+    @constants.setter
+    def constants(self, value): self.context.constants = value
+
+    @property
+    def functions(self): return self.context.functions
+
+    @property
+    def call_stack(self): return self.context.call_stack
 
-    def compile_from_file(self, filename, *, debug=False):
+    @property
+    def loop_depth(self): return self.context.loop_depth
+
+    @loop_depth.setter
+    def loop_depth(self, value): self.context.loop_depth = value
+
+    def compile_from_file(self, filename, *, debug=False, report=False):
         path = os.path.abspath(filename)
         ext = os.path.splitext(path)[1]
 
@@ -27,28 +127,161 @@ class ScriptCompiler(Executor):
             raise ExtensionError("Unknown extension: \'{0}\'".format(ext))
 
         with open(path, "r") as f:
-            return self.compile(f.read(), debug=debug)
+            return self.compile(f.read(), debug=debug, report=report)
 
 
-    def compile(self, string, *, debug=False):
+    def compile(self, string, *, debug=False, report=False):
+        """
+        Compile and run a script.
+
+        With 'report' the program is also run without the peephole
+        optimizer, with the same input, to find the cycles it saved.
+        """
+        bcode = self._evaluate(self._compile(string, debug=debug))
+
+        a = Assembler(mem_size=self.mem_size, testing=self.testing, test_input=self.testing_output,
+            stats=self.stats, banked=self.banked, accelerate=self.accelerate)
+        output = a._execute(bcode, self.mem_size, self.prefix)
+        self.cycles = a.cycles
+
+        if report and self.peephole_stats is not None:
+            self._measure_peephole(string, a.inputs)
+
+        return output
+
+
+    def compile_with_stats(self, string, *, debug=False):
+        """
+        Compile and run a script, returns the output and the 'PipelineStats'.
+        """
+        output = self.compile(string, debug=debug)
+        return output, self.stats
+
+
+    def profile(self, string, *, debug=False):
+        """
+        Compile and run a script, with the cycles and the memory
+        traffic of every line counted. Returns the output and the
+        'SourceProfiler'.
+        """
+        bcode = self._compile(string, debug=debug)
+
+        profiler = SourceProfiler(self.source_map, self.mem_size, banked=self.banked)
+        e = Executor(testing=self.testing, test_input=self.testing_output, banked=self.banked)
+        with self.stats.phase("execute") as p:
+            output = profiler.run(e, bcode)
+            p.items = e.cycles
+        self.cycles = e.cycles
+        return output, profiler
+
+
+    def compile_to_asm(self, string, *, debug=False):
+        """
+        Compile a script without running it.
+
+        Returns the assembler with the lines starting at 1, like
+        the '.man' files that 'Assembler.run' reads.
+        """
+        self._compile(string, debug=debug)
+        return "\n".join([i.asm(line_margin=1) for i in self.instructions]) + "\n"
+
+
+    def compile_to_bytecode(self, string, *, debug=False):
+        """
+        Compile a script without running it, returns the bytecode.
+        """
+        return self._compile(string, debug=debug)
+
+
+    def emit_from_file(self, filename, output, *, debug=False):
+        """
+        Compile a script and write it to 'output' without running it,
+        as assembler if it ends with '.man' or bytecode if it ends with '.lmc'.
+        """
+        path = os.path.abspath(filename)
+        ext = os.path.splitext(path)[1]
+        if ext != ".script":
+            raise ExtensionError("Unknown extension: \'{0}\'".format(ext))
+
+        with open(path, "r") as f:
+            string = f.read()
+
+        out_ext = os.path.splitext(output)[1]
+        if out_ext == ".man":
+            with open(output, "w") as f:
+                f.write(self.compile_to_asm(string, debug=debug))
+        elif out_ext == ".lmc":
+            bcode = self._evaluate(self.compile_to_bytecode(string, debug=debug))
+            Bytecode.save(output, bcode, self.mem_size, self.banked, self.prefix)
+        else:
+            raise ExtensionError("Unknown extension: \'{0}\'".format(out_ext))
+
+
+    def _evaluate(self, bcode):
+        """
+        run the bytecode ahead to its first input, with 'partial_eval'.
+        returns the memory there, the 'Prefix' is kept in 'prefix'.
+        """
+        if not self.partial_eval or self.banked:
+            return bcode
+
+        with self.stats.phase("evaluate") as p:
+            self.prefix = PrefixEvaluator(self.mem_size).evaluate(bcode)
+            p.items = 0 if self.prefix is None else self.prefix.cycles
+        if self.prefix is None:
+            return bcode
+        print("\n" + str(self.prefix))
+        return self.prefix.memory
+
+
+    def _compile(self, string, *, debug=False):
+        """
+        Compile a script into bytecode.
+        """
         self.debug = debug
+        self._reset()
 
         # Read file contents and interpret it
         t = Tokenizer()
         t.load(string)
 
-        self.tokens = t.tokenize()
+        with self.stats.phase("tokenize") as p:
+            self.tokens = t.tokenize()
+            p.items = len(self.tokens)
 
         print("\nTokens:")
         for t in self.tokens: print("   {0}\t\t{1}".format(str(t.value), str(t.token)))
 
-        (exprs, asm) = self._parse(self.tokens)
+        self.solver.arithmetic.compact = self.opt_size
+        try:
+            (exprs, instructions) = self._parse(self.tokens)
+        except SizeError as e:
+            # dividing by constants with several loops is fast but large,
+            # try again with one loop for each if that was the difference
+            if self.solver.arithmetic.expanded == 0:
+                raise e
+            print("\n{0}, dividing with one loop instead".format(str(e)))
+            stats = self.stats
+            self._reset()
+            self.stats = stats
+            self.solver.arithmetic.compact = True
+            (exprs, instructions) = self._parse(self.tokens)
+        if instructions is None:
+            raise CompileError("The program could not be bound to memory")
 
-        a = Assembler(mem_size=100, testing=self.testing)
-        output = a.load(asm)
+        # encoded directly, the assembler text is only made when asked for
+        return Assembler(mem_size=self.mem_size, stats=self.stats, banked=self.banked).encode(instructions)
 
 
-        return output
+    def _measure_peephole(self, string, inputs):
+        baseline = ScriptCompiler(testing=True, test_input=list(inputs),
+            opt_level=self.opt_level, peephole=False, mem_size=self.mem_size, banked=self.banked,
+            accelerate=self.accelerate)
+        baseline.compile(string)
+
+        self.peephole_stats.cycles_before = baseline.cycles
+        self.peephole_stats.cycles_after = self.cycles
+        print("\n" + str(self.peephole_stats))
 
 
     def _print_expr_tree(self, exprs, prefix=""):
@@ -149,42 +382,55 @@ class ScriptCompiler(Executor):
         result variable into the reference.
         """
         identifier = str(ex.tokens[0].value)
-        # skip the identifier and the '=' char
-        relevant_tokens = ex.tokens[2:]
-
         asm = AsmExpressionContainer(ex)
 
+        # skip the identifier and the '=' char
+        self._check_no_comparison(ex.tokens[2:])
+        relevant_tokens = self._lower_calls(ex.tokens[2:], asm)
+
+        if not self.mem.has_reference(identifier) and self._runs_repeatedly():
+            # the initial value in memory is only set once, but the
+            # assignment has to happen every time the code runs.
+            self.mem.add_reference(identifier)
+
+        value = self._fold(relevant_tokens)
+        if value is not None:
+            relevant_tokens = [Token(str(value), TokenType.Identifier)]
+            self.constants[identifier] = value
+        else:
+            self.constants.pop(identifier, None)
+
         # reference does not exist
         if not self.mem.has_reference(identifier):
-            if len(relevant_tokens) == 1 and relevant_tokens[0].value.isdigit():
+            if len(relevant_tokens) == 1 and Utils.is_int(relevant_tokens[0].value):
                 # one token that is an int value
                 self.mem.add_reference(identifier, relevant_tokens[0].value)
             elif len(relevant_tokens) == 1 and self.mem.has_reference(relevant_tokens[0].value):
-                # one token that is an identifier
-                self.mem.add_reference(identifier, self.mem.get_reference(relevant_tokens[0].value))
+                # one token that is an identifier, copy it at runtime
+                self.mem.add_reference(identifier)
+                asm.load(str(relevant_tokens[0].value))
+                asm.store(identifier)
             else:
                 # several tokens, let's solve it
                 self.mem.add_reference(identifier)
-                instructions = self.solver.gen_runtime_expression(relevant_tokens,
-                    self.mem, result_var=identifier)
+                instructions = self._gen_expression(relevant_tokens, identifier)
                 asm.merge(instructions)
 
         # reference exists
         else:
-            temp = Memory.gen_temp_name()
+            temp = self.mem.gen_temp_name()
             #self.mem.add_reference(temp)
 
-            if len(relevant_tokens) == 1 and relevant_tokens[0].value.isdigit():
+            if len(relevant_tokens) == 1 and Utils.is_int(relevant_tokens[0].value):
                 # one token that is an int value
                 self.mem.add_reference(temp, relevant_tokens[0].value)
             elif len(relevant_tokens) == 1 and self.mem.has_reference(relevant_tokens[0].value):
-                # one token that is an identifier
-                self.mem.add_reference(temp, self.mem.get_reference(relevant_tokens[0].value))
+                # one token that is an identifier, copy it at runtime
+                temp = str(relevant_tokens[0].value)
             else:
                 # several tokens, let's solve it
                 self.mem.add_reference(temp)
-                instructions = self.solver.gen_runtime_expression(relevant_tokens,
-                    self.mem, result_var=temp)
+                instructions = self._gen_expression(relevant_tokens, temp)
                 asm.merge(instructions)
 
             # the 'temp' variabel may be loaded in the
@@ -200,21 +446,68 @@ class ScriptCompiler(Executor):
         relevant_tokens = ex.tokens[2:len(ex.tokens)-1]
 
         asm = AsmExpressionContainer(ex)
+
+        comparison = self._split_comparison(relevant_tokens)
+        value = self._fold_condition(relevant_tokens, comparison)
+        if value == 0:
+            # the block can never run, so drop its code
+            self._declare_block(ex)
+            return asm
+        elif value is not None:
+            # the block always runs, so there is nothing to test
+            self._handle_block(ex, asm)
+            return asm
+
+        jp_name = self.mem.gen_jump_name()
+        if comparison is not None:
+            self._gen_comparison(comparison, asm, jp_name, when=False)
+        else:
+            self._gen_condition(relevant_tokens, asm)
+            asm.add(Instruction("BRZ", jump=jp_name, comment="jump if zero"))
+
+        # the block may or may not run, so only the constants
+        # that are the same on both paths survive it.
+        before = dict(self.constants)
+        self._handle_block(ex, asm)
+        self._merge_constants(before)
+
+        asm.add(JumpFlag(jp_name))
+
+        return asm
+
+
+    def _declare_block(self, ex):
+        """
+        compile a block that never runs and throw the code away. The
+        variables it assigns first are still declared, with the same
+        initial values as when the block is compiled without folding.
+        """
+        before = dict(self.constants)
+        self._handle_block(ex, AsmExpressionContainer(ex))
+        self.constants = before
+
+
+    def _gen_condition(self, relevant_tokens, asm):
+        """
+        generate the assembly that loads the value of a
+        condition into the AC, and add it to 'asm'.
+        """
         result_var = ""
+        relevant_tokens = self._lower_calls(relevant_tokens, asm)
 
         if len(relevant_tokens) == 1 and relevant_tokens[0].token == TokenType.Identifier \
-                and not relevant_tokens[0].value.isdigit():
+                and not Utils.is_int(relevant_tokens[0].value):
             # single token with a value, should be dynamic
             #print("IT'S AN IDENTIFIER")
             var_name = str(relevant_tokens[0].value)
             result_var = var_name
             #self.mem.add_reference(temp, self.mem.get_reference(relevant_tokens[0].value))
         else:
-            temp = Memory.gen_temp_name()
+            temp = self.mem.gen_temp_name()
             #val = int(self.solver.solve_expr(ex.tokens[2:len(ex.tokens)-1], self.mem, None))
             #ex.value = val
             #var_name = add_mem_ref(val)
-            if len(relevant_tokens) == 1 and relevant_tokens[0].value.isdigit():
+            if len(relevant_tokens) == 1 and Utils.is_int(relevant_tokens[0].value):
                 # one token that is an int value
                 self.mem.add_reference(temp, relevant_tokens[0].value)
             elif len(relevant_tokens) == 1 and self.mem.has_reference(relevant_tokens[0].value):
@@ -224,46 +517,254 @@ class ScriptCompiler(Executor):
             else:
                 # several tokens, let's solve it
                 self.mem.add_reference(temp)
-                instructions = self.solver.gen_runtime_expression(relevant_tokens,
-                    self.mem, result_var=temp)
+                instructions = self._gen_expression(relevant_tokens, temp)
                 asm.merge(instructions)
             result_var = temp
 
-
         asm.load(result_var)
-        #print("a.load(var_name); == " + var_name)
-        jp_name = Memory.gen_jump_name()
-        #asm.load(temp)
-        asm.add(Instruction("BRZ", jump=jp_name, comment="jump if zero"))
 
+
+    def _split_comparison(self, tokens):
+        """
+        returns '(operator, left, right)' if the condition compares
+        two expressions, otherwise None.
+        """
+        found = None
+        depth = 0
+        for idx, t in enumerate(tokens):
+            if t.token == TokenType.LParen:
+                depth += 1
+            elif t.token == TokenType.RParen:
+                depth -= 1
+            elif t.token in COMPARISONS.values():
+                if depth != 0 or found is not None:
+                    raise CompileError("A condition can only have one comparison, "
+                        + "and it can't be inside parentheses")
+                found = idx
+
+        if found is None:
+            return None
+        if found == 0 or found == len(tokens) - 1:
+            raise CompileError("\'{0}\' needs a value on both sides".format(tokens[found].value))
+        return (tokens[found].token, tokens[:found], tokens[found + 1:])
+
+
+    def _fold_condition(self, tokens, comparison):
+        """
+        returns the value of a condition if it's known at compile time,
+        a comparison is 1 if it holds and 0 if it doesn't.
+        """
+        if comparison is None:
+            return self._fold(tokens)
+
+        (op, left, right) = comparison
+        (a, b) = (self._fold(left), self._fold(right))
+        if a is None or b is None:
+            return None
+        holds = {
+            TokenType.EqualTo: a == b,
+            TokenType.NotEqualTo: a != b,
+            TokenType.LessThan: a < b,
+            TokenType.GreaterThan: a > b,
+            TokenType.LessOrEqual: a <= b,
+            TokenType.GreaterOrEqual: a >= b
+        }[op]
+        return 1 if holds else 0
+
+
+    def _gen_comparison(self, comparison, asm, target, *, when):
+        """
+        jump to 'target' if the comparison is 'when', and fall through
+        otherwise. The difference of the two sides is computed in the AC
+        and tested directly, no boolean is stored:
+
+            a == b, a != b:     a - b, BRZ
+            a > b, a <= b:      a - b, BRP
+            a < b, a >= b:      b - a, BRP
+
+        '==' and '>' jump when 'when' is True, the others when it's False,
+        and the rest takes a 'BRA' around the branch.
+        """
+        (op, left, right) = comparison
+        if op in [TokenType.LessThan, TokenType.GreaterOrEqual]:
+            (left, right) = (right, left)
+        if op in [TokenType.NotEqualTo, TokenType.LessOrEqual, TokenType.GreaterOrEqual]:
+            when = not when
+        branch = "BRZ" if op in [TokenType.EqualTo, TokenType.NotEqualTo] else "BRP"
+
+        if self._fold(right) == 0:
+            difference = left
+        else:
+            difference = left + [Token("-", TokenType.Sub), Token("(", TokenType.LParen)] \
+                + right + [Token(")", TokenType.RParen)]
+        self._gen_condition(difference, asm)
+
+        if when:
+            asm.add(Instruction(branch, jump=target, comment="jump if {0}".format(
+                "zero" if branch == "BRZ" else "positive")))
+        else:
+            skip = self.mem.gen_jump_name()
+            asm.add(Instruction(branch, jump=skip))
+            asm.add(Instruction("BRA", jump=target, comment="jump if not {0}".format(
+                "zero" if branch == "BRZ" else "positive")))
+            asm.add(JumpFlag(skip))
+
+
+    def _check_no_comparison(self, tokens):
+        if any([t.token in COMPARISONS.values() for t in tokens]):
+            raise CompileError("Comparisons can only be used in 'if' and 'while' conditions")
+
+
+    def _gen_expression(self, tokens, result_var):
+        """
+        returns the code that computes 'tokens' into 'result_var', from
+        opt_level 1 with the value kept in the AC between operators.
+        """
+        self._check_no_comparison(tokens)
+        if self.opt_level >= 1:
+            return self.solver.gen_tree_expression(tokens, self.mem, result_var=result_var,
+                constants=self._known_constants())
+        return self.solver.gen_runtime_expression(tokens, self.mem, result_var=result_var,
+            constants=self._known_constants())
+
+
+    def _handle_while(self, ex):
+        """
+        the loop is rotated so the test is at the bottom:
+
+                BRA test
+            top:
+                <block>
+            test:
+                <condition>
+                BRP top
+                BRZ exit
+                BRA top
+            exit:
+
+        a positive condition takes one branch per iteration.
+        """
+        relevant_tokens = ex.tokens[2:len(ex.tokens)-1]
+        asm = AsmExpressionContainer(ex)
+
+        # whatever the loop assigns is not known at the test
+        for name in self._assigned_names(ex.expressions):
+            self.constants.pop(name, None)
+        before = dict(self.constants)
+
+        comparison = self._split_comparison(relevant_tokens)
+        value = self._fold_condition(relevant_tokens, comparison)
+        if value == 0:
+            # the block can never run, so drop its code
+            self.loop_depth += 1
+            self._declare_block(ex)
+            self.loop_depth -= 1
+            return asm
+
+        top = self.mem.gen_jump_name()
+        test = self.mem.gen_jump_name()
+        end = self.mem.gen_jump_name()
+
+        if value is None:
+            asm.add(Instruction("BRA", jump=test, comment="jump to loop test"))
+
+        asm.add(JumpFlag(top))
+        self.loop_depth += 1
+        self._handle_block(ex, asm)
+        self.loop_depth -= 1
+
+        if value is None and comparison is not None:
+            asm.add(JumpFlag(test))
+            self._gen_comparison(comparison, asm, top, when=True)
+        elif value is None:
+            asm.add(JumpFlag(test))
+            self._gen_condition(relevant_tokens, asm)
+            asm.add(Instruction("BRP", jump=top, comment="loop if positive"))
+            asm.add(Instruction("BRZ", jump=end, comment="exit if zero"))
+            asm.add(Instruction("BRA", jump=top, comment="loop if negative"))
+            asm.add(JumpFlag(end))
+        else:
+            asm.add(Instruction("BRA", jump=top, comment="loop forever"))
+
+        # the loop is only left from the test, where
+        # the constants are the same as before the loop.
+        self.constants = before
+
+        return asm
+
+
+    def _assigned_names(self, exprs):
+        """
+        returns the set of identifiers that are assigned or read
+        into in a list of expressions, including nested blocks.
+        """
+        names = set()
+        for e in exprs:
+            if len(e.tokens) >= 2 and e.tokens[0].token == TokenType.Identifier \
+                    and e.tokens[1].token == TokenType.Equals:
+                names.add(str(e.tokens[0].value))
+            elif len(e.tokens) >= 3 and str(e.tokens[0].value) == "read":
+                names.add(str(e.tokens[2].value))
+            names.update(self._assigned_names(e.expressions))
+        return names
+
+
+    def _handle_block(self, ex, asm):
+        """
+        generate the assembly for all the expressions inside a block
+        and add the instructions to 'asm'.
+        """
         for e in ex.expressions:
             ae = self._handle_expr(e)
             if ae is not None:
                 asm.asm_expressions.append(ae)
+                for i in ae.get_instructions():
+                    asm.add(i)
 
-        for aa in asm.asm_expressions:
-            instrs = aa.get_instructions()
-            for i in instrs:
-                asm.add(i)
 
-        asm.add(JumpFlag(jp_name))
+    def _fold(self, tokens):
+        """
+        returns the value of the expression if it can be evaluated
+        at compile time, otherwise None.
+        """
+        if self.opt_level < 1 or self._find_call(tokens) is not None:
+            return None
+        return self.solver.fold_expr(tokens, self.constants)
 
-        return asm
+
+    def _runs_repeatedly(self):
+        """
+        returns True if the code being generated can run more than once.
+        """
+        return self.loop_depth > 0 or any([linked for (_, _, linked) in self.call_stack])
+
+
+    def _known_constants(self):
+        return self.constants if self.opt_level >= 1 else None
+
+
+    def _merge_constants(self, before):
+        """
+        keep only the constants that has the same value as they had
+        in 'before', i.e. the ones that are known on both paths.
+        """
+        self.constants = { k: v for k, v in before.items() if self.constants.get(k) == v }
 
 
     def _handle_func_call(self, ex):
         # TODO: function lookup table with arument count and such
         #       cause right now all we have is "print" and "read"
 
-        identifier = str(ex.tokens[2].value)
         a = AsmExpressionContainer(ex)
-        name = str(ex.tokens[0].value)
+        tokens = self._lower_calls(ex.tokens, a)
+        identifier = str(tokens[2].value)
+        name = str(tokens[0].value)
 
         if name == "print":
              # identifier is a constant
              # so we just print it
             if identifier.isdigit():
-                temp = Memory.gen_temp_name()
+                temp = self.mem.gen_temp_name()
                 self.mem.add_reference(temp, identifier)
                 a.load(temp)
                 a.do_print()
@@ -273,9 +774,10 @@ class ScriptCompiler(Executor):
 
         elif name == "read":
             a.do_read()
+            self.constants.pop(identifier, None)
 
             if self.mem.has_reference(identifier):
-                temp = Memory.gen_temp_name()
+                temp = self.mem.gen_temp_name()
                 self.mem.add_reference(temp)
 
                 a.add(Instruction("STA", variable=temp, comment="store input"))
@@ -291,6 +793,41 @@ class ScriptCompiler(Executor):
         """
         evaluate an expression and generate assembly for it
         """
+        asm = self._gen_expr(ex)
+        if asm is not None:
+            self._locate(asm.get_instructions(), ex)
+        return asm
+
+
+    @staticmethod
+    def _locate(code, ex):
+        """
+        the instructions that are not from a statement inside 'ex' are from 'ex'.
+        """
+        for i in code:
+            if isinstance(i, Instruction) and i.statement is None:
+                i.statement = ex
+
+
+    @staticmethod
+    def _relocate(code, old, new):
+        """
+        point code from the cache at the statements of 'new', that has
+        the same tokens as 'old' but maybe at other places in the script.
+        """
+        statements = {}
+        def walk(a, b):
+            statements[id(a)] = b
+            for (x, y) in zip(a.expressions, b.expressions):
+                walk(x, y)
+        walk(old, new)
+
+        for i in code:
+            if isinstance(i, Instruction):
+                i.statement = statements.get(id(i.statement), new)
+
+
+    def _gen_expr(self, ex):
         # returns true or false
         def expr_matches(expr, tokens):
             if len(expr.tokens) < len(tokens): return False
@@ -301,7 +838,11 @@ class ScriptCompiler(Executor):
 
         match_assignment = lambda x: expr_matches(x, [TokenType.Identifier, TokenType.Equals])
         match_condition = lambda x: expr_matches(x, [TokenType.Conditional, TokenType.LParen])
+        match_loop = lambda x: expr_matches(x, [TokenType.While, TokenType.LParen])
         match_func = lambda x: expr_matches(x, [TokenType.Function, TokenType.LParen])
+        match_def = lambda x: expr_matches(x, [TokenType.FuncDecl, TokenType.Identifier])
+        match_return = lambda x: expr_matches(x, [TokenType.Return])
+        match_call = lambda x: self._find_call(x.tokens) == 0
 
          # VARIABLE ASSIGMENT
         if match_assignment(ex):
@@ -312,13 +853,386 @@ class ScriptCompiler(Executor):
             asm = self._handle_if(ex)
             return asm
 
+        elif match_loop(ex): # WHILE LOOP
+            asm = self._handle_while(ex)
+            return asm
+
         elif match_func(ex):
             asm = self._handle_func_call(ex)
             return asm
 
+        elif match_def(ex): # FUNCTION DECLARATION
+            function = self.functions.get(str(ex.tokens[1].value))
+            if function is None or function.expression is not ex:
+                raise CompileError("Functions can only be declared at the top level")
+            # the body is generated where the function is called
+            return AsmExpressionContainer(ex)
+
+        elif match_return(ex):
+            return self._handle_return(ex)
+
+        elif match_call(ex): # USER FUNCTION CALL
+            asm = AsmExpressionContainer(ex)
+            (function, args, end) = self._split_call(ex.tokens, 0)
+            if end == len(ex.tokens):
+                self._gen_call(function, args, asm)
+            else:
+                self._lower_calls(ex.tokens, asm)
+            return asm
+
         return None
 
 
+    def _handle_cached(self, ex):
+        """
+        generate the code for a top-level statement, or reuse the code
+        from the cache if the statement was compiled before in the
+        same state. Statements that call user functions are not cached.
+        """
+        names = self._statement_names(ex)
+        if any([n in self.functions for n in names]):
+            return self._handle_expr(ex)
+
+        key = (self.opt_level, self.solver.arithmetic.compact, self._statement_key(ex),
+            tuple([(n, self.mem.has_reference(n), self.constants.get(n)) for n in sorted(names)]))
+
+        entry = self.cache.lookup(key)
+        if entry is not None:
+            asm = AsmExpressionContainer(ex)
+            code = self.cache.replay(entry, self.mem)
+            self._relocate(code, entry.statement, ex)
+            for i in code:
+                asm.add(i)
+            for (name, value) in entry.constants:
+                if value is None:
+                    self.constants.pop(name, None)
+                else:
+                    self.constants[name] = value
+            return asm
+
+        count = len(self.mem.get())
+        asm = self._handle_expr(ex)
+        if asm is None:
+            return None
+
+        added = list(self.mem.get().items())[count:]
+        constants = [(n, self.constants.get(n)) for n in sorted(names)]
+        self.cache.store(key, asm.get_instructions(), added, constants, ex)
+        return asm
+
+
+    def _statement_key(self, ex):
+        return (tuple([(str(t.value), int(t.token)) for t in ex.tokens]),
+            tuple([self._statement_key(e) for e in ex.expressions]))
+
+
+    def _statement_names(self, ex):
+        """
+        returns the set of identifiers in a statement and its blocks.
+        """
+        names = set([str(t.value) for t in ex.tokens if t.token == TokenType.Identifier
+            and not Utils.is_int(t.value)])
+        for e in ex.expressions:
+            names.update(self._statement_names(e))
+        return names
+
+
+    def _declare_functions(self, exprs):
+        """
+        add the functions declared at the top level to the function
+        table, and count how many times each of them is called.
+        """
+        for ex in exprs:
+            if len(ex.tokens) == 0 or ex.tokens[0].token != TokenType.FuncDecl:
+                continue
+
+            tokens = ex.tokens
+            if len(tokens) < 4 or tokens[1].token != TokenType.Identifier \
+                    or tokens[2].token != TokenType.LParen \
+                    or tokens[len(tokens) - 1].token != TokenType.RParen:
+                raise CompileError("Invalid function declaration: \'{0}\'".format(ex))
+
+            name = str(tokens[1].value)
+            params = [str(t.value) for t in tokens[3:len(tokens) - 1]
+                if t.token != TokenType.Seperator]
+            if name in self.functions:
+                raise CompileError("Function \'{0}\' is declared twice".format(name))
+
+            self.functions[name] = Function(name, params, ex,
+                self._assigned_names(ex.expressions), self.mem)
+
+        for idx, t in enumerate(self.tokens):
+            if self._find_call(self.tokens[idx:idx + 2]) == 0 \
+                    and (idx == 0 or self.tokens[idx - 1].token != TokenType.FuncDecl):
+                self.functions[str(t.value)].calls += 1
+
+
+    def _find_call(self, tokens):
+        """
+        returns the index of the first call to a user function, or None.
+        """
+        for idx in range(len(tokens) - 1):
+            if tokens[idx].token == TokenType.Identifier and str(tokens[idx].value) in self.functions \
+                    and tokens[idx + 1].token == TokenType.LParen:
+                return idx
+        return None
+
+
+    def _split_call(self, tokens, start):
+        """
+        returns the function called at 'start', the tokens of every
+        argument and the index after the closing parenthesis.
+        """
+        function = self.functions[str(tokens[start].value)]
+        args = []
+        arg = []
+        level = 0
+        idx = start + 2
+        while idx < len(tokens):
+            t = tokens[idx]
+            idx += 1
+            if t.token == TokenType.RParen and level == 0:
+                break
+            if t.token == TokenType.Seperator and level == 0:
+                args.append(arg)
+                arg = []
+                continue
+
+            if t.token == TokenType.LParen: level += 1
+            if t.token == TokenType.RParen: level -= 1
+            arg.append(t)
+        else:
+            raise CompileError("Missing \')\' in call to \'{0}\'".format(function.name))
+
+        if len(arg) != 0 or len(args) != 0:
+            args.append(arg)
+        return function, args, idx
+
+
+    def _lower_calls(self, tokens, asm):
+        """
+        generate the calls to user functions in an expression, and
+        returns the expression with every call replaced by a temp
+        variable that holds what the function returned.
+        """
+        result = []
+        idx = 0
+        while idx < len(tokens):
+            start = self._find_call(tokens[idx:])
+            if start is None:
+                result.extend(tokens[idx:])
+                break
+
+            result.extend(tokens[idx:idx + start])
+            (function, args, idx) = self._split_call(tokens, idx + start)
+            self._gen_call(function, args, asm)
+
+            temp = self.mem.gen_temp_name()
+            self.mem.add_reference(temp)
+            asm.store(temp)
+            result.append(Token(temp, TokenType.Identifier))
+
+        return result
+
+
+    def _gen_call(self, function, args, asm):
+        """
+        generate a call to a user function, the value it
+        returns is in the AC afterwards.
+        """
+        if len(args) != len(function.params):
+            raise CompileError("\'{0}\' takes {1} arguments, but {2} were given"
+                .format(function.name, len(function.params), len(args)))
+        if function in [f for (f, _, _) in self.call_stack]:
+            raise CompileError("\'{0}\' is recursive, which is not supported".format(function.name))
+
+        # calls in the arguments are made before any parameter is set
+        args = [self._lower_calls(arg, asm) for arg in args]
+
+        if self.opt_level >= 1 and function.should_inline(self._function_size(function),
+                hot=self.loop_depth > 0):
+            self._gen_inline_call(function, args, asm)
+        else:
+            self._gen_linked_call(function, args, asm)
+
+        # the locals are changed by the call
+        for name in function.locals:
+            self.constants.pop(name, None)
+
+
+    def _gen_inline_call(self, function, args, asm):
+        """
+        generate the body of the function in place of the call.
+        """
+        mapping = {}
+        for (param, arg) in zip(function.params, args):
+            value = self._fold(arg)
+            if value is not None and value >= 0:
+                arg = [Token(str(value), TokenType.Identifier)]
+
+            if len(arg) == 1 and arg[0].token == TokenType.Identifier \
+                    and param not in function.assigned:
+                # the parameter is never changed, so the argument is used directly
+                mapping[param] = arg[0]
+            else:
+                self._gen_argument(param, arg, asm)
+
+        expressions = function.expressions
+        if len(mapping) != 0:
+            expressions = Function.rename(expressions, mapping)
+
+        end = self.mem.gen_jump_name()
+        self._gen_function_block(function, expressions, asm, end, linked=False)
+        asm.add(JumpFlag(end))
+
+
+    def _gen_linked_call(self, function, args, asm):
+        """
+        set the parameters, the return address and jump to the body:
+
+                LDA <return_n>      # MEM that holds 'BRA back_n'
+                STA <back>
+                BRA entry
+            back_n:
+
+        with banked memory the bank of 'back_n' is stored in the 'BNK' at <exit> first.
+        """
+        for (param, arg) in zip(function.params, args):
+            self._gen_argument(param, arg, asm)
+
+        back = self.mem.gen_jump_name()
+        return_adr = self.mem.gen_temp_name()
+        self.mem.add_jump_reference(return_adr, back, offset=6 * self.mem_size)
+        function.returns.append(back)
+        function.linked = True
+
+        if self.banked:
+            return_bank = self.mem.gen_temp_name()
+            self.mem.add_jump_reference(return_bank, back, offset=4 * self.mem_size, bank=True)
+            asm.add(Instruction("LDA", variable=return_bank, comment="call {0}".format(function.name)))
+            asm.add(Instruction("STA", jump=function.exit, comment="set return bank"))
+
+        asm.add(Instruction("LDA", variable=return_adr, comment="call {0}".format(function.name)))
+        asm.add(Instruction("STA", jump=function.back, comment="set return address"))
+        asm.add(Instruction("BRA", jump=function.entry))
+        asm.add(JumpFlag(back))
+
+
+    def _gen_argument(self, param, arg, asm):
+        tokens = [Token(param, TokenType.Identifier), Token("=", TokenType.Equals)] + arg
+        asm.merge(self._handle_assignment(Expression(tokens)))
+
+
+    def _gen_function_block(self, function, expressions, asm, end, *, linked):
+        """
+        generate the statements of a function body, 'return' jumps to 'end'
+        with the value in the AC. Reaching the end of the body returns 0.
+        """
+        self.call_stack.append((function, end, linked))
+
+        for idx, e in enumerate(expressions):
+            if len(e.tokens) != 0 and e.tokens[0].token == TokenType.Return:
+                # the last return has nowhere to jump
+                ae = self._handle_return(e, jump=idx != len(expressions) - 1)
+                self._locate(ae.get_instructions(), e)
+            else:
+                ae = self._handle_expr(e)
+            if ae is not None:
+                asm.asm_expressions.append(ae)
+                for i in ae.get_instructions():
+                    asm.add(i)
+
+        last = expressions[len(expressions) - 1] if len(expressions) != 0 else None
+        if last is None or len(last.tokens) == 0 or last.tokens[0].token != TokenType.Return:
+            self._gen_condition([Token("0", TokenType.Identifier)], asm)
+
+        self.call_stack.pop()
+
+
+    def _handle_return(self, ex, *, jump=True):
+        if len(self.call_stack) == 0:
+            raise CompileError("\'return\' outside of a function")
+        (function, end, linked) = self.call_stack[len(self.call_stack) - 1]
+
+        asm = AsmExpressionContainer(ex)
+        relevant_tokens = ex.tokens[1:]
+        if len(relevant_tokens) == 0:
+            relevant_tokens = [Token("0", TokenType.Identifier)]
+        self._check_no_comparison(relevant_tokens)
+
+        value = self._fold(relevant_tokens)
+        if value is not None:
+            relevant_tokens = [Token(str(value), TokenType.Identifier)]
+
+        self._gen_condition(relevant_tokens, asm)
+        if jump:
+            asm.add(Instruction("BRA", jump=end, comment="return"))
+        return asm
+
+
+    def _gen_function_body(self, function):
+        """
+        returns the instructions for the body of a function that is called,
+        it ends with the 'BRA' that the callers patch to return to them.
+        """
+        asm = AsmExpressionContainer(function.expression)
+        asm.add(JumpFlag(function.entry))
+
+        # the body runs from every call site, so nothing is known
+        self.constants = {}
+        self._gen_function_block(function, function.expressions, asm, function.exit, linked=True)
+
+        back_jump = Instruction("BRA", adr=0, comment="return, patched by the caller")
+        back_jump.targets = function.returns
+        asm.add(JumpFlag(function.exit))
+        if self.banked:
+            asm.add(Instruction("BNK", adr=0, comment="return bank, patched by the caller"))
+        asm.add(JumpFlag(function.back))
+        asm.add(back_jump)
+        return asm.get_instructions()
+
+
+    def _function_size(self, function):
+        """
+        returns the number of instructions in the body of the function.
+        """
+        if function.size is None:
+            constants = self.constants
+            loop_depth = self.loop_depth
+            state = [(f, list(f.returns), f.linked) for f in self.functions.values()]
+
+            self.loop_depth = 0
+            code = self._merge_jumps(self._gen_function_body(function))
+            if self.use_peephole:
+                code = PeepholeOptimizer().optimize(code)
+            # everything but the 'BRA' back, and its 'BNK'
+            function.size = len(code) - (2 if self.banked else 1)
+
+            self.constants = constants
+            self.loop_depth = loop_depth
+            for (f, returns, linked) in state:
+                f.returns[:] = returns
+                f.linked = linked
+
+        return function.size
+
+
+    def _gen_function_bodies(self):
+        """
+        returns the instructions for every function that is called
+        without being inlined, they are placed after the program.
+        """
+        code = []
+        while True:
+            pending = [f for f in self.functions.values() if f.linked and not f.compiled]
+            if len(pending) == 0:
+                break
+            for f in pending:
+                f.compiled = True
+                code.extend(self._gen_function_body(f))
+        return code
+
+
     def _bind_jumps(self, instructions):
         def find_jump(instructions, alias):
             for idx, instr in enumerate(instructions):
@@ -334,7 +1248,7 @@ class ScriptCompiler(Executor):
                 (line_idx, jump_inst) = find_jump(instructions, need)
                 if line_idx is None:
                     print("Error: What the f-...this shouldnt happen...")
-                inst.set_adr(line_idx)
+                inst.set_adr(inst.adr_offset + line_idx)
 
         return instructions
 
@@ -382,50 +1296,133 @@ class ScriptCompiler(Executor):
         return copy
 
 
+    def _optimize(self, code):
+        """
+        run the optimization passes over the code, the code has
+        merged jumps but no memory or jump bindings.
+        """
+        if self.opt_level >= 2:
+            optimizer = GlobalOptimizer()
+            code = optimizer.optimize(code)
+            self.mem.remove_unused(code, temps_only=False)
+
+            self.global_stats = optimizer.stats
+            print("\n" + str(self.global_stats))
+
+        if self.opt_level >= 1:
+            # temps that are only read can share a memory slot
+            self.mem.pool_constants(code)
+            self.mem.remove_unused(code)
+
+        if self.use_peephole:
+            optimizer = PeepholeOptimizer()
+            optimizer.stats.instructions_before = len(code) + len(self.mem.get())
+
+            code = optimizer.optimize(code)
+            self.mem.remove_unused(code)
+
+            optimizer.stats.instructions_after = len(code) + len(self.mem.get())
+            self.peephole_stats = optimizer.stats
+            print("\n" + str(self.peephole_stats))
+
+        # the code, the memory and the jump over the memory
+        size = len(code) + len(self.mem.get()) + 1
+        if self.opt_level >= 1 and not self.banked and (self.opt_size or size > self.mem_size):
+            outliner = Outliner(self.mem, mem_size=self.mem_size,
+                cycles_per_word=float("inf") if self.opt_size else 0)
+            code = outliner.optimize(code, words_needed=size - self.mem_size)
+            self.mem.remove_unused(code)
+
+            self.outline_stats = outliner.stats
+            print("\n" + str(self.outline_stats))
+
+        return code
+
+
     def _parse(self, tokens):
-        exprs = self._parse_expr_recursive(tokens)
+        with self.stats.phase("parse") as p:
+            exprs = self._parse_expr_recursive(tokens)
+            p.items = len(exprs)
+
         asm_list = [] # AsmExpression
 
-        for ex in exprs:
-            asm_expr = self._handle_expr(ex)
+        with self.stats.phase("codegen") as p:
+            self._declare_functions(exprs)
+
+            for ex in exprs:
+                asm_expr = self._handle_cached(ex)
 
-            if Utils.check_none_critical(asm_expr):
-                Utils.debug("Compiler Error!: 'asm_expr' cannot be None.")
+                if Utils.check_none_critical(asm_expr):
+                    Utils.debug("Compiler Error!: 'asm_expr' cannot be None.")
 
-            asm_list.append(asm_expr)
+                asm_list.append(asm_expr)
 
 
-        g = []
-        mem_asm = self.mem.gen_asm()
+            code = []
+            for expr in asm_list:
+                code.extend(expr.get_instructions())
 
-        g.extend(mem_asm)
-         # get the rest of the instructions
-        for expr in asm_list:
-            g.extend(expr.get_instructions())
+            code.append(Instruction("HLT", comment="exit"))
+            code.extend(self._gen_function_bodies())
+            p.items = len(code)
 
-        g.append(Instruction("HLT", comment="exit"))
+        self.cache.prune()
+        print("\n" + str(self.cache))
 
         print("\nDebug preview:\n")
-        for idx, gg in enumerate(g):
+        for idx, gg in enumerate(code):
             print(str(idx) + ": " + str(gg))
 
-
-        instructions = self._merge_jumps(g)
-
-        instructions = self.mem.bind_mem(instructions)
+        with self.stats.phase("merge_jumps") as p:
+            code = self._merge_jumps(code)
+            p.items = len(code)
+
+        with self.stats.phase("optimize") as p:
+            code = self._optimize(code)
+            p.items = len(code)
+
+        # the memory is laid out after the optimizations
+        # so that unused variables can be removed first.
+        g = self.mem.gen_asm()
+        g.extend(code)
+
+        with self.stats.phase("merge_jumps") as p:
+            instructions = self._merge_jumps(g)
+            p.items = len(instructions)
+        if len(instructions) > self.mem_size and not self.banked:
+            raise SizeError("The program needs {0} words of memory, but there is only {1}"
+                .format(len(instructions), self.mem_size))
+
+        with self.stats.phase("bind_mem") as p:
+            instructions = self.mem.bind_mem(instructions)
+            p.items = len(self.mem.get())
         if instructions is None:
             print("Critical Error!: Memory bindings.")
-            return None
+            return exprs, None
 
-        instructions = self._bind_jumps(instructions)
+        with self.stats.phase("bind_jumps") as p:
+            instructions = self._bind_jumps(instructions)
+            p.items = len([i for i in instructions if i.jump is not None])
         if Utils.check_none_critical(instructions):
             print("Critical Error!: Jump bindings.")
-            return None
+            return exprs, None
+
+        if self.banked:
+            with self.stats.phase("banks") as p:
+                layout = BankLayout(self.mem_size)
+                instructions = layout.layout(instructions)
+                p.items = layout.prefixes
+
+        self.instructions = instructions
+        self.source_map = SourceMap(instructions)
+        with self.stats.phase("estimate") as p:
+            self.estimate = CycleEstimator().estimate(instructions)
+            p.items = len(self.estimate.loops)
 
 
-        assembly = "\n".join([a.asm() for a in instructions])
         print("\nCompiled:\n")
         for idx, gg in enumerate(instructions):
             print(str(idx) + ": " + str(gg))
+        print("\n" + str(self.estimate))
 
-        return [], assembly
+        return exprs, instructions
@@ -0,0 +1,25 @@
+from compiler.memory import Memory
+
+class CompileContext:
+    """
+    The state of one compilation: the memory, which also makes the
+    names of temps and jumps, and the symbol tables.
+
+    Nothing in it is shared with other compilations, so the names only
+    depend on the script, and different compilers can compile scripts
+    in parallel threads.
+    """
+
+    def __init__(self):
+        self.memory = Memory()
+
+        # identifiers whose value is known at compile time,
+        # only used when optimizations are turned on.
+        self.constants = {}
+
+        # user functions by name, and the functions whose body is
+        # being generated, as (function, jump to return, linked).
+        self.functions = {}
+        self.call_stack = []
+
+        self.loop_depth = 0
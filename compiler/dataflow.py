@@ -0,0 +1,218 @@
+AC = "<AC>" # the accumulator is treated like any other variable
+
+def uses(inst):
+    """
+    returns the set of variables an instruction reads.
+    """
+    op = inst.instruction
+    if op == "LDA":
+        return set([inst.variable])
+    elif op in ["ADD", "SUB"]:
+        return set([inst.variable, AC])
+    elif op in ["STA", "OUT", "BRZ", "BRP"]:
+        return set([AC])
+    return set()
+
+def defs(inst):
+    """
+    returns the set of variables an instruction writes.
+    """
+    op = inst.instruction
+    if op in ["LDA", "ADD", "SUB", "INP"]:
+        return set([AC])
+    elif op == "STA" and inst.variable is not None:
+        return set([inst.variable])
+    return set()
+
+
+class DataFlowAnalysis:
+    """
+    Iterative data-flow analysis over a 'ControlFlowGraph'.
+
+    Subclasses set 'forward' and implement 'top', 'boundary', 'meet'
+    and 'transfer_instruction'. The values should be immutable.
+    """
+    forward = True
+
+    def __init__(self, cfg):
+        self.cfg = cfg
+        self.block_in = {}
+        self.block_out = {}
+        self.solve()
+
+    def top(self):
+        """
+        the value of a block that has not been visited yet
+        """
+        raise NotImplementedError
+
+    def boundary(self):
+        """
+        the value at the entry (forward) or at the exits (backward)
+        """
+        raise NotImplementedError
+
+    def meet(self, a, b):
+        raise NotImplementedError
+
+    def transfer_instruction(self, inst, value):
+        raise NotImplementedError
+
+    def transfer(self, block, value):
+        instrs = block.instructions if self.forward else reversed(block.instructions)
+        for inst in instrs:
+            value = self.transfer_instruction(inst, value)
+        return value
+
+    def solve(self):
+        blocks = self.cfg.blocks
+        for b in blocks:
+            self.block_in[b] = self.top()
+            self.block_out[b] = self.top()
+
+        worklist = list(blocks) if self.forward else list(reversed(blocks))
+        while len(worklist) != 0:
+            b = worklist.pop(0)
+
+            if self.forward:
+                value = self.boundary() if b is self.cfg.entry else self.top()
+                for p in b.predecessors:
+                    value = self.meet(value, self.block_out[p])
+                self.block_in[b] = value
+
+                out = self.transfer(b, value)
+                if out != self.block_out[b]:
+                    self.block_out[b] = out
+                    worklist.extend([s for s in b.successors if s not in worklist])
+            else:
+                value = self.boundary() if len(b.successors) == 0 else self.top()
+                for s in b.successors:
+                    value = self.meet(value, self.block_in[s])
+                self.block_out[b] = value
+
+                inp = self.transfer(b, value)
+                if inp != self.block_in[b]:
+                    self.block_in[b] = inp
+                    worklist.extend([p for p in b.predecessors if p not in worklist])
+
+    def instruction_values(self, block):
+        """
+        returns a list of (instruction, value before, value after)
+        for every instruction in the block, in program order.
+        """
+        result = []
+        if self.forward:
+            value = self.block_in[block]
+            for inst in block.instructions:
+                after = self.transfer_instruction(inst, value)
+                result.append((inst, value, after))
+                value = after
+        else:
+            value = self.block_out[block]
+            for inst in reversed(block.instructions):
+                before = self.transfer_instruction(inst, value)
+                result.append((inst, before, value))
+                value = before
+            result.reverse()
+        return result
+
+
+class ReachingDefinitions(DataFlowAnalysis):
+    """
+    Which instructions may have written the current value of each variable.
+
+    A variable with no reaching definitions still has its initial value.
+    """
+    forward = True
+
+    def top(self): return frozenset()
+    def boundary(self): return frozenset()
+    def meet(self, a, b): return a | b
+
+    def transfer_instruction(self, inst, value):
+        written = defs(inst)
+        if len(written) == 0:
+            return value
+        kept = [d for d in value if len(defs(d) & written) == 0]
+        return frozenset(kept + [inst])
+
+    @staticmethod
+    def definitions_of(variable, value):
+        return [d for d in value if variable in defs(d)]
+
+
+class Liveness(DataFlowAnalysis):
+    """
+    Which variables may be read before they are written again.
+
+    Nothing is live when the program halts, unless it's in 'live_at_exit'.
+    """
+    forward = False
+
+    def __init__(self, cfg, live_at_exit=None):
+        self.live_at_exit = frozenset() if live_at_exit is None else frozenset(live_at_exit)
+        super().__init__(cfg)
+
+    def top(self): return frozenset()
+    def boundary(self): return self.live_at_exit
+    def meet(self, a, b): return a | b
+
+    def transfer_instruction(self, inst, value):
+        return (value - defs(inst)) | uses(inst)
+
+
+class AvailableValues(DataFlowAnalysis):
+    """
+    Which variables are known to hold the same value, on every path.
+
+    The values are sets of pairs '(a, b)' where 'a' holds the value of 'b',
+    'a' can be the accumulator. None is used as the "everything" set.
+    """
+    forward = True
+
+    def top(self): return None
+    def boundary(self): return frozenset()
+
+    def meet(self, a, b):
+        if a is None: return b
+        if b is None: return a
+        return a & b
+
+    def transfer_instruction(self, inst, value):
+        if value is None:
+            return None
+
+        op = inst.instruction
+        if op == "LDA":
+            src = inst.variable
+            facts = set([f for f in value if f[0] != AC])
+            facts.add((AC, src))
+            for (a, b) in value:
+                if a == src and b != AC: facts.add((AC, b))
+                if b == src and a != AC: facts.add((AC, a))
+            return frozenset(facts)
+        elif op == "STA" and inst.variable is not None:
+            dst = inst.variable
+            facts = set([f for f in value if dst not in f])
+            for (a, b) in value:
+                if a == AC and b != dst:
+                    facts.add((dst, b))
+            facts.add((AC, dst))
+            return frozenset(facts)
+        elif AC in defs(inst):
+            return frozenset([f for f in value if f[0] != AC])
+
+        return value
+
+    @staticmethod
+    def holds(value, a, b):
+        return value is not None and (a, b) in value
+
+    @staticmethod
+    def copies_of(value, variable):
+        """
+        returns the variables that holds the same value as 'variable'.
+        """
+        if value is None:
+            return []
+        return sorted([b for (a, b) in value if a == variable and b != AC])
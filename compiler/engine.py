@@ -0,0 +1,251 @@
+import asm
+from compiler.executor import Executor
+from compiler.error import ExecuteError
+
+# a cross-check stops comparing after this many cycles
+MAX_CYCLES = 1000000
+
+class EngineResult:
+    def __init__(self, output, cycles, inputs, memory):
+        self.output = output
+        self.cycles = cycles
+        # the values that were read, in order
+        self.inputs = inputs
+        self.memory = memory
+
+    def __str__(self):
+        return "{0} cycles, {1} inputs, output {2}".format(self.cycles, len(self.inputs), self.output)
+
+
+class Engine:
+    """
+    Runs a memory image of Little Man instructions. Every engine has
+    the same protocol:
+
+        engine.load(words, mem_size, banked)
+        result = engine.run(inputs)     # an 'EngineResult'
+
+    'inputs' is a list of values, or None to read from the terminal.
+    'trace(pc, ac)' is called before every instruction, and can stop
+    the run by raising an exception.
+    """
+    name = None
+
+    def __init__(self):
+        self.words = []
+        self.mem_size = 100
+        self.banked = False
+
+    def load(self, words, mem_size=100, banked=False):
+        self.words = list(words)
+        self.mem_size = mem_size
+        self.banked = banked
+
+    def supports(self, words, mem_size=100, banked=False):
+        raise NotImplementedError
+
+    def run(self, inputs=None, *, trace=None):
+        raise NotImplementedError
+
+
+class ExecutorEngine(Engine):
+    """
+    The 'Executor', it runs everything: any memory size, banks and 'TAS'.
+    """
+    name = "executor"
+    accelerate = True
+
+    def supports(self, words, mem_size=100, banked=False):
+        return True
+
+    def run(self, inputs=None, *, trace=None):
+        e = Executor(testing=inputs is not None, test_input=inputs, banked=self.banked,
+            accelerate=self.accelerate)
+        memory = list(self.words)
+        output = e.execute_bytecode(memory, self.mem_size, quiet=True, trace=trace)
+        return EngineResult(output, e.cycles, list(e.inputs), memory)
+
+
+class SimpleEngine(Engine):
+    """
+    'runLittleMan' from 'asm.py', the original interpreter. It only has
+    the classic instructions, in 100 words of memory, and its loop does
+    less work per instruction than the 'Executor'.
+    """
+    name = "simple"
+
+    def supports(self, words, mem_size=100, banked=False):
+        # a 'MEM' that looks like a 'TAS' is turned down as well
+        return mem_size == 100 and not banked and len(words) <= mem_size \
+            and not any([w // 100 == 4 for w in words])
+
+    def run(self, inputs=None, *, trace=None):
+        read = []
+        output = []
+
+        def read_input():
+            if inputs is None:
+                value = asm.readInput()
+            elif len(read) >= len(inputs):
+                raise ExecuteError("Ran out of test input after {0} values".format(len(inputs)))
+            else:
+                value = inputs[len(read)]
+            read.append(value)
+            return value
+
+        def write_output(value):
+            print(value)
+            output.append(str(value))
+
+        cycles = [0]
+        def count(pc, ac):
+            cycles[0] += 1
+            if trace is not None:
+                trace(pc, ac)
+
+        # padded, so it has all of the 100 words like the 'Executor' expects
+        memory = self.words + [0] * (self.mem_size - len(self.words))
+        asm.runLittleMan(memory, read_input, write_output, count)
+        return EngineResult(output, cycles[0], read, memory)
+
+
+class PlainEngine(ExecutorEngine):
+    """
+    The 'Executor' without skipping loops ahead, every instruction is
+    run. Cross-check against it to test the loop accelerator.
+    """
+    name = "plain"
+    accelerate = False
+
+
+# the engines by name, the fastest first
+ENGINES = {
+    SimpleEngine.name: SimpleEngine,
+    ExecutorEngine.name: ExecutorEngine,
+    PlainEngine.name: PlainEngine
+}
+
+def select(name, words, mem_size=100, banked=False):
+    """
+    returns a loaded engine, 'auto' picks the first one in 'ENGINES'
+    that can run the program.
+    """
+    if name == "auto":
+        name = next(n for (n, e) in ENGINES.items() if e().supports(words, mem_size, banked))
+    elif name not in ENGINES:
+        raise ExecuteError("Unknown engine: \'{0}\', there is {1}".format(name, ", ".join(ENGINES)))
+
+    engine = ENGINES[name]()
+    if not engine.supports(words, mem_size, banked):
+        raise ExecuteError("The engine \'{0}\' can't run this program".format(name))
+    engine.load(words, mem_size, banked)
+    return engine
+
+
+class Divergence:
+    def __init__(self, step, first, second, what):
+        self.step = step
+        # (name, pc, ac) of both engines
+        self.first = first
+        self.second = second
+        self.what = what
+
+    def __str__(self):
+        return "Diverged at step {0}, {1}: {2} at pc {3} with ac {4}, {5} at pc {6} with ac {7}".format(
+            self.step, self.what, *(self.first + self.second))
+
+
+class CrossCheck:
+    """
+    Runs a program on two engines and compares the PC and the AC before
+    every instruction, then the output and the memory at the end.
+
+    The first engine is run to the end and records its states, then the
+    second one is stopped at the first state that differs. The second
+    one reads the same input as the first one did.
+
+    Tracing turns off the loop accelerator of the 'Executor', so an
+    engine that has it is run once more without a trace, and its cycles,
+    output and memory are compared with the traced run.
+    """
+
+    def __init__(self, first, second, *, max_cycles=MAX_CYCLES):
+        self.first = first
+        self.second = second
+        self.max_cycles = max_cycles
+        self.results = []
+
+    def run(self, inputs=None):
+        """
+        returns the first 'Divergence', or None if the engines agree.
+        """
+        states = []
+        def record(pc, ac):
+            if len(states) >= self.max_cycles:
+                raise ExecuteError("Stopped after {0} cycles".format(len(states)))
+            states.append((pc, ac))
+
+        first = self.first.run(inputs, trace=record)
+
+        step = [0]
+        def compare(pc, ac):
+            n = step[0]
+            if n >= len(states) or states[n] != (pc, ac):
+                raise _Diverged(n, states[n] if n < len(states) else (None, None), (pc, ac))
+            step[0] += 1
+
+        try:
+            second = self.second.run(list(first.inputs), trace=compare)
+        except _Diverged as d:
+            return self._divergence(d.step, d.first, d.second, "state")
+        except Exception as e:
+            last = states[step[0] - 1] if step[0] > 0 else (None, None)
+            return self._divergence(step[0], last, last, "error: {0}".format(e))
+        self.results = [first, second]
+
+        end = states[len(states) - 1]
+        if step[0] != len(states):
+            return self._divergence(step[0], states[step[0]], states[step[0] - 1], "halted early")
+        if first.output != second.output:
+            return self._divergence(len(states), end, end, "output {0} != {1}".format(
+                first.output, second.output))
+        size = min(len(first.memory), len(second.memory))
+        for adr in range(size):
+            if first.memory[adr] != second.memory[adr]:
+                return self._divergence(len(states), end, end, "memory at {0}: {1} != {2}".format(
+                    adr, first.memory[adr], second.memory[adr]))
+
+        for engine in [self.first, self.second]:
+            if getattr(engine, "accelerate", False):
+                untraced = engine.run(list(first.inputs))
+                what = self._compare(first, untraced)
+                if what is not None:
+                    return self._divergence(len(states), end, end,
+                        "'{0}' without tracing, {1}".format(engine.name, what))
+        return None
+
+    @staticmethod
+    def _compare(first, second):
+        """
+        returns what differs between two 'EngineResult's at the end, or None.
+        """
+        if first.cycles != second.cycles:
+            return "cycles {0} != {1}".format(first.cycles, second.cycles)
+        if first.output != second.output:
+            return "output {0} != {1}".format(first.output, second.output)
+        size = min(len(first.memory), len(second.memory))
+        for adr in range(size):
+            if first.memory[adr] != second.memory[adr]:
+                return "memory at {0}: {1} != {2}".format(adr, first.memory[adr], second.memory[adr])
+        return None
+
+    def _divergence(self, step, first, second, what):
+        return Divergence(step, (self.first.name,) + tuple(first), (self.second.name,) + tuple(second),
+            what)
+
+
+class _Diverged(Exception):
+    def __init__(self, step, first, second):
+        self.step = step
+        self.first = first
+        self.second = second
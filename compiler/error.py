@@ -2,6 +2,15 @@
 class ExtensionError(Exception):
     pass
 
+class CompileError(Exception):
+    pass
+
+class SizeError(CompileError):
+    """
+    The program doesn't fit in memory.
+    """
+    pass
+
 class ExecuteError(Exception):
     pass
 
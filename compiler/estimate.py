@@ -0,0 +1,241 @@
+from compiler.cfg import ControlFlowGraph
+
+class LoopEstimate:
+    def __init__(self, header, best, worst):
+        # the address of the first instruction in the loop
+        self.header = header
+        # the cycles of one more time around the loop
+        self.best = best
+        self.worst = worst
+
+    def to_dict(self):
+        return { "header": self.header, "best": self.best, "worst": self.worst }
+
+    def __str__(self):
+        return "loop at {0}: {1}..{2} cycles per iteration".format(self.header, self.best, self.worst)
+
+
+class CycleEstimate:
+    """
+    The cycles a program needs, from the start to a 'HLT'. Every
+    instruction takes one cycle.
+
+    Without loops 'best' and 'worst' are bounds on the whole run. With
+    loops they are the cost of going around no loop, and every loop adds
+    its cost per iteration for every time it's repeated:
+
+        worst + n_1 * loops[0].worst + n_2 * loops[1].worst + ...
+
+    'best' and 'worst' are None if the program can never halt.
+    """
+
+    def __init__(self, best, worst, loops):
+        self.best = best
+        self.worst = worst
+        self.loops = loops
+
+    @property
+    def exact(self):
+        return len(self.loops) == 0
+
+    def formula(self, bound):
+        terms = [str(getattr(self, bound))]
+        terms += ["n{0} * {1}".format(idx + 1, getattr(l, bound)) for idx, l in enumerate(self.loops)]
+        return " + ".join(terms)
+
+    def to_dict(self):
+        return {
+            "best": self.best,
+            "worst": self.worst,
+            "loops": [l.to_dict() for l in self.loops]
+        }
+
+    def __str__(self):
+        if self.best is None:
+            return "Cycles: the program never halts"
+        if self.exact:
+            return "Cycles: {0} best, {1} worst".format(self.best, self.worst)
+
+        lines = ["Cycles: {0} best, {1} worst".format(self.formula("best"), self.formula("worst"))]
+        lines += ["   n{0}: {1}".format(idx + 1, l) for idx, l in enumerate(self.loops)]
+        return "\n".join(lines)
+
+
+class CycleEstimator:
+    """
+    Estimates the cycles of a bound program from its control-flow graph,
+    without running it.
+
+    The loops are found from the edges that go back to a block that is
+    still being visited, in a depth-first walk from the start. With
+    them removed the graph has no cycles, and the shortest and longest
+    paths through it are the bounds.
+
+    A linked function returns to the caller that patched its 'BRA', so
+    its return is not an edge. A call is an edge from the call to where
+    it returns instead, that costs the shortest or longest path through
+    the body of the function.
+    """
+
+    def estimate(self, instructions):
+        cfg = ControlFlowGraph(instructions)
+        if cfg.entry is None:
+            return CycleEstimate(0, 0, [])
+
+        start = {}
+        position = 0
+        for block in cfg.blocks:
+            start[block] = position
+            position += len(block.instructions)
+
+        self.edges = self._edges(cfg)
+        self.summaries = {}
+        (order, back_edges) = self._walk(cfg.entry)
+        self.forward = { b: [e for e in self.edges[b] if (b, e[0]) not in back_edges] for b in order }
+        self.topological = self._topological(order)
+
+        exits = [b for b in order if b.last.instruction == "HLT"]
+        (best, worst) = self._paths(cfg.entry, exits, set(order))
+
+        loops = []
+        headers = []
+        for (_, header) in back_edges:
+            if header not in headers:
+                headers.append(header)
+        for header in sorted(headers, key=lambda b: start[b]):
+            latches = [latch for (latch, h) in back_edges if h is header]
+            body = self._loop_body(header, latches)
+            (b, w) = self._paths(header, latches, body)
+            loops.append(LoopEstimate(start[header], b, w))
+
+        return CycleEstimate(best, worst, loops)
+
+    def _edges(self, cfg):
+        """
+        returns the successors of every block as '(block, call)', where
+        'call' is '(entry, exit)' of the function a call goes through.
+        """
+        labels = {}
+        for block in cfg.blocks:
+            for j in block.instructions[0].jumps:
+                labels[j.alias] = block
+
+        # the block that returns to each return site
+        returns = {}
+        for block in cfg.blocks:
+            for alias in block.last.targets:
+                if alias in labels:
+                    returns[labels[alias]] = block
+
+        edges = {}
+        for n, block in enumerate(cfg.blocks):
+            if len(block.last.targets) != 0:
+                edges[block] = []
+                continue
+            edges[block] = [(s, None) for s in block.successors]
+
+            site = cfg.blocks[n + 1] if n + 1 < len(cfg.blocks) else None
+            if site in returns and block.last.instruction == "BRA" and len(block.successors) == 1:
+                edges[block].append((site, (block.successors[0], returns[site])))
+        return edges
+
+    def _summary(self, call):
+        """
+        returns the fewest and the most cycles through a function,
+        from its entry to the end of the 'BRA' that returns.
+        """
+        if call not in self.summaries:
+            (entry, exit) = call
+            (best, worst) = self._paths(entry, [exit], set(self.forward))
+            # a body that never returns can't be passed through
+            self.summaries[call] = (best, worst)
+        return self.summaries[call]
+
+    def _walk(self, entry):
+        """
+        returns the blocks that can be reached in the order they were
+        first visited, and the edges back to a block being visited.
+        """
+        order = [entry]
+        back_edges = set()
+        visiting = set([entry])
+        seen = set([entry])
+        stack = [(entry, iter(self.edges[entry]))]
+        while len(stack) != 0:
+            (block, successors) = stack[len(stack) - 1]
+            edge = next(successors, None)
+            if edge is None:
+                visiting.discard(block)
+                stack.pop()
+                continue
+            s = edge[0]
+            if s in visiting:
+                back_edges.add((block, s))
+            elif s not in seen:
+                seen.add(s)
+                visiting.add(s)
+                order.append(s)
+                stack.append((s, iter(self.edges[s])))
+        return order, back_edges
+
+    def _topological(self, order):
+        incoming = { b: 0 for b in order }
+        for b in order:
+            for (s, _) in self.forward[b]:
+                incoming[s] += 1
+
+        result = []
+        ready = [b for b in order if incoming[b] == 0]
+        while len(ready) != 0:
+            b = ready.pop()
+            result.append(b)
+            for (s, _) in self.forward[b]:
+                incoming[s] -= 1
+                if incoming[s] == 0:
+                    ready.append(s)
+        return result
+
+    def _paths(self, source, targets, within):
+        """
+        returns the fewest and the most cycles on a path from 'source'
+        to the end of any of 'targets', only through blocks in 'within'.
+        """
+        best = { source: len(source.instructions) }
+        worst = { source: len(source.instructions) }
+        for b in self.topological:
+            if b not in best:
+                continue
+            for (s, call) in self.forward[b]:
+                if s not in within:
+                    continue
+                (extra_best, extra_worst) = (0, 0) if call is None else self._summary(call)
+                if extra_best is None:
+                    continue
+                cost = len(s.instructions)
+                (low, high) = (best[b] + extra_best + cost, worst[b] + extra_worst + cost)
+                best[s] = min(best.get(s, low), low)
+                worst[s] = max(worst.get(s, high), high)
+
+        reached = [t for t in targets if t in best]
+        if len(reached) == 0:
+            return None, None
+        return min([best[t] for t in reached]), max([worst[t] for t in reached])
+
+    def _loop_body(self, header, latches):
+        """
+        returns the blocks that can reach a latch without passing the header.
+        """
+        predecessors = {}
+        for b in self.forward:
+            for (s, _) in self.edges[b]:
+                predecessors.setdefault(s, []).append(b)
+
+        body = set([header])
+        stack = [l for l in latches if l is not header]
+        while len(stack) != 0:
+            b = stack.pop()
+            if b in body:
+                continue
+            body.add(b)
+            stack.extend(predecessors.get(b, []))
+        return body
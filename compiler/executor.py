@@ -1,25 +1,91 @@
+import contextlib
 from compiler.error import ExecuteError
+from compiler.loops import LoopAccelerator
 
 class Executor():
 
-    def __init__(self, *, testing=False, test_input=7):
+    def __init__(self, *, testing=False, test_input=7, max_cycles=None, banked=False, lock=None,
+            accelerate=True):
+        """
+        'test_input' is either a single value that is returned for
+        every input, or a list of values that is returned in order.
+
+        A program that runs for more than 'max_cycles' is stopped.
+
+        With 'banked' the memory is split in banks of 'mem_size' words,
+        and 'BNK b' (opcode 4) makes the next instruction address bank 'b'.
+        Otherwise an address is in the same bank as the instruction.
+
+        Without banks, 'TAS x' (opcode 4) loads x into the AC and sets x
+        to 1. When 'lock' is given, it's held while doing so, so that no
+        other process sharing the memory can come in between.
+
+        With 'accelerate', loops that count are skipped ahead when they
+        are jumped back to, see 'LoopAccelerator'. The memory, the AC and
+        the cycles are the same as if they had run. It's turned off with
+        banks and when tracing, and has to be turned off when another
+        process can change the memory.
+        """
         self.testing = testing
         self.testing_output = test_input
+        self.max_cycles = max_cycles
+        self.banked = banked
+        self.lock = contextlib.nullcontext() if lock is None else lock
+        self.accelerate = accelerate
+        self.cycles = 0
+        self.skipped = 0
+        self.inputs = []
+        self.paused_at = None
+
+    def _next_test_input(self):
+        if not isinstance(self.testing_output, list):
+            return self.testing_output
+
+        if len(self.inputs) >= len(self.testing_output):
+            raise ExecuteError("Ran out of test input after {0} values"
+                .format(len(self.testing_output)))
+        return self.testing_output[len(self.inputs)]
 
     #def smart_error(self, instr, mem_size): pass
 
-    def execute_bytecode(self, mem, memory_size=100):
+    def execute_bytecode(self, mem, memory_size=100, *, start=0, ac=0, quiet=False, trace=None,
+            pause=False, prefix=None):
         """
-        Run and execute Little Man instruction codes.
+        Run and execute Little Man instruction codes, from the
+        instruction at 'start' with 'ac' in the AC. 'mem' is changed in place.
+
+        With 'quiet' only the output of the program is printed.
+        'trace(pc, ac)' is called before every instruction.
+
+        With 'pause' it stops before the first 'INP' or 'HLT' instead,
+        and 'paused_at' is the address of it.
+
+        'prefix' is a 'Prefix' that was run ahead into 'mem', its output
+        is printed first and the program starts where it stopped. Its
+        cycles are counted as well.
         """
         # Initialize
-        ac = 0
-        pc = 0
+        pc = start
+        bank = None
         running = True
         mem_size = memory_size
         output = []
+        self.cycles = 0
+        self.skipped = 0
+        self.inputs = []
+        self.paused_at = None
+        loops = LoopAccelerator(mem_size) if self.accelerate and not self.banked and trace is None \
+            else None
+
+        if not quiet:
+            print("Program Output:")
 
-        print("Program Output:")
+        if prefix is not None:
+            pc = prefix.start
+            self.cycles = prefix.cycles
+            for value in prefix.output:
+                print(str(value))
+                output.append(str(value))
 
         # Run instruction cycle
         while running:
@@ -28,31 +94,67 @@ class Executor():
                 raise ExecuteError("Program Counter is out of range ({0}) ".format(str(pc))
                     + "Are you missing a 'HLT' instruction?")
 
+            if self.max_cycles is not None and self.cycles >= self.max_cycles:
+                raise ExecuteError("Stopped after {0} cycles".format(self.cycles))
+
+            if trace is not None:
+                trace(pc, ac)
+
             # Fetch
             instr = mem[pc]
             pc += 1
+            self.cycles += 1
+
+            op = instr // mem_size
+            adr = instr % mem_size
+            if self.banked:
+                if op == 4: # BNK, the next instruction uses bank 'adr'
+                    bank = adr
+                    continue
+                # without a bank, the address is in the bank of the instruction
+                adr += (bank if bank is not None else (pc - 1) // mem_size) * mem_size
+                bank = None
 
             # Add, Subtract
-            if instr // mem_size == 1:   # ADD
-                ac += mem[instr % mem_size]
-            elif instr // mem_size == 2: # SUB
-                ac -= mem[instr % mem_size]
+            if op == 1:   # ADD
+                ac += mem[adr]
+            elif op == 2: # SUB
+                ac -= mem[adr]
 
             # Store and load
-            elif instr // mem_size == 3: # STA
-                mem[instr % mem_size] = ac
-            elif instr // mem_size == 5: # LDA
-                ac = mem[instr % mem_size]
+            elif op == 3: # STA
+                mem[adr] = ac
+                if loops is not None and adr in loops.code:
+                    loops.invalidate()
+            elif op == 5: # LDA
+                ac = mem[adr]
+
+            # Test and set, the only thing that is shared between cores
+            elif op == 4: # TAS
+                with self.lock:
+                    ac = mem[adr]
+                    mem[adr] = 1
 
             # Branch operations
-            elif instr // mem_size == 6: # BRA
-                pc = instr % mem_size
-            elif instr // mem_size == 7: # BRZ
+            elif op == 6: # BRA
+                if adr < pc and loops is not None:
+                    ac = self._skip_loop(loops, mem, adr, pc - 1, ac)
+                pc = adr
+            elif op == 7: # BRZ
                 if ac == 0:
-                    pc = instr % mem_size
-            elif instr // mem_size == 8: # BRP
+                    if adr < pc and loops is not None:
+                        ac = self._skip_loop(loops, mem, adr, pc - 1, ac)
+                    pc = adr
+            elif op == 8: # BRP
                 if ac > 0:
-                    pc = instr % mem_size
+                    if adr < pc and loops is not None:
+                        ac = self._skip_loop(loops, mem, adr, pc - 1, ac)
+                    pc = adr
+
+            elif pause and instr in [(9 * mem_size) + 1, 0]: # INP or HLT, stop before it
+                self.cycles -= 1
+                self.paused_at = pc - 1
+                break
 
             # I/O
             elif instr == (9 * mem_size) + 1:  # INP
@@ -60,7 +162,8 @@ class Executor():
                 if not self.testing:
                     ac = int(input("Input: "))
                 else:
-                    ac = self.testing_output
+                    ac = self._next_test_input()
+                self.inputs.append(ac)
             elif instr == (9 * mem_size) + 2:  # OUT
                 print(str(ac))
                 output.append(str(ac))
@@ -74,5 +177,19 @@ class Executor():
                 #self.smart_error(instr, mem_size) # try to give a smart error
                 raise ExecuteError("Unknown instruction: \'{0}\'".format(instr))
 
-        print("Finished.")
+        if loops is not None:
+            self.skipped = loops.skipped
+        if not quiet:
+            print("Finished.")
         return output
+
+    def _skip_loop(self, loops, mem, head, end, ac):
+        """
+        skip the iterations of the loop from 'head' to the branch at 'end',
+        returns the AC after them.
+        """
+        length = end - head + 1
+        left = None if self.max_cycles is None else (self.max_cycles - self.cycles) // length
+        (ac, iterations) = loops.skip(mem, head, end, ac, left)
+        self.cycles += iterations * length
+        return ac
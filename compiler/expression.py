@@ -2,7 +2,8 @@ import random
 from compiler.token import TokenType, SYMBOLS, KEYWORDS
 from compiler.tokenizer import Token
 from compiler.instruction import Instruction, AsmExpressionContainer, JumpFlag
-from compiler.memory import Memory
+from compiler.arithmetic import Arithmetic
+from compiler.utils import Utils
 
 class Stack:
     def __init__(self): self.items = []
@@ -24,6 +25,9 @@ class Expression:
 
 
 class ExpressionSolver:
+    def __init__(self):
+        self.arithmetic = Arithmetic()
+
     def solve_expr(self, tokens, variables, functions=None):
         #tokens = expression.tokens
         #print("eval expression: " + str(expression)) # debug
@@ -39,16 +43,40 @@ class ExpressionSolver:
             print("eval result: error") # debug
             return None
 
-    def gen_runtime_expression(self, tokens, memory, functions=None, *, result_var=None):
+    def fold_expr(self, tokens, constants):
+        """
+        Try to evaluate an expression at compile time.
+
+        'constants' maps identifiers to values that are known at this
+        point in the program. Returns the value as an int, or None if
+        the expression depends on a value only known at runtime.
+        """
+        rpn_notation = self._apply_shunting_yard(tokens, None, substitute_vars=False)
+        folded = self._fold_rpn(rpn_notation, constants)
+
+        if len(folded) == 1 and Utils.is_int(folded[0].value):
+            return int(folded[0].value)
+        return None
+
+    def gen_runtime_expression(self, tokens, memory, functions=None, *, result_var=None, constants=None):
         rpn_notation = self._apply_shunting_yard(tokens, None, substitute_vars=False)
 
+        if constants is not None:
+            rpn_notation = self._fold_rpn(rpn_notation, constants)
+
         stack = Stack()
         asm = AsmExpressionContainer(tokens)
 
         # print("rpn_notation: " + str([str(t.value) for t in rpn_notation])) # debug
 
-        temp = Memory.gen_temp_name()
-        memory.add_reference(temp)
+        def mem_name(var):
+            if Utils.is_int(var.value): #var.token == TokenType.IntValue:
+                name = memory.gen_temp_name()
+                memory.add_reference(name, var.value)
+                return name
+            return var.value
+
+        temp = None
 
         for t in rpn_notation:
             if t.token == TokenType.Identifier:
@@ -59,27 +87,37 @@ class ExpressionSolver:
                 var2 = stack.pop()
                 var1 = stack.pop()
 
-                if var1.value.isdigit(): #var1.token == TokenType.IntValue:
-                    var1_name = Memory.gen_temp_name()
-                    memory.add_reference(var1_name, var1.value)
-                else:
-                    var1_name = var1.value
-
-                if var2.value.isdigit(): #.token == TokenType.IntValue:
-                    var2_name = Memory.gen_temp_name()
-                    memory.add_reference(var2_name, var2.value)
-                else:
-                    var2_name = var2.value
+                # every result gets its own temp, so that
+                # it's not overwritten by the other operand.
+                temp = memory.gen_temp_name()
+                memory.add_reference(temp)
 
                 if t.token == TokenType.Add:
-                    asm.load(var1_name)
-                    asm.add(Instruction("ADD", variable=var2_name))
-                    asm.store(temp)
+                    asm.load(mem_name(var1))
+                    asm.add(Instruction("ADD", variable=mem_name(var2)))
                 elif t.token == TokenType.Sub:
-                    asm.load(var1_name)
-                    asm.add(Instruction("SUB", variable=var2_name))
-                    asm.store(temp)
-
+                    asm.load(mem_name(var1))
+                    asm.add(Instruction("SUB", variable=mem_name(var2)))
+                elif t.token == TokenType.Mul:
+                    if Utils.is_int(var2.value):
+                        var1_name = mem_name(var1)
+                        asm.load(var1_name)
+                        self.arithmetic.gen_mul_const(asm, memory, var1_name, int(var2.value))
+                    elif Utils.is_int(var1.value):
+                        var2_name = mem_name(var2)
+                        asm.load(var2_name)
+                        self.arithmetic.gen_mul_const(asm, memory, var2_name, int(var1.value))
+                    else:
+                        self.arithmetic.gen_mul(asm, memory, mem_name(var1), mem_name(var2))
+                elif t.token == TokenType.Div:
+                    if Utils.is_int(var2.value):
+                        var1_name = mem_name(var1)
+                        asm.load(var1_name)
+                        self.arithmetic.gen_div_const(asm, memory, var1_name, int(var2.value))
+                    else:
+                        self.arithmetic.gen_div(asm, memory, mem_name(var1), mem_name(var2))
+
+                asm.store(temp)
                 stack.push(Token(temp, TokenType.Identifier))
 
             else:
@@ -91,6 +129,140 @@ class ExpressionSolver:
         return asm
 
 
+    def gen_tree_expression(self, tokens, memory, *, result_var=None, constants=None):
+        """
+        Like 'gen_runtime_expression', but the expression is turned into
+        a tree first, so every result can stay in the AC for the operator
+        that uses it. A value is only stored in a temp when the other
+        operand has to be computed first, and the temps are reused.
+
+        Both sides of a '+' are complex: the side that needs the most
+        temps is computed first (Sethi-Ullman). For '-' the right side
+        is computed and stored first, since the AC can only be subtracted
+        from.
+        """
+        rpn_notation = self._apply_shunting_yard(tokens, None, substitute_vars=False)
+        if constants is not None:
+            rpn_notation = self._fold_rpn(rpn_notation, constants)
+
+        asm = AsmExpressionContainer(tokens)
+        self._gen_tree(self._as_tree(rpn_notation), asm, memory, [])
+        asm.store(result_var)
+        return asm
+
+    def _as_tree(self, rpn_notation):
+        """
+        returns the root of the tree, a leaf is a 'Token' and
+        an operator is a tuple of '(operator, left, right)'.
+        """
+        stack = Stack()
+        for t in rpn_notation:
+            if self._is_operator(t):
+                right = stack.pop()
+                left = stack.pop()
+                stack.push((t.token, left, right))
+            else:
+                stack.push(t)
+        return stack.pop()
+
+    def _need(self, node):
+        """
+        returns how many temps are used at once to compute 'node' in the AC.
+        """
+        if isinstance(node, Token):
+            return 0
+
+        (op, left, right) = node
+        if op in [TokenType.Mul, TokenType.Div]:
+            # the operands are kept in memory
+            return max(self._need(left), self._need(right)) + 1
+        if isinstance(right, Token):
+            return self._need(left)
+        if op == TokenType.Add and isinstance(left, Token):
+            return self._need(right)
+        if op == TokenType.Add:
+            (first, second) = sorted([self._need(left), self._need(right)], reverse=True)
+            return max(first, second + 1)
+        return max(self._need(right), self._need(left) + 1)
+
+    def _gen_tree(self, node, asm, memory, free):
+        """
+        generate the code that leaves 'node' in the AC. 'free' has
+        the temps of this expression that can be used again.
+        """
+        if isinstance(node, Token):
+            asm.load(self._leaf_name(node, memory))
+            return
+
+        (op, left, right) = node
+        if op in [TokenType.Add, TokenType.Sub]:
+            instruction = "ADD" if op == TokenType.Add else "SUB"
+            if isinstance(right, Token):
+                self._gen_tree(left, asm, memory, free)
+                asm.add(Instruction(instruction, variable=self._leaf_name(right, memory)))
+            elif op == TokenType.Add and isinstance(left, Token):
+                self._gen_tree(right, asm, memory, free)
+                asm.add(Instruction("ADD", variable=self._leaf_name(left, memory)))
+            else:
+                (first, second) = (right, left)
+                if op == TokenType.Add and self._need(left) > self._need(right):
+                    (first, second) = (left, right)
+                temp = self._spill(first, asm, memory, free)
+                self._gen_tree(second, asm, memory, free)
+                asm.add(Instruction(instruction, variable=temp))
+                free.append(temp)
+
+        elif isinstance(right, Token) and Utils.is_int(right.value) or \
+                op == TokenType.Mul and isinstance(left, Token) and Utils.is_int(left.value):
+            # by a constant, 'src' holds the same value as the AC
+            (operand, c) = (left, int(right.value)) if isinstance(right, Token) \
+                and Utils.is_int(right.value) else (right, int(left.value))
+            if isinstance(operand, Token):
+                src = self._leaf_name(operand, memory)
+                asm.load(src)
+            else:
+                src = self._spill(operand, asm, memory, free)
+            if op == TokenType.Mul:
+                self.arithmetic.gen_mul_const(asm, memory, src, c)
+            else:
+                self.arithmetic.gen_div_const(asm, memory, src, c)
+            if not isinstance(operand, Token):
+                free.append(src)
+
+        else:
+            a = self._operand_name(left, asm, memory, free)
+            b = self._operand_name(right, asm, memory, free)
+            if op == TokenType.Mul:
+                self.arithmetic.gen_mul(asm, memory, a, b)
+            else:
+                self.arithmetic.gen_div(asm, memory, a, b)
+            free.extend([n for (n, child) in [(a, left), (b, right)] if not isinstance(child, Token)])
+
+    def _spill(self, node, asm, memory, free):
+        """
+        compute 'node' and store it in a temp, returns the temp.
+        """
+        self._gen_tree(node, asm, memory, free)
+        if len(free) != 0:
+            temp = free.pop()
+        else:
+            temp = memory.gen_temp_name()
+            memory.add_reference(temp)
+        asm.store(temp)
+        return temp
+
+    def _operand_name(self, node, asm, memory, free):
+        if isinstance(node, Token):
+            return self._leaf_name(node, memory)
+        return self._spill(node, asm, memory, free)
+
+    def _leaf_name(self, token, memory):
+        if Utils.is_int(token.value):
+            name = memory.gen_temp_name()
+            memory.add_reference(name, token.value)
+            return name
+        return token.value
+
     def _apply_rpn(self, token_list):
         stack = Stack()
 
@@ -115,6 +287,42 @@ class ExpressionSolver:
 
         return None # default, should cause error
 
+    def _fold_rpn(self, token_list, constants):
+        """
+        Replace every constant subexpression of an RPN token list with
+        its value. Known constant variables are substituted first.
+
+        Returns a new RPN token list.
+        """
+        stack = Stack()
+
+        for t in token_list:
+            if t.token == TokenType.Identifier:
+                if Utils.is_int(t.value):
+                    stack.push(int(t.value))
+                elif str(t.value) in constants:
+                    stack.push(int(constants[str(t.value)]))
+                else:
+                    stack.push([t])
+            elif self._is_operator(t):
+                right = stack.pop()
+                left = stack.pop()
+
+                # leave division by zero for the runtime to deal with
+                div_zero = t.token == TokenType.Div and right == 0
+                if isinstance(left, int) and isinstance(right, int) and not div_zero:
+                    stack.push(self._eval_operator(t.token,
+                        Token(left, TokenType.Identifier), Token(right, TokenType.Identifier)))
+                else:
+                    stack.push(self._as_rpn(left) + self._as_rpn(right) + [t])
+
+        return self._as_rpn(stack.pop())
+
+    def _as_rpn(self, item):
+        if isinstance(item, int):
+            return [Token(str(item), TokenType.Identifier)]
+        return item
+
     def _apply_shunting_yard(self, tokens, variables, substitute_vars=True):
         output = []
         op = Stack()
@@ -197,7 +405,11 @@ class ExpressionSolver:
         elif token == TokenType.Mul:
             return int(left.value) * int(right.value)
         elif token == TokenType.Div:
-            return int(left.value) / int(right.value)
+            # integer division that truncates towards zero
+            quotient = abs(int(left.value)) // abs(int(right.value))
+            if (int(left.value) < 0) != (int(right.value) < 0):
+                return -quotient
+            return quotient
 
     def _debug_print(self, output, op_stack):
         print("Output: {0} \t Stack: {1}".format(
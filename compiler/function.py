@@ -0,0 +1,78 @@
+from compiler.expression import Expression
+from compiler.tokenizer import Token
+from compiler.token import TokenType
+from compiler.outline import CALL_WORDS
+
+# Call sites inside a loop inline functions up to this many instructions,
+# since the call would cost cycles on every iteration.
+HOT_INLINE_SIZE = 12
+
+class Function:
+    """
+    A function declared with 'def name(params) { ... }'.
+
+    The parameters and the variables the function assigns to are local
+    to it, and are renamed to '<function>.<name>' so they get their own
+    memory. Every function has one set of parameters and one return
+    address, so functions can't be recursive.
+
+    The return value is left in the AC.
+    """
+
+    def __init__(self, name, params, expression, assigned_names, memory):
+        self.name = name
+        self.params = [self.local_name(p) for p in params]
+        self.expression = expression
+        self.assigned = set([self.local_name(n) for n in assigned_names])
+        self.locals = self.assigned | set(self.params)
+
+        local_names = set(params) | set(assigned_names)
+        self.expressions = self.rename(expression.expressions,
+            { n: Token(self.local_name(n), TokenType.Identifier) for n in local_names })
+
+        # call sites in the program
+        self.calls = 0
+        # instructions in the body, measured the first time it's needed
+        self.size = None
+
+        # a function that is called without being inlined gets a body
+        # after the program, its last instruction is a 'BRA' that the
+        # caller patches to return to the jump endpoints in 'returns'.
+        # With banked memory the 'BNK' in front of it is patched too,
+        # then 'exit' is the 'BNK' and 'back' is the 'BRA'.
+        self.entry = memory.gen_jump_name()
+        self.exit = memory.gen_jump_name()
+        self.back = memory.gen_jump_name()
+        self.returns = []
+        self.linked = False
+        self.compiled = False
+
+    def local_name(self, name):
+        return "{0}.{1}".format(self.name, name)
+
+    def should_inline(self, size, *, hot):
+        """
+        Inline functions that are only called once, that are no larger
+        than a call, or that are small and called from a loop.
+        """
+        if self.calls <= 1 or size <= CALL_WORDS:
+            return True
+        return hot and size <= HOT_INLINE_SIZE
+
+    @staticmethod
+    def rename(expressions, mapping):
+        """
+        returns a copy of the expressions, where the identifiers
+        in 'mapping' are replaced by the mapped token.
+        """
+        result = []
+        for e in expressions:
+            tokens = []
+            for t in e.tokens:
+                if t.token == TokenType.Identifier and t.value in mapping:
+                    m = mapping[t.value]
+                    tokens.append(Token(m.value, m.token, t.line, t.column))
+                else:
+                    tokens.append(t)
+            result.append(Expression(tokens, Function.rename(e.expressions, mapping)))
+        return result
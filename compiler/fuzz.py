@@ -0,0 +1,365 @@
+import ast, contextlib, io, random
+from compiler.compiler import ScriptCompiler
+from compiler.executor import Executor
+from compiler.error import ExecuteError
+
+# large enough that every program fits, even without optimizing
+MEM_SIZE = 10000
+
+# programs that run longer than this are skipped, not failed
+MAX_CYCLES = 200000
+
+# (name, keyword arguments of ScriptCompiler), the first one is the baseline
+SETTINGS = [
+    ("O0", { "opt_level": 0 }),
+    ("O1", { "opt_level": 1 }),
+    ("O2", { "opt_level": 2 }),
+    ("O2 no peephole", { "opt_level": 2, "peephole": False }),
+    ("O2 size", { "opt_level": 2, "opt_size": True }),
+    ("O2 banked", { "opt_level": 2, "banked": True, "mem_size": 50 }),
+]
+
+class ScriptGenerator:
+    """
+    Random valid scripts, as a list of statements:
+
+        ("assign", name, expression)
+        ("print", name)
+        ("read", name)
+        ("if", expression, statements)
+        ("while", counter, count, statements)
+
+    Expressions are kept as script text. Every 'while' counts its own
+    counter down from a small number, so every program stops.
+    """
+
+    def __init__(self, seed=0, *, variables=4, statements=12, depth=3):
+        self.random = random.Random(seed)
+        self.variables = ["v{0}".format(i) for i in range(variables)]
+        self.statements = statements
+        self.depth = depth
+        self.counters = 0
+
+    def program(self):
+        self.counters = 0
+        return self._block(self.statements, self.depth)
+
+    def _block(self, n, depth):
+        r = self.random
+        block = []
+        for _ in range(r.randint(1, n)):
+            choice = r.random()
+            name = r.choice(self.variables)
+            if choice < 0.45:
+                block.append(("assign", name, self.expression(2)))
+            elif choice < 0.65:
+                block.append(("print", name))
+            elif choice < 0.75:
+                block.append(("read", name))
+            elif choice < 0.9 and depth > 0:
+                block.append(("if", self.condition(), self._block(n // 2, depth - 1)))
+            elif depth > 0:
+                counter = "k{0}".format(self.counters)
+                self.counters += 1
+                block.append(("while", counter, r.randint(0, 3), self._block(n // 2, depth - 1)))
+        return block
+
+    def condition(self):
+        if self.random.random() < 0.5:
+            return self.expression(1)
+        op = self.random.choice(["==", "!=", "<", ">", "<=", ">="])
+        return "{0} {1} {2}".format(self.expression(1), op, self.expression(1))
+
+    def expression(self, depth):
+        r = self.random
+        if depth == 0 or r.random() < 0.3:
+            if r.random() < 0.6:
+                return r.choice(self.variables)
+            return str(r.randint(0, 20))
+
+        op = r.choice(["+", "-", "*", "/"])
+        left = self._operand(depth)
+        # multiplying or dividing by a variable loops at runtime,
+        # mostly use small numbers to keep the programs short
+        if op in ["*", "/"] and r.random() < 0.8:
+            right = str(r.randint(0, 12))
+        else:
+            right = self._operand(depth)
+        return "{0} {1} {2}".format(left, op, right)
+
+    def _operand(self, depth):
+        e = self.expression(depth - 1)
+        if " " in e and self.random.random() < 0.6:
+            return "(" + e + ")"
+        return e
+
+    def inputs(self, n=64):
+        return [self.random.randint(-5, 20) for _ in range(n)]
+
+    def render(self, program):
+        lines = ["{0} = 0;".format(v) for v in self.variables]
+        lines += ["{0} = 0;".format(c) for c in sorted(self._counters(program))]
+        self._render(program, lines, 0)
+        return "\n".join(lines)
+
+    def _render(self, block, lines, indent):
+        pad = "    " * indent
+        for s in block:
+            if s[0] == "assign":
+                lines.append("{0}{1} = {2};".format(pad, s[1], s[2]))
+            elif s[0] == "print":
+                lines.append("{0}print({1});".format(pad, s[1]))
+            elif s[0] == "read":
+                lines.append("{0}read({1});".format(pad, s[1]))
+            elif s[0] == "if":
+                lines.append("{0}if ({1}) {{".format(pad, s[1]))
+                self._render(s[2], lines, indent + 1)
+                lines.append(pad + "}")
+            elif s[0] == "while":
+                lines.append("{0}{1} = {2};".format(pad, s[1], s[2]))
+                lines.append("{0}while ({1}) {{".format(pad, s[1]))
+                self._render(s[3], lines, indent + 1)
+                lines.append("{0}    {1} = {1} - 1;".format(pad, s[1]))
+                lines.append(pad + "}")
+
+    def _counters(self, block):
+        counters = set()
+        for s in block:
+            if s[0] == "if":
+                counters |= self._counters(s[2])
+            elif s[0] == "while":
+                counters.add(s[1])
+                counters |= self._counters(s[3])
+        return counters
+
+
+class Reference:
+    """
+    Runs a generated program directly in Python, with the semantics of
+    the compiled program: division truncates toward zero, dividing by
+    zero gives zero, any value except zero is true and a comparison
+    is 1 or 0.
+    """
+
+    def __init__(self, inputs, *, max_steps=MAX_CYCLES):
+        self.inputs = list(inputs)
+        self.max_steps = max_steps
+        self.steps = 0
+        self.variables = {}
+        self.output = []
+
+    def run(self, program):
+        self._block(program)
+        return self.output
+
+    def _block(self, block):
+        for s in block:
+            self.steps += 1
+            if self.steps > self.max_steps:
+                raise ExecuteError("Stopped after {0} steps".format(self.steps))
+
+            if s[0] == "assign":
+                self.variables[s[1]] = self.evaluate(s[2])
+            elif s[0] == "print":
+                self.output.append(str(self.variables.get(s[1], 0)))
+            elif s[0] == "read":
+                if len(self.inputs) == 0:
+                    raise ExecuteError("Ran out of input")
+                self.variables[s[1]] = self.inputs.pop(0)
+            elif s[0] == "if":
+                if self.evaluate(s[1]) != 0:
+                    self._block(s[2])
+            elif s[0] == "while":
+                self.variables[s[1]] = s[2]
+                while self.variables[s[1]] != 0:
+                    self._block(s[3])
+                    self.variables[s[1]] -= 1
+
+    def evaluate(self, expression):
+        return self._evaluate(ast.parse(expression, mode="eval").body)
+
+    def _evaluate(self, node):
+        if isinstance(node, ast.Constant):
+            return node.value
+        if isinstance(node, ast.Name):
+            return self.variables.get(node.id, 0)
+        if isinstance(node, ast.Compare):
+            compare = {
+                ast.Eq: lambda a, b: a == b,
+                ast.NotEq: lambda a, b: a != b,
+                ast.Lt: lambda a, b: a < b,
+                ast.Gt: lambda a, b: a > b,
+                ast.LtE: lambda a, b: a <= b,
+                ast.GtE: lambda a, b: a >= b
+            }[type(node.ops[0])]
+            return 1 if compare(self._evaluate(node.left), self._evaluate(node.comparators[0])) else 0
+
+        left = self._evaluate(node.left)
+        right = self._evaluate(node.right)
+        if isinstance(node.op, ast.Add):
+            return left + right
+        if isinstance(node.op, ast.Sub):
+            return left - right
+        if isinstance(node.op, ast.Mult):
+            return left * right
+        if right == 0:
+            return 0
+        quotient = abs(left) // abs(right)
+        return quotient if (left < 0) == (right < 0) else -quotient
+
+
+class FuzzReport:
+    """
+    The failures found, and the instructions and cycles every setting
+    needed in total over the programs that ran everywhere.
+    """
+
+    def __init__(self, settings):
+        self.settings = [name for (name, _) in settings]
+        self.programs = 0
+        self.skipped = 0
+        self.failures = []
+        self.instructions = { name: 0 for name in self.settings }
+        self.cycles = { name: 0 for name in self.settings }
+
+    def __str__(self):
+        base = self.settings[0]
+        lines = ["Fuzzed {0} programs, {1} skipped, {2} failed".format(
+            self.programs, self.skipped, len(self.failures))]
+        lines.append("   {0:<16} {1:>12} {2:>8} {3:>12} {4:>8}".format(
+            "setting", "instructions", "delta", "cycles", "delta"))
+        for name in self.settings:
+            lines.append("   {0:<16} {1:>12} {2:>7.1f}% {3:>12} {4:>7.1f}%".format(name,
+                self.instructions[name], self._delta(self.instructions, name, base),
+                self.cycles[name], self._delta(self.cycles, name, base)))
+        for f in self.failures:
+            lines.append("\n" + str(f))
+        return "\n".join(lines)
+
+    @staticmethod
+    def _delta(values, name, base):
+        if values[base] == 0:
+            return 0.0
+        return (values[name] - values[base]) * 100 / values[base]
+
+
+class FuzzFailure:
+    def __init__(self, setting, script, inputs, expected, got):
+        self.setting = setting
+        self.script = script
+        self.inputs = inputs
+        self.expected = expected
+        self.got = got
+
+    def __str__(self):
+        return "{0}: expected {1}, got {2}\ninputs: {3}\n{4}".format(
+            self.setting, self.expected, self.got, self.inputs, self.script)
+
+
+class Fuzzer:
+    """
+    Checks that every setting in 'SETTINGS' compiles random programs to
+    the same output as the 'Reference', and adds up what each setting
+    costs in instructions and cycles.
+
+    A failing program is shrunk, by removing statements for as long as
+    it keeps failing, before it's reported.
+    """
+
+    def __init__(self, *, seed=0, settings=SETTINGS, max_cycles=MAX_CYCLES, shrink=True):
+        self.seed = seed
+        self.settings = settings
+        self.max_cycles = max_cycles
+        self.shrink = shrink
+
+    def run(self, count, *, verbose=False):
+        report = FuzzReport(self.settings)
+        for n in range(count):
+            generator = ScriptGenerator(self.seed + n)
+            program = generator.program()
+            inputs = generator.inputs()
+
+            result = self.check(generator, program, inputs)
+            report.programs += 1
+            if result is None:
+                report.skipped += 1
+            elif isinstance(result, FuzzFailure):
+                if self.shrink:
+                    result = self._shrink(generator, program, inputs, result)
+                report.failures.append(result)
+            else:
+                for name, (instructions, cycles) in result.items():
+                    report.instructions[name] += instructions
+                    report.cycles[name] += cycles
+
+            if verbose:
+                print("{0}: {1}".format(self.seed + n, "skipped" if result is None
+                    else "FAILED" if isinstance(result, FuzzFailure) else "ok"))
+
+        return report
+
+    def check(self, generator, program, inputs):
+        """
+        returns a 'FuzzFailure', None if the program runs too long, or the
+        instructions and cycles of every setting.
+        """
+        script = generator.render(program)
+        try:
+            expected = Reference(inputs, max_steps=self.max_cycles).run(program)
+        except ExecuteError:
+            return None
+
+        costs = {}
+        for (name, options) in self.settings:
+            try:
+                (output, instructions, cycles) = self.run_setting(script, inputs, options)
+            except ExecuteError as e:
+                if "Stopped after" in str(e) and name == self.settings[0][0]:
+                    return None
+                return FuzzFailure(name, script, inputs, expected, str(e))
+            except Exception as e:
+                return FuzzFailure(name, script, inputs, expected,
+                    "{0}: {1}".format(type(e).__name__, e))
+
+            if output != expected:
+                return FuzzFailure(name, script, inputs, expected, output)
+            costs[name] = (instructions, cycles)
+
+        return costs
+
+    def run_setting(self, script, inputs, options):
+        """
+        returns the output, the number of instructions and the cycles.
+        """
+        options = dict({ "mem_size": MEM_SIZE }, **options)
+        with contextlib.redirect_stdout(io.StringIO()):
+            c = ScriptCompiler(testing=True, **options)
+            bytecode = c.compile_to_bytecode(script)
+            executor = Executor(testing=True, test_input=inputs, max_cycles=self.max_cycles,
+                banked=c.banked)
+            output = executor.execute_bytecode(bytecode, c.mem_size)
+        return output, len(bytecode), executor.cycles
+
+    def _shrink(self, generator, program, inputs, failure):
+        shrinking = True
+        while shrinking:
+            shrinking = False
+            for smaller in self._smaller(program):
+                result = self.check(generator, smaller, inputs)
+                if isinstance(result, FuzzFailure):
+                    (program, failure, shrinking) = (smaller, result, True)
+                    break
+        return failure
+
+    def _smaller(self, block):
+        """
+        every program with one statement less, or one block emptied.
+        """
+        for i, s in enumerate(block):
+            yield block[:i] + block[i + 1:]
+            if s[0] == "if":
+                for inner in self._smaller(s[2]):
+                    yield block[:i] + [(s[0], s[1], inner)] + block[i + 1:]
+            elif s[0] == "while":
+                for inner in self._smaller(s[3]):
+                    yield block[:i] + [(s[0], s[1], s[2], inner)] + block[i + 1:]
@@ -0,0 +1,138 @@
+from compiler.cfg import ControlFlowGraph
+from compiler.dataflow import AC, uses, defs, Liveness, AvailableValues
+
+class GlobalStats:
+    def __init__(self):
+        self.unreachable_removed = 0
+        self.copies_propagated = 0
+        self.loads_removed = 0
+        self.dead_removed = 0
+
+    def __str__(self):
+        return "Global: {0} unreachable, {1} redundant loads and {2} dead instructions removed, " \
+            "{3} copies propagated".format(self.unreachable_removed, self.loads_removed,
+                self.dead_removed, self.copies_propagated)
+
+
+class GlobalOptimizer:
+    """
+    Optimizations that needs to look at the whole program, built on the
+    control-flow graph and the data-flow analyses.
+
+    Works on a list of 'Instruction' where the JumpFlags have been
+    merged into the instructions, but before memory and jumps are bound.
+    """
+
+    def __init__(self, *, live_at_exit=None):
+        self.stats = GlobalStats()
+        self.live_at_exit = live_at_exit
+
+    def optimize(self, instructions):
+        """
+        Run all the passes until none of them can change anything.
+
+        Returns a new list of instructions.
+        """
+        code = list(instructions)
+
+        changed = True
+        while changed:
+            changed = False
+            (code, c) = self.remove_unreachable_blocks(code)
+            changed = changed or c
+            (code, c) = self.propagate_copies(code)
+            changed = changed or c
+            (code, c) = self.eliminate_dead_code(code)
+            changed = changed or c
+
+        return code
+
+    def _remove(self, code, removed):
+        """
+        Returns the code without the instructions in 'removed', their jump
+        endpoints are moved to the next instruction that is kept.
+        """
+        result = []
+        pending = []
+        for inst in code:
+            if inst in removed:
+                pending.extend(inst.jumps)
+                continue
+            for j in pending:
+                inst.add_jump(j)
+            pending = []
+            result.append(inst)
+        return result
+
+    def remove_unreachable_blocks(self, code):
+        cfg = ControlFlowGraph(code)
+        reachable = cfg.reachable()
+
+        removed = set()
+        for block in cfg.blocks:
+            if block not in reachable:
+                removed.update(block.instructions)
+
+        if len(removed) == 0:
+            return code, False
+
+        # the jump endpoints of unreachable blocks can only be reached
+        # from other unreachable blocks, so they are dropped as well.
+        for inst in removed:
+            inst.jumps = []
+            inst.is_jump_endpoint = False
+
+        self.stats.unreachable_removed += len(removed)
+        return self._remove(code, removed), True
+
+    def propagate_copies(self, code):
+        """
+        Reads of a variable that holds a copy of another variable reads the
+        original instead, and loads of a value the AC already holds are removed.
+        """
+        cfg = ControlFlowGraph(code)
+        available = AvailableValues(cfg)
+
+        removed = set()
+        changed = False
+        for block in cfg.blocks:
+            for (inst, before, after) in available.instruction_values(block):
+                if inst.instruction == "LDA" and AvailableValues.holds(before, AC, inst.variable):
+                    removed.add(inst)
+                    self.stats.loads_removed += 1
+                    continue
+
+                if inst.instruction in ["LDA", "ADD", "SUB"]:
+                    copies = AvailableValues.copies_of(before, inst.variable)
+                    if len(copies) != 0:
+                        inst.variable = copies[0]
+                        self.stats.copies_propagated += 1
+                        changed = True
+
+        if len(removed) != 0:
+            return self._remove(code, removed), True
+        return code, changed
+
+    def eliminate_dead_code(self, code):
+        """
+        Remove stores to variables and computations in the AC
+        that are never read afterwards.
+        """
+        cfg = ControlFlowGraph(code)
+        liveness = Liveness(cfg, live_at_exit=self.live_at_exit)
+
+        removed = set()
+        for block in cfg.blocks:
+            for (inst, before, after) in liveness.instruction_values(block):
+                if inst.instruction not in ["STA", "LDA", "ADD", "SUB"]:
+                    continue
+
+                written = defs(inst)
+                if len(written) != 0 and len(written & after) == 0:
+                    removed.add(inst)
+
+        if len(removed) == 0:
+            return code, False
+
+        self.stats.dead_removed += len(removed)
+        return self._remove(code, removed), True
@@ -23,6 +23,18 @@ class Instruction:
         self.is_jump_endpoint = False
         self.jumps = []
 
+        # added to the address when the jump is bound, so that
+        # e.g. a 'MEM' can hold a 'BRA' to a jump endpoint.
+        self.adr_offset = 0
+        # the jumps a 'BRA' can go to when its address
+        # is patched while the program runs.
+        self.targets = []
+        # a 'MEM' with a jump holds the bank of the jump
+        # instead of its address, with banked memory.
+        self.bank = False
+        # the 'Expression' in the script the instruction was made for
+        self.statement = None
+
     def add_jump(self, jp_flag):
         if not self.is_jump_endpoint:
             self.is_jump_endpoint = True
@@ -44,13 +56,19 @@ class Instruction:
         # TODO: print comments "evenly?"
         return "" if self.comment is None else "\t\t# " + self.comment
 
-    def asm(self):
+    def asm(self, *, line_margin=0):
+        """
+        'line_margin' is added to addresses, use 1 for assembler
+        that is read from a file where the lines start at 1.
+        """
         s = ""
         if self.invalidate_binding or self.invalidate_jump_bindings:
             var = self.variable if self.invalidate_binding else self.jump
             s = "{0} <{1}>{2}".format(self.instruction, var, self._get_comment())
         elif self.has_adr:
-            s = "{0} {1}{2}".format(self.instruction, str(self.adr), self._get_comment())
+            # a 'MEM' holds a value and 'BNK' a bank, not an address
+            adr = self.adr if self.instruction in ["MEM", "BNK"] else self.adr + line_margin
+            s = "{0} {1}{2}".format(self.instruction, str(adr), self._get_comment())
         else:
             s = "{0}    {1}".format(self.instruction, self._get_comment())
 
@@ -0,0 +1,231 @@
+AC = "<AC>" # the accumulator at the start of an iteration
+
+class Loop:
+    """
+    A loop that can be skipped ahead: the instructions from 'head' to
+    the branch back at 'end', as (op, address), and the addresses the
+    loop stores to.
+    """
+
+    def __init__(self, head, end, code, written):
+        self.head = head
+        self.end = end
+        self.code = code
+        self.written = written
+
+    @property
+    def cycles(self):
+        return self.end - self.head + 1
+
+
+class LoopAccelerator:
+    """
+    Skips the iterations of simple counting loops, like the ones that
+    multiply and divide by adding and subtracting:
+
+        body    SUB one
+                STA count
+                LDA result
+                ADD addend
+                STA result
+                LDA count
+                BRP body
+
+    A loop is the code from where a branch jumps back to, to the branch,
+    with only 'ADD', 'SUB', 'LDA' and 'STA' in between, and branches that
+    leave the loop. One iteration is run symbolically, and every word it
+    stores to, and the AC, has to end up as its own value or the value of
+    another one, plus something that doesn't change in the loop. Then the
+    value at every iteration is linear, so the first iteration that leaves
+    the loop is known, and the ones before it are done at once.
+
+    The iteration that leaves the loop is run as usual, so the memory,
+    the AC and the cycles are exactly what running the loop would give.
+    """
+
+    def __init__(self, mem_size=100):
+        self.mem_size = mem_size
+        # (head, end) -> 'Loop', or None if it can't be skipped
+        self.loops = {}
+        # the addresses of the code in 'loops'
+        self.code = set()
+        self.skipped = 0
+
+    def invalidate(self):
+        """
+        forget the loops, after their code was stored to.
+        """
+        self.loops = {}
+        self.code = set()
+
+    def skip(self, mem, head, end, ac, max_iterations=None):
+        """
+        'mem' is at the start of the loop, with 'ac' in the AC. Skips the
+        iterations that don't leave the loop, at most 'max_iterations'.
+
+        returns the AC and the number of iterations skipped.
+        """
+        key = (head, end)
+        if key not in self.loops:
+            self.loops[key] = self._find(mem, head, end)
+            self.code.update(range(head, end + 1))
+        loop = self.loops[key]
+        if loop is None:
+            return ac, 0
+
+        summary = self._iterate(loop, mem)
+        if summary is None:
+            # it depends on the shape of the loop, not the values
+            self.loops[key] = None
+            return ac, 0
+        (values, branches) = summary
+
+        linear = self._linear(values, mem, ac)
+        if linear is None:
+            return ac, 0
+
+        iterations = None
+        for (op, value, leaves_when_taken) in branches:
+            k = self._first_exit(op, value, leaves_when_taken, linear, mem, ac)
+            if k is not None and (iterations is None or k < iterations):
+                iterations = k
+        if iterations is None:
+            return ac, 0 # never leaves, the cycle limit has to stop it
+        if max_iterations is not None:
+            iterations = min(iterations, max_iterations)
+        if iterations == 0:
+            return ac, 0
+
+        for (var, (a, b)) in linear.items():
+            if var == AC:
+                ac = a + b * iterations
+            else:
+                mem[var] = a + b * iterations
+        self.skipped += iterations
+        return ac, iterations
+
+    def _find(self, mem, head, end):
+        """
+        returns the 'Loop' from 'head' to 'end', or None.
+        """
+        code = []
+        written = set()
+        for adr in range(head, end + 1):
+            (op, a) = (mem[adr] // self.mem_size, mem[adr] % self.mem_size)
+            if op in [1, 2, 5]:
+                pass
+            elif op == 3:
+                if head <= a <= end:
+                    return None # changes its own code
+                written.add(a)
+            elif op in [7, 8] and adr != end:
+                if head <= a <= end:
+                    return None # a branch inside the loop
+            elif op in [6, 7, 8] and adr == end:
+                pass
+            else:
+                return None
+            code.append((op, a))
+        return Loop(head, end, code, written)
+
+    def _iterate(self, loop, mem):
+        """
+        runs one iteration symbolically. A value is '(base, delta)', the
+        value of 'base' at the start of the iteration plus 'delta', or
+        just 'delta' when 'base' is None.
+
+        returns the values at the end of the iteration, and every branch
+        as (op, the value in the AC, if it leaves the loop when taken).
+        """
+        values = { var: (var, 0) for var in loop.written }
+        acc = (AC, 0)
+        branches = []
+
+        def read(a):
+            return values[a] if a in loop.written else (None, mem[a])
+
+        for (idx, (op, a)) in enumerate(loop.code):
+            if op == 5: # LDA
+                acc = read(a)
+            elif op == 1: # ADD
+                (base, delta) = read(a)
+                if base is not None and acc[0] is not None:
+                    return None
+                acc = (acc[0] if base is None else base, acc[1] + delta)
+            elif op == 2: # SUB
+                (base, delta) = read(a)
+                if base is not None:
+                    return None
+                acc = (acc[0], acc[1] - delta)
+            elif op == 3: # STA
+                values[a] = acc
+            else:
+                branches.append((op, acc, idx != len(loop.code) - 1))
+
+        values[AC] = acc
+        return values, branches
+
+    @staticmethod
+    def _linear(values, mem, ac):
+        """
+        returns '{ var: (a, b) }' so that 'a + b * k' is the value of
+        'var' at the start of iteration 'k', for every 'k' from 1.
+        """
+        def initial(var):
+            return ac if var == AC else mem[var]
+
+        linear = {}
+        for (var, (base, delta)) in values.items():
+            if base is None:
+                linear[var] = (delta, 0)
+            elif base == var:
+                linear[var] = (initial(var), delta)
+            else:
+                # a copy of another value, from the iteration before
+                (other, step) = values[base]
+                if other != base:
+                    return None
+                linear[var] = (initial(base) - step + delta, step)
+        return linear
+
+    @staticmethod
+    def _first_exit(op, value, leaves_when_taken, linear, mem, ac):
+        """
+        returns the first iteration 'k' where the branch leaves the
+        loop, or None if it never does.
+        """
+        (base, delta) = value
+        if base is None:
+            (a, b) = (delta, 0)
+            first = delta
+        else:
+            (a, b) = linear[base]
+            (a, first) = (a + delta, (ac if base == AC else mem[base]) + delta)
+
+        def leaves(v):
+            taken = v == 0 if op == 7 else v > 0 if op == 8 else True
+            return taken == leaves_when_taken
+
+        if leaves(first):
+            return 0
+        if leaves(a + b):
+            return 1
+        # 'a + b * k' for k >= 1, find the first k where it leaves
+        if b == 0:
+            return None
+        if op == 6:
+            return None
+        if op == 7:
+            # BRZ, it changes when the value is zero
+            zero = -a // b if -a % b == 0 else None
+            if leaves_when_taken:
+                return zero if zero is not None and zero >= 1 else None
+            return 2 if leaves(a + b * 2) else None
+        # BRP, the value crosses zero once
+        if leaves_when_taken:
+            # leaves when it becomes positive
+            k = -a // b + 1 if b > 0 else None
+        else:
+            # leaves when it stops being positive, rounded up
+            k = -(-a // -b) if b < 0 else None
+        return max(k, 1) if k is not None and leaves(a + b * max(k, 1)) else None
@@ -3,13 +3,15 @@ from compiler.utils import Utils
 
 class Memory:
 
-    GlobalTempCount = 0
-    GlobalNameCount = 0
-    GlobalJumpCount = 0
-
     def __init__(self):
         self.memory = {}
 
+        # counters for the names made by this memory, so they
+        # only depend on what has been compiled with it.
+        self.temp_count = 0
+        self.name_count = 0
+        self.jump_count = 0
+
     def has_reference(self, identifier):
         """
         check if memory exists
@@ -29,20 +31,85 @@ class Memory:
 
     def add_reference(self, identifier, init_value=0):
         self.memory.update({ identifier: {"value": init_value, "line": -1} })
-        self.debug()
+        # printing the whole memory on every add is quadratic
+        print("Memory add:\t{0}:   {1}".format(identifier, init_value))
+        return identifier
+
+    def add_jump_reference(self, identifier, alias, offset=0, *, bank=False):
+        """
+        add a memory reference that holds the address of a jump
+        endpoint plus 'offset', which is only known after binding.
+
+        With 'bank' it holds the bank of the jump endpoint instead.
+        """
+        self.memory.update({ identifier: {"value": 0, "line": -1, "jump": alias, "offset": offset,
+            "bank": bank} })
         return identifier
 
+    def remove_reference(self, identifier):
+        """
+        remove a memory reference if it exists
+        """
+        if self.has_reference(identifier):
+            del self.memory[identifier]
+
+    def remove_unused(self, instructions, *, temps_only=True):
+        """
+        remove the references that no instruction refers to,
+        by default only the temp variables are removed.
+
+        returns the number of references removed.
+        """
+        used = set([inst.variable for inst in instructions if inst.variable is not None])
+        unused = [m for m in self.memory if m not in used
+            and (Memory.is_temp_name(m) or not temps_only)]
+        for m in unused:
+            self.remove_reference(m)
+        return len(unused)
+
+    def pool_constants(self, instructions):
+        """
+        make every instruction that reads a temp which is never written
+        to, read the first temp with the same initial value instead.
+
+        returns the number of instructions changed.
+        """
+        stored = set([inst.variable for inst in instructions if inst.instruction == "STA"])
+        pool = {}
+        changed = 0
+        for inst in instructions:
+            var = inst.variable
+            if var is None or var in stored or not Memory.is_temp_name(var):
+                continue
+
+            ref = self.get_reference(var)
+            if ref is None or "jump" in ref:
+                continue
+
+            value = str(ref["value"])
+            if value not in pool:
+                pool[value] = var
+            elif pool[value] != var:
+                inst.variable = pool[value]
+                changed += 1
+        return changed
+
     def gen_asm(self):
         """
         returns a list of 'Instruction' and 'JumpFlag'
         """
-        jump_id = Memory.gen_jump_name()
+        jump_id = self.gen_jump_name()
         inst = [Instruction("BRA", jump=jump_id, comment="jump over memory")]
 
         for idx, m in enumerate(self.memory):
             ref = self.memory[m]
 
-            i = Instruction("MEM", adr=ref["value"], comment="<{0}>".format(m))
+            if "jump" in ref:
+                i = Instruction("MEM", jump=ref["jump"], comment="<{0}>".format(m))
+                i.adr_offset = ref["offset"]
+                i.bank = ref["bank"]
+            else:
+                i = Instruction("MEM", adr=ref["value"], comment="<{0}>".format(m))
             inst.append(i)
 
             # Update the memory table so that we can use it
@@ -105,22 +172,23 @@ class Memory:
         for m in self.memory:
             print("\t{0}:   {1}".format(m, self.memory[m]["value"]))
 
-    ## Static methods
+    def gen_temp_name(self):
+        name = "temp_{0}".format(str(self.temp_count))
+        self.temp_count += 1
+        return name
 
-    @staticmethod
-    def gen_temp_name():
-        name = "temp_{0}".format(str(Memory.GlobalTempCount))
-        Memory.GlobalTempCount += 1
+    def gen_name(self):
+        name = "mem_{0}".format(str(self.name_count))
+        self.name_count += 1
         return name
 
-    @staticmethod
-    def gen_name():
-        name = "mem_{0}".format(str(Memory.GlobalNameCount))
-        Memory.GlobalNameCount += 1
+    def gen_jump_name(self):
+        name = "jump_{0}".format(str(self.jump_count))
+        self.jump_count += 1
         return name
 
+    ## Static methods
+
     @staticmethod
-    def gen_jump_name():
-        name = "jump_{0}".format(str(Memory.GlobalJumpCount))
-        Memory.GlobalJumpCount += 1
-        return name
+    def is_temp_name(name):
+        return str(name).startswith("temp_")
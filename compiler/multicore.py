@@ -0,0 +1,127 @@
+import contextlib, io, multiprocessing, time
+from multiprocessing import shared_memory
+from compiler.executor import Executor
+from compiler.stats import PipelineStats
+from compiler.error import ExecuteError
+
+# the size of a word in shared memory, as a 'memoryview' format
+WORD = "q"
+WORD_BYTES = 8
+
+class CoreResult:
+    def __init__(self, core, output, cycles, error):
+        self.core = core
+        self.output = output
+        self.cycles = cycles
+        self.error = error
+
+    def __str__(self):
+        if self.error is not None:
+            return "core {0}: failed after {1} cycles, {2}".format(self.core, self.cycles, self.error)
+        return "core {0}: {1} cycles, output {2}".format(self.core, self.cycles, self.output)
+
+
+class MultiCore:
+    """
+    Runs a program on several Little Men at once, each one in its own
+    process with its own AC and PC, over one memory image that is held
+    in shared memory. The words are 64-bit integers.
+
+    Every core starts at address 0 with its number in the AC, so the
+    program can give the cores different work. 'TAS x' loads x and sets
+    it to 1 in one step, which is enough for a spin lock:
+
+        wait    TAS lock    # 0 if the lock was free, and now it's taken
+                BRZ locked
+                BRA wait
+        locked  ...
+                LDA zero
+                STA lock    # release it
+
+    Banked memory is not supported, since 'BNK' is opcode 4 as well.
+    """
+
+    def __init__(self, cores=2, *, test_input=None, max_cycles=None, stats=None):
+        """
+        'test_input' is given to every core, like the 'Executor' takes it.
+        Without it a core can't read input.
+
+        The run is added to 'stats' as the phase "execute", with the
+        cycles of all the cores as its items.
+        """
+        self.cores = cores
+        self.test_input = test_input
+        self.max_cycles = max_cycles
+        self.stats = PipelineStats() if stats is None else stats
+        self.results = []
+        self.memory = []
+        self.seconds = 0
+
+    def run(self, bytecode, mem_size=100):
+        """
+        returns the output of every core, in the order of the cores.
+        The memory after the run is kept in 'memory'.
+        """
+        if len(bytecode) > mem_size:
+            raise ExecuteError("The program needs {0} words of memory, but there is only {1}"
+                .format(len(bytecode), mem_size))
+
+        shm = shared_memory.SharedMemory(create=True, size=mem_size * WORD_BYTES)
+        try:
+            image = shm.buf.cast(WORD)
+            for idx in range(mem_size):
+                image[idx] = bytecode[idx] if idx < len(bytecode) else 0
+
+            lock = multiprocessing.Lock()
+            queue = multiprocessing.Queue()
+            processes = [multiprocessing.Process(target=_run_core, args=(shm.name, core, mem_size,
+                lock, queue, self.test_input, self.max_cycles)) for core in range(self.cores)]
+
+            with self.stats.phase("execute") as phase:
+                start = time.perf_counter()
+                for p in processes:
+                    p.start()
+                # read the results before joining, a process with
+                # something left in the queue doesn't exit.
+                results = [queue.get() for _ in processes]
+                for p in processes:
+                    p.join()
+                self.seconds = time.perf_counter() - start
+                phase.items = sum([r[2] for r in results])
+
+            self.memory = list(image)
+            image.release()
+        finally:
+            shm.close()
+            shm.unlink()
+
+        self.results = sorted([CoreResult(*r) for r in results], key=lambda r: r.core)
+        for r in self.results:
+            if r.error is not None:
+                raise ExecuteError("Core {0}: {1}".format(r.core, r.error))
+        return [r.output for r in self.results]
+
+    def __str__(self):
+        lines = ["Ran {0} cores in {1:.1f} ms".format(self.cores, self.seconds * 1000)]
+        lines += ["   " + str(r) for r in self.results]
+        return "\n".join(lines)
+
+
+def _run_core(name, core, mem_size, lock, queue, test_input, max_cycles):
+    """
+    runs in the process of a core, until it halts.
+    """
+    shm = shared_memory.SharedMemory(name=name)
+    image = shm.buf.cast(WORD)
+    # a core has no terminal, without input it runs out at the first 'INP'
+    e = Executor(testing=True, test_input=[] if test_input is None else test_input,
+        max_cycles=max_cycles, lock=lock, accelerate=False)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            output = e.execute_bytecode(image, mem_size, ac=core)
+        queue.put((core, output, e.cycles, None))
+    except Exception as ex:
+        queue.put((core, [], e.cycles, str(ex)))
+    finally:
+        image.release()
+        shm.close()
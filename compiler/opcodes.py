@@ -0,0 +1,46 @@
+from compiler.error import ParseError
+
+# what the number after an instruction is
+ADDRESS = "address" # an address, lines start at 1 in '.man' files
+BANK = "bank"       # the number of a bank
+VALUE = "value"     # the value of the word itself
+
+# name -> (opcode, operand), the word is 'opcode * mem_size + operand'.
+# The instructions without a number have a fixed operand instead.
+OPCODES = {
+    "ADD": (1, ADDRESS),    # add X to AC
+    "SUB": (2, ADDRESS),    # sub X from AC
+    "STA": (3, ADDRESS),    # Store AC in X
+    "BNK": (4, BANK),       # Next instruction uses bank X
+    "TAS": (4, ADDRESS),    # Load X, set X to 1
+    "LDA": (5, ADDRESS),    # Load X into AC
+    "BRA": (6, ADDRESS),    # Set PC to X
+    "BRZ": (7, ADDRESS),    # Set PC to X if AC=0
+    "BRP": (8, ADDRESS),    # Set PC to X if AC>0
+    "INP": (9, 1),          # Read input to AC
+    "OUT": (9, 2),          # Write output from AC
+    "MEM": (0, VALUE),      # Reserve a memory slot with value==adr
+    "HLT": (0, 0)           # Exit
+}
+
+def encode(name, adr, mem_size=100, *, decrement=0, line=None):
+    """
+    returns the word of an instruction, 'adr' is None if it has no
+    number. 'decrement' is taken from addresses, 1 for assembler that
+    was written with lines starting at 1. 'line' is used in errors.
+    """
+    if name not in OPCODES:
+        raise ParseError("Unknown token: '{0}'".format(name))
+
+    (opcode, operand) = OPCODES[name]
+    if operand not in [ADDRESS, BANK, VALUE]:
+        return opcode * mem_size + operand
+    if adr is None:
+        raise ParseError("Expected address for instruction: '{0}' Line: {1}".format(name, line))
+
+    adr = int(adr)
+    if operand == VALUE:
+        return adr
+    if operand == BANK:
+        return opcode * mem_size + adr
+    return opcode * mem_size + adr - decrement
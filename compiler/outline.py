@@ -0,0 +1,239 @@
+from compiler.instruction import Instruction, JumpFlag
+from compiler.memory import Memory
+
+BRANCHES = ["BRA", "BRZ", "BRP"]
+
+# Words a call site costs: 'LDA <return>', 'STA <patch>', 'BRA <sub>' and
+# the memory slot with the return jump. A subroutine adds its 'BRA' back.
+CALL_WORDS = 4
+RETURN_WORDS = 1
+
+# Cycles a call costs: the three instructions and the jump back.
+CALL_CYCLES = 4
+
+# How many times more often code in a loop is expected to run.
+LOOP_WEIGHT = 10
+
+MIN_LENGTH = 4
+MAX_LENGTH = 40
+
+class OutlineStats:
+    def __init__(self):
+        self.subroutines = 0
+        self.calls = 0
+        self.words_saved = 0
+        self.extra_cycles = 0
+
+    def __str__(self):
+        return "Outline: {0} subroutines with {1} calls, {2} words saved " \
+            "for about {3} extra cycles".format(self.subroutines, self.calls,
+                self.words_saved, self.extra_cycles)
+
+
+class Candidate:
+    """
+    A sequence of instructions and where it can be replaced by a call.
+    """
+
+    def __init__(self, key, length, sites, frequency):
+        self.key = key
+        self.length = length
+        self.sites = sites
+        self.frequency = frequency
+
+    @property
+    def words_saved(self):
+        n = len(self.sites)
+        return n * self.length - (n * CALL_WORDS + self.length + RETURN_WORDS)
+
+    @property
+    def extra_cycles(self):
+        return CALL_CYCLES * sum([self.frequency[idx] for idx in self.sites])
+
+
+class Outliner:
+    """
+    Shrinks the program by moving repeated sequences of instructions
+    into subroutines.
+
+    The caller stores a 'BRA' back to itself over the last instruction
+    of the subroutine before jumping to it:
+
+            LDA <return_n>      # MEM that holds 'BRA back_n'
+            STA <ret>
+            BRA sub
+        back_n:
+            ...
+        sub:
+            <sequence>
+        ret:
+            BRA 0               # patched by the caller
+
+    Only sequences that begin by overwriting the AC are outlined, since
+    the call needs the AC. Calls cost cycles, so a sequence is only
+    outlined if it saves a word for at most 'cycles_per_word' extra
+    cycles, unless 'words_needed' words must be saved for the program to
+    fit in memory. Then the sequences with the fewest extra cycles per
+    word saved are outlined first.
+
+    Works on a list of 'Instruction' where the JumpFlags have been
+    merged into the instructions, but before memory and jumps are bound.
+    """
+
+    def __init__(self, memory, *, mem_size=100, cycles_per_word=0):
+        self.mem = memory
+        self.mem_size = mem_size
+        self.cycles_per_word = cycles_per_word
+        self.stats = OutlineStats()
+
+    def optimize(self, instructions, words_needed=0):
+        code = list(instructions)
+
+        while True:
+            candidates = [c for c in self._find_candidates(code) if c.words_saved > 0]
+            if words_needed > 0:
+                candidates.sort(key=lambda c: (c.extra_cycles / c.words_saved, -c.words_saved))
+            else:
+                candidates = [c for c in candidates
+                    if c.words_saved * self.cycles_per_word >= c.extra_cycles]
+                candidates.sort(key=lambda c: (c.extra_cycles - c.words_saved * self.cycles_per_word,
+                    -c.words_saved))
+
+            if len(candidates) == 0:
+                break
+
+            best = candidates[0]
+            code = self._outline(code, best)
+            words_needed -= best.words_saved
+
+            self.stats.subroutines += 1
+            self.stats.calls += len(best.sites)
+            self.stats.words_saved += best.words_saved
+            self.stats.extra_cycles += best.extra_cycles
+
+        return code
+
+    def _frequency(self, code):
+        """
+        A guess of how often each instruction runs, from how many
+        loops (jumps backwards) it is inside of.
+        """
+        index = {}
+        for idx, inst in enumerate(code):
+            for j in inst.jumps:
+                index[j.alias] = idx
+
+        depth = [0] * len(code)
+        for idx, inst in enumerate(code):
+            if inst.instruction in BRANCHES and inst.jump is not None \
+                    and index[inst.jump] <= idx:
+                for n in range(index[inst.jump], idx + 1):
+                    depth[n] += 1
+
+        return [LOOP_WEIGHT ** d for d in depth]
+
+    def _can_outline(self, inst):
+        return inst.instruction not in BRANCHES and inst.instruction != "HLT" \
+            and inst.jump is None and len(inst.targets) == 0
+
+    def _find_candidates(self, code):
+        frequency = self._frequency(code)
+
+        # where every temp is used, a temp that is only used inside a
+        # sequence can be shared by all the copies of the sequence.
+        span = {}
+        for idx, inst in enumerate(code):
+            if inst.variable is not None and Memory.is_temp_name(inst.variable):
+                (first, last) = span.get(inst.variable, (idx, idx))
+                span[inst.variable] = (min(first, idx), max(last, idx))
+
+        stored = set([inst.variable for inst in code if inst.instruction == "STA"])
+
+        # every place a sequence of a given length starts
+        found = {}
+        for start in range(len(code)):
+            if code[start].instruction not in ["LDA", "INP"]:
+                continue
+
+            for length in range(1, MAX_LENGTH + 1):
+                end = start + length
+                if end >= len(code) or not self._can_outline(code[end - 1]):
+                    break
+                # only the first instruction can be jumped to
+                if length > 1 and code[end - 1].is_jump_endpoint:
+                    break
+                if length < MIN_LENGTH:
+                    continue
+
+                key = self._key(code, start, end, span, stored)
+                found.setdefault(key, []).append(start)
+
+        candidates = []
+        for key, starts in found.items():
+            # the sequences can't overlap
+            sites = []
+            for s in starts:
+                if len(sites) == 0 or s >= sites[len(sites) - 1] + len(key):
+                    sites.append(s)
+            if len(sites) >= 2:
+                candidates.append(Candidate(key, len(key), sites, frequency))
+
+        return candidates
+
+    def _key(self, code, start, end, span, stored):
+        """
+        What a sequence does, where temps that are only used inside it
+        are numbered and constants are compared by their value.
+        """
+        local = {}
+        key = []
+        for inst in code[start:end]:
+            var = inst.variable
+            if var in span and span[var][0] >= start and span[var][1] < end:
+                var = local.setdefault(var, ("local", len(local)))
+            elif var in span and var not in stored:
+                var = ("const", str(self.mem.get_reference(var)["value"]))
+            key.append((inst.instruction, var))
+        return tuple(key)
+
+    def _outline(self, code, candidate):
+        sub = self.mem.gen_jump_name()
+        ret = self.mem.gen_jump_name()
+
+        body = [Instruction(i.instruction, variable=i.variable, comment=i.comment)
+            for i in code[candidate.sites[0]:candidate.sites[0] + candidate.length]]
+        body[0].add_jump(JumpFlag(sub))
+
+        back_jump = Instruction("BRA", adr=0, comment="return, patched by the caller")
+        back_jump.add_jump(JumpFlag(ret))
+
+        result = []
+        idx = 0
+        for site in candidate.sites:
+            result.extend(code[idx:site])
+
+            back = self.mem.gen_jump_name()
+            return_adr = self.mem.gen_temp_name()
+            self.mem.add_jump_reference(return_adr, back, offset=6 * self.mem_size)
+            back_jump.targets.append(back)
+
+            call = Instruction("LDA", variable=return_adr, comment="call {0}".format(sub))
+            for j in code[site].jumps:
+                call.add_jump(j)
+            result.append(call)
+            result.append(Instruction("STA", jump=ret, comment="set return address"))
+            result.append(Instruction("BRA", jump=sub))
+
+            idx = site + candidate.length
+            code[idx].add_jump(JumpFlag(back))
+
+        result.extend(code[idx:])
+
+        # make sure the program can't run into the subroutine
+        last = result[len(result) - 1]
+        if last.instruction not in ["HLT", "BRA"]:
+            result.append(Instruction("HLT", comment="exit"))
+
+        result.extend(body)
+        result.append(back_jump)
+        return result
@@ -0,0 +1,202 @@
+from compiler.memory import Memory
+
+BRANCHES = ["BRA", "BRZ", "BRP"]
+
+class PeepholeStats:
+    """
+    What the peephole optimizer did to a program.
+
+    The cycle counts are only known if the program was measured
+    against an unoptimized build, otherwise they are None.
+    """
+
+    def __init__(self):
+        self.instructions_before = 0
+        self.instructions_after = 0
+        self.loads_removed = 0
+        self.stores_removed = 0
+        self.jumps_removed = 0
+        self.jumps_threaded = 0
+        self.cycles_before = None
+        self.cycles_after = None
+
+    @property
+    def instructions_saved(self):
+        return self.instructions_before - self.instructions_after
+
+    @property
+    def cycles_saved(self):
+        if self.cycles_before is None or self.cycles_after is None:
+            return None
+        return self.cycles_before - self.cycles_after
+
+    def __str__(self):
+        s = "Peephole: {0} instructions saved ({1} -> {2}), ".format(
+            self.instructions_saved, self.instructions_before, self.instructions_after)
+        s += "{0} loads, {1} stores and {2} jumps removed, {3} jumps threaded".format(
+            self.loads_removed, self.stores_removed, self.jumps_removed, self.jumps_threaded)
+        if self.cycles_saved is not None:
+            s += "\nPeephole: {0} cycles saved ({1} -> {2})".format(
+                self.cycles_saved, self.cycles_before, self.cycles_after)
+        return s
+
+
+class PeepholeOptimizer:
+    """
+    Removes redundant instructions from the generated code.
+
+    Works on a list of 'Instruction' where the JumpFlags have been
+    merged into the instructions, but before memory and jumps are bound.
+    """
+
+    def __init__(self):
+        self.stats = PeepholeStats()
+
+    def optimize(self, instructions):
+        """
+        Run all the rules until none of them can change anything.
+
+        Returns a new list of instructions.
+        """
+        code = list(instructions)
+
+        changed = True
+        while changed:
+            changed = False
+            changed = self._thread_jumps(code) or changed
+            self._remove_unused_labels(code)
+            changed = self._remove_redundant_pairs(code) or changed
+            changed = self._remove_dead_temp_stores(code) or changed
+            changed = self._remove_useless_jumps(code) or changed
+
+        return code
+
+    def _remove(self, code, idx):
+        """
+        Remove the instruction at 'idx' and move its jump
+        endpoints to the instruction that follows it.
+        """
+        inst = code[idx]
+        if inst.is_jump_endpoint:
+            for j in inst.jumps:
+                code[idx + 1].add_jump(j)
+        del code[idx]
+
+    def _label_map(self, code):
+        labels = {}
+        for inst in code:
+            for j in inst.jumps:
+                labels[j.alias] = inst
+        return labels
+
+    def _thread_jumps(self, code):
+        """
+        A jump to a 'BRA' is replaced by a jump to where the 'BRA' goes.
+        """
+        labels = self._label_map(code)
+        changed = False
+
+        for inst in code:
+            if inst.instruction not in BRANCHES or inst.jump is None:
+                continue
+
+            seen = set([inst.jump])
+            alias = inst.jump
+            target = labels[alias]
+            while target.instruction == "BRA" and target.jump is not None \
+                    and target.jump not in seen:
+                alias = target.jump
+                seen.add(alias)
+                target = labels[alias]
+
+            if alias != inst.jump:
+                inst.jump = alias
+                self.stats.jumps_threaded += 1
+                changed = True
+
+        return changed
+
+    def _remove_unused_labels(self, code):
+        used = set([inst.jump for inst in code if inst.jump is not None])
+        used.update([alias for inst in code for alias in inst.targets])
+        for inst in code:
+            inst.jumps = [j for j in inst.jumps if j.alias in used]
+            inst.is_jump_endpoint = len(inst.jumps) != 0
+
+    def _remove_redundant_pairs(self, code):
+        """
+        Look at every pair of instructions that always runs back to back,
+        i.e. the second instruction is not the endpoint of a jump.
+        """
+        changed = False
+        same_var = lambda a, b: a.variable is not None and a.variable == b.variable
+
+        idx = 0
+        while idx + 1 < len(code):
+            prev = code[idx]
+            curr = code[idx + 1]
+
+            if curr.is_jump_endpoint:
+                idx += 1
+                continue
+
+            if prev.instruction == "STA" and curr.instruction == "LDA" and same_var(prev, curr):
+                # the value is still in the AC
+                self._remove(code, idx + 1)
+                self.stats.loads_removed += 1
+                changed = True
+            elif prev.instruction in ["STA", "LDA"] and curr.instruction == "STA" and same_var(prev, curr):
+                # the memory already has the value of the AC
+                self._remove(code, idx + 1)
+                self.stats.stores_removed += 1
+                changed = True
+            elif prev.instruction == "LDA" and curr.instruction in ["LDA", "INP"]:
+                # the AC is overwritten before it's used
+                self._remove(code, idx)
+                self.stats.loads_removed += 1
+                changed = True
+            else:
+                idx += 1
+
+        return changed
+
+    def _remove_dead_temp_stores(self, code):
+        """
+        Remove stores to temporary variables that are never read.
+        """
+        reads = set([inst.variable for inst in code
+            if inst.variable is not None and inst.instruction != "STA"])
+        changed = False
+
+        idx = 0
+        while idx < len(code):
+            inst = code[idx]
+            if inst.instruction == "STA" and inst.variable is not None \
+                    and Memory.is_temp_name(inst.variable) and inst.variable not in reads:
+                self._remove(code, idx)
+                self.stats.stores_removed += 1
+                changed = True
+            else:
+                idx += 1
+
+        return changed
+
+    def _remove_useless_jumps(self, code):
+        """
+        Remove jumps to the instruction right after the jump.
+        """
+        changed = False
+
+        idx = 0
+        while idx + 1 < len(code):
+            inst = code[idx]
+            nxt = code[idx + 1]
+            if inst.instruction in BRANCHES and inst.jump is not None \
+                    and inst.jump in [j.alias for j in nxt.jumps]:
+                self._remove(code, idx)
+                self.stats.jumps_removed += 1
+                changed = True
+            else:
+                idx += 1
+
+        return changed
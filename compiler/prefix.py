@@ -0,0 +1,63 @@
+import contextlib, io
+from compiler.executor import Executor
+from compiler.error import ExecuteError
+
+# a prefix that runs longer than this is left to run time
+MAX_CYCLES = 100000
+
+class Prefix:
+    def __init__(self, start, memory, output, cycles):
+        # where the program goes on, at its first 'INP' or 'HLT'
+        self.start = start
+        # the memory when it gets there
+        self.memory = memory
+        # the values it printed on the way
+        self.output = output
+        self.cycles = cycles
+
+    def __str__(self):
+        return "Evaluated ahead: {0} cycles, {1} outputs, the program starts at {2}".format(
+            self.cycles, len(self.output), self.start)
+
+
+class PrefixEvaluator:
+    """
+    Runs the part of a program that doesn't depend on input at compile
+    time, from the start to the first 'INP' (or 'HLT'):
+
+        [BRA code][variables][code ...][INP]...
+
+    The memory at that point is the new program, and the first word,
+    the 'BRA' over the variables, jumps to the 'INP' instead. What was
+    printed on the way is kept as the output of the prefix, and printed
+    before the program runs from there.
+
+    A program that stops with an error, or runs for more than
+    'max_cycles' without reading input, is left as it is, so it fails
+    or loops at run time like it did before.
+    """
+
+    def __init__(self, mem_size=100, *, max_cycles=MAX_CYCLES):
+        self.mem_size = mem_size
+        self.max_cycles = max_cycles
+
+    def evaluate(self, words):
+        """
+        returns a 'Prefix', or None if the program can't be run ahead.
+        """
+        if len(words) == 0 or words[0] // self.mem_size != 6:
+            return None
+
+        memory = list(words)
+        e = Executor(testing=True, test_input=[], max_cycles=self.max_cycles)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                output = e.execute_bytecode(memory, self.mem_size, quiet=True, pause=True)
+        except (ExecuteError, IndexError):
+            return None
+
+        start = e.paused_at
+        if start is None or start >= self.mem_size or memory[0] != words[0]:
+            return None
+        memory[0] = 6 * self.mem_size + start
+        return Prefix(start, memory, [int(v) for v in output], e.cycles)
@@ -0,0 +1,187 @@
+import contextlib, copy, io
+from compiler.compiler import ScriptCompiler
+from compiler.executor import Executor
+from compiler.assembler import Assembler
+from compiler.tokenizer import Tokenizer
+from compiler.instruction import Instruction
+from compiler.memory import Memory
+from compiler.globalopt import GlobalOptimizer
+from compiler.peephole import PeepholeOptimizer
+from compiler.error import CompileError
+
+# room for a long session, the image only grows
+MEM_SIZE = 10000
+
+class Repl:
+    """
+    Runs scripts one entry at a time, against one compiler and one
+    memory image that are kept for the whole session.
+
+    Every entry is compiled on its own, with the variables, functions
+    and constants of the entries before it, and appended to the image:
+
+            [new variables and temps][code][HLT]
+
+    then the code runs from its first instruction, on the memory the
+    earlier entries left behind. Nothing that was entered before runs
+    again. Functions are linked into every entry that calls them, so
+    an entry never jumps into the code of another one.
+    """
+
+    def __init__(self, *, testing=False, test_input=7, opt_level=2, mem_size=MEM_SIZE, debug=False):
+        self.compiler = ScriptCompiler(testing=testing, test_input=test_input,
+            opt_level=opt_level, mem_size=mem_size)
+        self.executor = Executor(testing=testing, test_input=test_input)
+        self.mem_size = mem_size
+        self.debug = debug
+        self.image = []
+        self.entries = 0
+
+    def enter(self, source):
+        """
+        compile and run one entry, returns the output of it.
+
+        An entry that doesn't compile leaves the session as it was.
+        """
+        c = self.compiler
+        context = copy.deepcopy(c.context)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()) as log:
+                (words, start) = self._compile(source)
+        except Exception as e:
+            c.context = context
+            raise e
+        finally:
+            if self.debug:
+                print(log.getvalue())
+
+        self.image.extend(words)
+        self.entries += 1
+
+        e = self.executor
+        try:
+            output = e.execute_bytecode(self.image, self.mem_size, start=start, quiet=True)
+        except Exception as ex:
+            # the entry stopped half way, what it folded can't be trusted
+            c.constants = {}
+            raise ex
+        finally:
+            if isinstance(e.testing_output, list):
+                e.testing_output = e.testing_output[len(e.inputs):]
+        return output
+
+    def variables(self):
+        """
+        returns the value of every variable in the image.
+        """
+        return { name: self.image[ref["line"]] for (name, ref) in self.compiler.mem.get().items()
+            if not Memory.is_temp_name(name) and "jump" not in ref and ref["line"] != -1 }
+
+    def _compile(self, source):
+        """
+        returns the words to append to the image,
+        and the address where the code starts.
+        """
+        c = self.compiler
+        mem = c.mem
+
+        t = Tokenizer()
+        t.load(source)
+        c.tokens = t.tokenize()
+        exprs = c._parse_expr_recursive(c.tokens)
+
+        # the calls are counted and the bodies linked for this entry only
+        for f in c.functions.values():
+            (f.calls, f.returns, f.linked, f.compiled) = (0, [], False, False)
+        c._declare_functions(exprs)
+
+        code = []
+        for ex in exprs:
+            asm = c._handle_expr(ex)
+            if asm is not None:
+                code.extend(asm.get_instructions())
+        code.append(Instruction("HLT", comment="back to the prompt"))
+        code.extend(c._gen_function_bodies())
+        code = c._merge_jumps(code)
+
+        if c.opt_level >= 2:
+            # later entries can read any variable
+            live = [m for m in mem.get() if not Memory.is_temp_name(m)]
+            code = GlobalOptimizer(live_at_exit=live).optimize(code)
+        if c.use_peephole:
+            code = PeepholeOptimizer().optimize(code)
+        mem.remove_unused(code)
+
+        # the new memory goes first, then the code
+        base = len(self.image)
+        added = [ref for ref in mem.get().values() if ref["line"] == -1]
+        start = base + len(added)
+        size = start + len(code)
+        if size > self.mem_size:
+            raise CompileError("The session needs {0} words of memory, but there is only {1}"
+                .format(size, self.mem_size))
+
+        for n, ref in enumerate(added):
+            ref["line"] = base + n
+        mem.bind_mem(code)
+
+        labels = {}
+        for idx, inst in enumerate(code):
+            for j in inst.jumps:
+                labels[j.alias] = start + idx
+        for inst in code:
+            if inst.invalidate_jump_bindings:
+                inst.set_adr(inst.adr_offset + labels[inst.jump])
+
+        words = []
+        for ref in added:
+            value = ref["offset"] + labels[ref["jump"]] if "jump" in ref else int(ref["value"])
+            words.append(Instruction("MEM", adr=value))
+        words.extend(code)
+
+        return Assembler(mem_size=self.mem_size).encode(words), start
+
+    @staticmethod
+    def complete(source):
+        """
+        returns True if 'source' ends a statement, outside of any block.
+        """
+        text = source.strip()
+        if text == "":
+            return True
+        return text.count("{") <= text.count("}") and text[len(text) - 1] in [";", "}"]
+
+    def loop(self):
+        """
+        read entries from the terminal until Ctrl+D.
+        """
+        print("Little Man REPL, ':vars' shows the variables, Ctrl+D quits")
+        lines = []
+        while True:
+            try:
+                line = input("... " if len(lines) != 0 else ">>> ")
+            except EOFError:
+                print()
+                break
+            except KeyboardInterrupt:
+                print()
+                lines = []
+                continue
+
+            lines.append(line)
+            source = "\n".join(lines)
+            if source.strip() == ":vars":
+                for (name, value) in self.variables().items():
+                    print("   {0} = {1}".format(name, value))
+                lines = []
+                continue
+            if not Repl.complete(source):
+                continue
+            lines = []
+
+            try:
+                self.enter(source)
+            except Exception as e:
+                print("Error: {0}".format(str(e)))
+                if self.debug:
+                    raise e
@@ -0,0 +1,136 @@
+import json
+from compiler.instruction import Instruction
+
+class SourceLocation:
+    def __init__(self, line, column, statement):
+        self.line = line
+        self.column = column
+        # the tokens of the statement, as text
+        self.statement = statement
+
+    def to_dict(self):
+        return { "line": self.line, "column": self.column, "statement": self.statement }
+
+    def __str__(self):
+        return "{0}:{1} {2}".format(self.line, self.column, self.statement)
+
+
+class SourceMap:
+    """
+    The line, the column and the statement in the script that every
+    address of a compiled program was generated for.
+
+    The addresses that no statement made, like the jump over the
+    variables and the variables themselves, map to None. So does code
+    the optimizers put in place of the code they removed.
+    """
+
+    def __init__(self, instructions):
+        self.locations = []
+        for inst in instructions:
+            location = None
+            if isinstance(inst, Instruction) and inst.statement is not None:
+                location = SourceMap.locate(inst.statement)
+            self.locations.append(location)
+
+    @staticmethod
+    def locate(statement):
+        """
+        returns the 'SourceLocation' of an 'Expression'.
+        """
+        first = statement.tokens[0] if len(statement.tokens) != 0 else None
+        if first is None or first.line is None:
+            return None
+        return SourceLocation(first.line, first.column, str(statement))
+
+    def lookup(self, address):
+        if address < 0 or address >= len(self.locations):
+            return None
+        return self.locations[address]
+
+    def to_dict(self):
+        return { "addresses": [dict(address=adr, **l.to_dict())
+            for adr, l in enumerate(self.locations) if l is not None] }
+
+    def save(self, filename):
+        with open(filename, "w") as f:
+            json.dump(self.to_dict(), f, indent=4)
+
+    def __str__(self):
+        lines = ["Source map:"]
+        lines += ["   {0}: {1}".format(adr, l) for adr, l in enumerate(self.locations) if l is not None]
+        return "\n".join(lines)
+
+
+class LineProfile:
+    def __init__(self, line, statement):
+        self.line = line
+        self.statement = statement
+        self.cycles = 0
+        # the loads from memory, with 'ADD' and 'SUB', and the stores
+        self.reads = 0
+        self.writes = 0
+
+    def to_dict(self):
+        return { "line": self.line, "statement": self.statement, "cycles": self.cycles,
+            "reads": self.reads, "writes": self.writes }
+
+
+class SourceProfiler:
+    """
+    Counts the cycles and the memory reads and writes of every
+    instruction that runs, and adds them up for every line of the script
+    with the 'SourceMap'. What doesn't map to a line is counted on line
+    None.
+
+    Every instruction is traced, so counting loops are not skipped
+    ahead, and the program runs from the start even if the compiler
+    ran it ahead.
+    """
+
+    def __init__(self, source_map, mem_size=100, *, banked=False):
+        self.source_map = source_map
+        self.mem_size = mem_size
+        self.banked = banked
+        self.lines = {}
+        self.cycles = 0
+
+    def run(self, executor, words):
+        """
+        runs 'words' on 'executor', returns the output.
+        """
+        memory = list(words)
+
+        def count(pc, ac):
+            op = memory[pc] // self.mem_size
+            location = self.source_map.lookup(pc)
+            line = None if location is None else location.line
+            if line not in self.lines:
+                self.lines[line] = LineProfile(line, None if location is None else location.statement)
+            p = self.lines[line]
+            p.cycles += 1
+            if op in [1, 2, 5] or (op == 4 and not self.banked):
+                p.reads += 1
+            if op == 3 or (op == 4 and not self.banked):
+                p.writes += 1
+
+        output = executor.execute_bytecode(memory, self.mem_size, trace=count)
+        self.cycles = executor.cycles
+        return output
+
+    def profiles(self):
+        """
+        returns the 'LineProfile' of every line, the most cycles first.
+        """
+        return sorted(self.lines.values(), key=lambda p: (-p.cycles, p.line or 0))
+
+    def to_dict(self):
+        return { "cycles": self.cycles, "lines": [p.to_dict() for p in self.profiles()] }
+
+    def __str__(self):
+        lines = ["Profile: {0} cycles".format(self.cycles),
+            "   {0:>6} {1:>10} {2:>8} {3:>8}  {4}".format("line", "cycles", "reads", "writes", "statement")]
+        for p in self.profiles():
+            lines.append("   {0:>6} {1:>10} {2:>8} {3:>8}  {4}".format("-" if p.line is None else p.line,
+                p.cycles, p.reads, p.writes, "" if p.statement is None else p.statement))
+        return "\n".join(lines)
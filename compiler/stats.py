@@ -0,0 +1,90 @@
+import contextlib, json, time, tracemalloc
+
+class PhaseStats:
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+        self.items = 0
+        # the most memory allocated at once, only known
+        # if the allocations are traced.
+        self.peak_bytes = None
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "calls": self.calls,
+            "seconds": self.seconds,
+            "items": self.items,
+            "peak_bytes": self.peak_bytes
+        }
+
+    def __str__(self):
+        s = "{0:<12} {1:>9.3f} ms  {2:>7} items".format(self.name, self.seconds * 1000, self.items)
+        if self.peak_bytes is not None:
+            s += "  {0:>9} bytes peak".format(self.peak_bytes)
+        return s
+
+
+class PipelineStats:
+    """
+    Wall time, the number of items handled and optionally the peak memory
+    allocated, for every phase of compiling and running a program.
+
+    A phase that runs more than once adds up its time and items, and
+    keeps the largest peak.
+
+        with stats.phase("tokenize") as p:
+            tokens = t.tokenize()
+            p.items = len(tokens)
+    """
+
+    def __init__(self, *, trace_memory=False):
+        self.phases = {}
+        self.trace_memory = trace_memory
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        if name not in self.phases:
+            self.phases[name] = PhaseStats(name)
+        stats = self.phases[name]
+
+        current = PhaseStats(name)
+        tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            (start_bytes, _) = tracemalloc.get_traced_memory()
+
+        start = time.perf_counter()
+        try:
+            yield current
+        finally:
+            stats.seconds += time.perf_counter() - start
+            stats.calls += 1
+            stats.items += current.items
+
+            if self.trace_memory:
+                (_, peak) = tracemalloc.get_traced_memory()
+                stats.peak_bytes = max(stats.peak_bytes or 0, peak - start_bytes)
+            if tracing:
+                tracemalloc.stop()
+
+    @property
+    def seconds(self):
+        return sum([p.seconds for p in self.phases.values()])
+
+    def to_dict(self):
+        return {
+            "seconds": self.seconds,
+            "phases": [p.to_dict() for p in self.phases.values()]
+        }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=4)
+
+    def __str__(self):
+        lines = ["Phases:"] + ["   " + str(p) for p in self.phases.values()]
+        lines.append("   {0:<12} {1:>9.3f} ms".format("total", self.seconds * 1000))
+        return "\n".join(lines)
@@ -1,3 +1,5 @@
+import bisect
+
 
 class StringReader:
     """
@@ -9,6 +11,8 @@ class StringReader:
     def __init__(self, string):
         self.string = string
         self.idx = 0
+        # the index where every line starts
+        self.lines = [0] + [idx + 1 for idx, c in enumerate(string) if c == "\n"]
 
     def next(self):
         """
@@ -64,6 +68,14 @@ class StringReader:
                 break
             self.idx += 1
 
+    def position(self, idx=None):
+        """
+        Return the line and the column of an index, both starting at 1.
+        """
+        idx = self.idx if idx is None else idx
+        line = bisect.bisect_right(self.lines, idx)
+        return line, idx - self.lines[line - 1] + 1
+
     @property
     def pos(self):
         """
@@ -26,6 +26,12 @@ class TokenType(IntEnum):
 	Seperator = 23
 	Conditional = 24
 	FuncDecl = 25
+	Return = 26
+	NotEqualTo = 27 # !=
+	LessThan = 28 # <
+	GreaterThan = 29 # >
+	LessOrEqual = 30 # <=
+	GreaterOrEqual = 31 # >=
 
 SYMBOLS = {
 	"(": TokenType.LParen,
@@ -50,10 +56,21 @@ SYMBOLS = {
 	#"def": Token.Function
 }
 
+# the two character ones are matched first
+COMPARISONS = {
+	"==": TokenType.EqualTo,
+	"!=": TokenType.NotEqualTo,
+	"<=": TokenType.LessOrEqual,
+	">=": TokenType.GreaterOrEqual,
+	"<": TokenType.LessThan,
+	">": TokenType.GreaterThan
+}
+
 KEYWORDS = {
 	"if": TokenType.Conditional,
 	"while": TokenType.While,
 	"def": TokenType.FuncDecl,
+	"return": TokenType.Return,
 	"print": TokenType.Function,
 	"read": TokenType.Function,
     "sin": TokenType.Function,
@@ -1,11 +1,14 @@
 import os
 from compiler.stringreader import StringReader
-from compiler.token import TokenType, SYMBOLS, KEYWORDS
+from compiler.token import TokenType, SYMBOLS, KEYWORDS, COMPARISONS
 
 class Token():
-    def __init__(self, value, token_type):
+    def __init__(self, value, token_type, line=None, column=None):
         self.value = value
         self.token = token_type
+        # where the token starts in the script, None if the compiler made it
+        self.line = line
+        self.column = column
 
 class Tokenizer():
     """
@@ -38,6 +41,12 @@ class Tokenizer():
 
         # This is explained later in the method
         expecting_identifier = False
+        # where the current string starts
+        start = None
+
+        def token_at(value, token_type, idx=None):
+            (line, column) = self.reader.position(idx)
+            return Token(value, token_type, line, column)
 
         def handle_curr_str(currstr):
             """
@@ -45,14 +54,14 @@ class Tokenizer():
             an identifier or is in the KEYWORDS list,
             if it is we add it as a token with the corresponding tokentype
             """
-            if currstr.strip() is not "":
+            if currstr.strip() != "":
                 currstr = currstr.strip()
                 token = None
 
                 if currstr in KEYWORDS:
-                    token = Token(currstr, KEYWORDS[currstr])
+                    token = token_at(currstr, KEYWORDS[currstr], start)
                 else:
-                    token = Token(currstr, TokenType.Identifier)
+                    token = token_at(currstr, TokenType.Identifier, start)
 
                 tokens.append(token)
                 currstr = ""
@@ -90,10 +99,20 @@ class Tokenizer():
             # Example: "var = -2;" becomes "var = 0 - 2;"
             if (self.reader.peak() == "+" or self.reader.peak() == "-") \
                     and expecting_identifier:
-                token = Token("0", TokenType.Identifier)
+                token = token_at("0", TokenType.Identifier)
                 tokens.append(token)
                 expecting_identifier = False
 
+            comparison = self._peak_comparison()
+            if comparison is not None:
+                curr_str = handle_curr_str(curr_str)
+                token = token_at(comparison, COMPARISONS[comparison])
+                self.reader.read(len(comparison))
+                tokens.append(token)
+                # "a < -2" works like "a = -2"
+                expecting_identifier = True
+                continue
+
             if self.reader.peak() == "=":
                 expecting_identifier = True
 
@@ -102,8 +121,8 @@ class Tokenizer():
                 # Maybe create identifier
                 curr_str = handle_curr_str(curr_str)
 
+                token = token_at(self.reader.peak(), SYMBOLS[self.reader.peak()])
                 char = self.reader.next()
-                token = Token(char, SYMBOLS[char])
                 tokens.append(token)
 
                 # This is a hack to make sure assignments like "-13" and
@@ -121,11 +140,24 @@ class Tokenizer():
                 if char == "-" and self.reader.peak() == "+":
                     self.reader.next()
                 elif char in ops and self.reader.peak() in ops:
-                    token = Token("0", TokenType.Identifier)
+                    token = token_at("0", TokenType.Identifier)
                     tokens.append(token)
             else:
+                if curr_str.strip() == "" and not self.reader.peak().isspace():
+                    start = self.reader.pos
                 curr_str += self.reader.next()
                 expecting_identifier = False
 
 
         return tokens
+
+    def _peak_comparison(self):
+        """
+        returns the comparison operator at the current position, or None.
+        """
+        if self.reader.peak() not in "=!<>":
+            return None
+        for op in COMPARISONS:
+            if self.reader.pos + len(op) <= self.reader.length and self.reader.peak(len(op)) == op:
+                return op
+        return None
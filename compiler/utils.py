@@ -17,3 +17,13 @@ class Utils:
             print("dbg::\'{0}\'::  {1}".format(name, "Critical!: Object was None."))
             return True
         return False
+
+    @staticmethod
+    def is_int(string):
+        """
+        Like 'str.isdigit' but also accepts negative integers, e.g. "-13".
+        """
+        string = str(string)
+        if string.startswith("-"):
+            string = string[1:]
+        return string.isdigit()
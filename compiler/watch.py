@@ -0,0 +1,105 @@
+import contextlib, io, os, time
+from compiler.compiler import ScriptCompiler
+from compiler.executor import Executor
+from compiler.tokenizer import Tokenizer
+
+class Watcher:
+    """
+    Compiles and runs a script every time it's saved, in the same process,
+    so the imports and the 'StatementCache' of the compiler stay warm
+    and only the statements that changed get new code.
+
+    The file is polled every 'interval' seconds. A save that didn't
+    change the text is not built again, and one that only changed
+    comments or whitespace runs the last bytecode again.
+    """
+
+    def __init__(self, filename, *, compiler=None, interval=0.1, debug=False):
+        self.filename = os.path.abspath(filename)
+        self.compiler = ScriptCompiler() if compiler is None else compiler
+        self.interval = interval
+        self.debug = debug
+        self.stamp = None
+        self.source = None
+        self.tokens = None
+        self.bytecode = None
+        self.builds = 0
+
+    def check(self):
+        """
+        build the script if it changed since the last check,
+        returns the output of the program, or None.
+        """
+        try:
+            stat = os.stat(self.filename)
+        except FileNotFoundError:
+            return None # between the delete and write of a save
+
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if stamp == self.stamp:
+            return None
+        self.stamp = stamp
+
+        with open(self.filename, "r") as f:
+            source = f.read()
+        if source == self.source:
+            return None
+        self.source = source
+
+        return self.build(source)
+
+    def build(self, source):
+        """
+        compile and run 'source', returns the output of the program.
+        """
+        c = self.compiler
+        (hits, misses) = (c.cache.hits, c.cache.misses)
+        start = time.perf_counter()
+
+        try:
+            with contextlib.redirect_stdout(io.StringIO()) as log:
+                t = Tokenizer()
+                t.load(source)
+                tokens = [(str(token.value), token.token) for token in t.tokenize()]
+                if tokens != self.tokens:
+                    self.bytecode = c.compile_to_bytecode(source, debug=self.debug)
+                    self.tokens = tokens
+                    built = True
+                else:
+                    built = False
+        except Exception as e:
+            print("Error: {0}".format(str(e)))
+            if self.debug:
+                raise e
+            return None
+        if self.debug:
+            print(log.getvalue())
+
+        if not built:
+            print("Only comments changed, running {0} again".format(os.path.basename(self.filename)))
+        else:
+            print("Built {0} in {1:.1f} ms ({2} statements reused, {3} generated)".format(
+                os.path.basename(self.filename), (time.perf_counter() - start) * 1000,
+                c.cache.hits - hits, c.cache.misses - misses))
+
+        executor = Executor(testing=c.testing, test_input=c.testing_output, banked=c.banked,
+            accelerate=c.accelerate)
+        try:
+            output = executor.execute_bytecode(list(self.bytecode), c.mem_size)
+        except Exception as e:
+            print("Error: {0}".format(str(e)))
+            return None
+        self.builds += 1
+        return output
+
+    def watch(self):
+        """
+        build the script whenever it changes, until Ctrl+C.
+        """
+        print("Watching {0}, press Ctrl+C to stop".format(self.filename))
+        try:
+            while True:
+                self.check()
+                time.sleep(self.interval)
+        except KeyboardInterrupt:
+            print("Stopped watching")
@@ -0,0 +1,18 @@
+import argparse, sys
+from compiler.fuzz import Fuzzer
+
+if __name__ == "__main__":
+
+	parser = argparse.ArgumentParser(description="Check that every optimization setting compiles random scripts correctly")
+	parser.add_argument("--count", type=int, default=100, help="the number of programs")
+	parser.add_argument("--seed", type=int, default=0, help="the seed of the first program")
+	parser.add_argument("--no-shrink", action="store_true", help="report failing programs as generated")
+	parser.add_argument("-v", "--verbose", action="store_true", help="print every program's result")
+	args = parser.parse_args()
+
+	fuzzer = Fuzzer(seed=args.seed, shrink=not args.no_shrink)
+	report = fuzzer.run(args.count, verbose=args.verbose)
+	print(report)
+
+	if len(report.failures) != 0:
+		sys.exit(1)
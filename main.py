@@ -1,32 +1,191 @@
-import argparse, sys, os
+import argparse, json, sys, os
 import compiler
+from compiler.bytecode import Bytecode
+from compiler.stats import PipelineStats
+from compiler.watch import Watcher
+from compiler.repl import Repl
+from compiler.multicore import MultiCore
+from compiler.engine import ENGINES, CrossCheck, select
+
+EMIT_EXTENSIONS = { "man": ".man", "bytecode": ".lmc" }
+
+def load_image(filename, ext, stats, banked):
+	"""
+	returns the bytecode of a file, its memory size, if it's banked and the stats.
+	"""
+	if ext == ".lmc":
+		(words, mem_size, banked, prefix) = Bytecode.load(filename, prefix=True)
+		if prefix is not None:
+			# the engines run the program from where it was run ahead to
+			for value in prefix.output:
+				print(value)
+		return words, mem_size, banked, stats
+
+	with open(filename, "r") as f:
+		source = f.read()
+	if ext == ".script":
+		s = compiler.ScriptCompiler(banked=banked)
+		return s.compile_to_bytecode(source), s.mem_size, banked, s.stats
+	a = compiler.Assembler(stats=stats, banked=banked)
+	return a.assemble(source, read_from_file=True), a.mem_size, banked, stats
 
 if __name__ == "__main__":
 
-	if len(sys.argv) < 2:
-		print("Usage:\n\tmain.py <file>")
-		sys.exit(1)
+	parser = argparse.ArgumentParser(description="Little Man compiler and assembler")
+	parser.add_argument("file", nargs="?", help="a '.script', '.man' or '.lmc' (bytecode) file")
+	parser.add_argument("-d", "--debug", action="store_true", help="print more and raise errors")
+	parser.add_argument("--emit", choices=EMIT_EXTENSIONS.keys(),
+		help="compile without running, and write assembler or bytecode to disk")
+	parser.add_argument("-o", "--output", help="where to write the output of '--emit'")
+	parser.add_argument("--stats", action="store_true",
+		help="print the time spent in every phase as JSON to stderr when done")
+	parser.add_argument("--trace-memory", action="store_true",
+		help="also trace the peak memory allocated in every phase (slow)")
+	parser.add_argument("--banked", action="store_true",
+		help="split the memory in banks of 100 words, so larger programs fit")
+	parser.add_argument("--watch", action="store_true",
+		help="compile and run a '.script' again every time it's saved")
+	parser.add_argument("--cores", type=int,
+		help="run a '.man' or '.lmc' file on this many cores that share the memory")
+	parser.add_argument("--engine", choices=["auto"] + list(ENGINES),
+		help="run the program on this engine, 'auto' picks the fastest one that can")
+	parser.add_argument("--cross-check", metavar="ENGINE", choices=list(ENGINES),
+		help="run the program on '--engine' and on this engine, and report where they differ")
+	parser.add_argument("--profile", action="store_true",
+		help="run a '.script' and count the cycles and the memory traffic of every line")
+	parser.add_argument("--source-map", metavar="FILE",
+		help="write where every address of a compiled '.script' comes from as JSON")
+	parser.add_argument("--no-accelerate", action="store_true",
+		help="run every instruction, without skipping counting loops ahead")
+	parser.add_argument("--repl", action="store_true",
+		help="enter statements one at a time, instead of running a file")
+	args = parser.parse_args()
+
+	if args.repl:
+		Repl(debug=args.debug).loop()
+		sys.exit(0)
+	if args.file is None:
+		parser.error("a file is needed, unless '--repl' is given")
+
+	debug_mode = args.debug
+	ext = os.path.splitext(args.file)[1]
 
-	debug_mode = False
-	if len(sys.argv) > 2:
-		if sys.argv[2] == "--debug" or sys.argv[2] == "-d":
-			debug_mode = True
+	output = args.output
+	if args.emit is not None and output is None:
+		output = os.path.splitext(args.file)[0] + EMIT_EXTENSIONS[args.emit]
 
-	ext = os.path.splitext(sys.argv[1])[1]
+	stats = PipelineStats(trace_memory=args.trace_memory)
+	estimate = None
+	source_map = None
 
 	try:
-		if ext == ".man": # Compile assembly
-			a = compiler.Assembler()
-			a.run(sys.argv[1], read_from_file=True)
+		if args.emit is not None and os.path.splitext(output)[1] != EMIT_EXTENSIONS[args.emit]:
+			print("The output of '--emit {0}' needs the extension '{1}'"
+				.format(args.emit, EMIT_EXTENSIONS[args.emit]))
+			sys.exit(1)
+
+		if args.cores is not None and (ext not in [".man", ".lmc"] or args.emit is not None
+				or args.engine is not None or args.cross_check is not None):
+			print("'--cores' only runs '.man' and '.lmc' files, without '--emit', '--engine' or '--cross-check'")
+			sys.exit(1)
+		if args.cores is not None and args.cores < 1:
+			print("'--cores' needs at least one core")
+			sys.exit(1)
+
+		if ext == ".man" and args.emit == "bytecode": # Assemble without running
+			with open(args.file, "r") as f:
+				a = compiler.Assembler(stats=stats, banked=args.banked)
+				Bytecode.save(output, a.assemble(f.read(), read_from_file=True), a.mem_size, args.banked)
+			print("Wrote {0}".format(output))
+
+		elif args.emit is None and (args.engine is not None or args.cross_check is not None) \
+				and ext in [".man", ".lmc", ".script"]: # Run on an engine
+			(words, mem_size, banked, stats) = load_image(args.file, ext, stats, args.banked)
+			engine = select(args.engine or "auto", words, mem_size, banked)
+			if args.no_accelerate and engine.name == "executor":
+				engine = select("plain", words, mem_size, banked)
+			if args.cross_check is None:
+				with stats.phase("execute") as p:
+					result = engine.run()
+					p.items = result.cycles
+				print("Ran on '{0}': {1}".format(engine.name, result))
+			else:
+				check = CrossCheck(engine, select(args.cross_check, words, mem_size, banked))
+				divergence = check.run()
+				if divergence is not None:
+					print(divergence)
+					sys.exit(1)
+				print("'{0}' and '{1}' agree: {2}".format(engine.name, args.cross_check, check.results[0]))
+
+		elif ext in [".man", ".lmc"] and args.cores is not None: # Run on several cores
+			if ext == ".lmc":
+				(bcode, mem_size, banked, prefix) = Bytecode.load(args.file, prefix=True)
+				if prefix is not None:
+					print("Bytecode that was run ahead can't run on several cores")
+					sys.exit(1)
+			else:
+				with open(args.file, "r") as f:
+					a = compiler.Assembler(stats=stats)
+					(bcode, mem_size, banked) = (a.assemble(f.read(), read_from_file=True), a.mem_size, False)
+			if banked or args.banked:
+				print("Banked memory can't run on several cores")
+				sys.exit(1)
+			m = MultiCore(args.cores, stats=stats)
+			m.run(bcode, mem_size)
+			print(m)
+
+		elif ext in [".man", ".lmc"] and args.emit is None: # Compile assembly or run bytecode
+			a = compiler.Assembler(stats=stats, banked=args.banked, accelerate=not args.no_accelerate)
+			a.run(args.file, read_from_file=True)
+
+		elif ext == ".script" and args.watch: # Compile script on every save
+			s = compiler.ScriptCompiler(banked=args.banked, accelerate=not args.no_accelerate)
+			Watcher(args.file, compiler=s, debug=debug_mode).watch()
+			stats = s.stats
+
+		elif ext == ".script" and args.profile: # Count the cycles of every line
+			s = compiler.ScriptCompiler(trace_memory=args.trace_memory, banked=args.banked)
+			with open(args.file, "r") as f:
+				(_, profile) = s.profile(f.read(), debug=debug_mode)
+			(stats, source_map) = (s.stats, s.source_map)
+			print("\n" + str(profile))
+
+		elif ext == ".script" and args.emit is not None: # Compile script without running
+			s = compiler.ScriptCompiler(trace_memory=args.trace_memory, banked=args.banked)
+			s.emit_from_file(args.file, output, debug=debug_mode)
+			(stats, estimate, source_map) = (s.stats, s.estimate, s.source_map)
+			print("Wrote {0}".format(output))
 
 		elif ext == ".script": # Compile script
-			s = compiler.ScriptCompiler()
-			s.compile_from_file(sys.argv[1], debug=debug_mode)
+			s = compiler.ScriptCompiler(trace_memory=args.trace_memory, banked=args.banked,
+				accelerate=not args.no_accelerate)
+			s.compile_from_file(args.file, debug=debug_mode, report=debug_mode)
+			(stats, estimate, source_map) = (s.stats, s.estimate, s.source_map)
+
+		elif args.emit is not None:
+			print("Only '.script' and '.man' files can be emitted")
 
 		else:
-			print("The file needs an extension '.man' or '.script'")
+			print("The file needs an extension '.man', '.lmc' or '.script'")
 
 	except Exception as e:
 		print("Error: {0}".format(str(e)))
 		if debug_mode:
 			raise e
+
+	if args.source_map is not None:
+		if source_map is None:
+			print("A source map is only made when a '.script' is compiled")
+		else:
+			source_map.save(args.source_map)
+			print("Wrote {0}".format(args.source_map))
+
+	if args.stats:
+		report = stats.to_dict()
+		if estimate is not None:
+			# the cycles the compiler expects, next to the ones measured
+			report["estimate"] = estimate.to_dict()
+		# on stderr, so it can be piped apart from the listing and the output
+		print(json.dumps(report, indent=4), file=sys.stderr)
+	elif debug_mode:
+		print("\n" + str(stats))
@@ -32,6 +32,26 @@ class TestAssembler(unittest.TestCase):
         asm = """INP\nOUT\nHLT"""
         self.assembler.load(asm)
 
+    def test_bytecode(self):
+        from compiler.bytecode import Bytecode
+        bcode = self.assembler.assemble("""LDA 4\nOUT\nHLT\nMEM -13""", read_from_file=True)
+        data = Bytecode.pack(bcode)
+        assert Bytecode.unpack(data) == (bcode, 100, False)
+        assert self.assembler.execute_bytecode(bcode) == ["-13"]
+        with self.assertRaises(AssemblerError):
+            Bytecode.unpack(data[:len(data) - 1])
+
+    def test_banked(self):
+        from compiler.bytecode import Bytecode
+        a = compiler.Assembler(testing=True, mem_size=10, banked=True)
+        # bank 0 reads word 2 of bank 1 and jumps to word 0 of bank 1
+        asm = "LDA 5\nBNK 1\nADD 2\nBNK 1\nBRA 0\nMEM 4\nHLT\nHLT\nHLT\nHLT\nOUT\nHLT\nMEM 7"
+        bcode = a.assemble(asm)
+        assert a.execute_bytecode(list(bcode), 10) == ["11"]
+        assert Bytecode.unpack(Bytecode.pack(bcode, 10, True)) == (bcode, 10, True)
+        with self.assertRaises(ExecuteError):
+            Executor(testing=True).execute_bytecode(list(bcode), 10)
+
     def test_parse_error(self):
         asm = """INP\nOUTTTT\nHLT"""
         with self.assertRaises(ParseError):
@@ -100,6 +120,186 @@ class TestAssembler(unittest.TestCase):
         assert output[1] == "5"  # sub operation
 
 
+class TestLoops(unittest.TestCase):
+    def run_both(self, bcode, mem_size, test_input):
+        results = []
+        for accelerate in [False, True]:
+            exe = Executor(testing=True, test_input=test_input, accelerate=accelerate)
+            mem = list(bcode)
+            output = exe.execute_bytecode(mem, mem_size, quiet=True)
+            results.append((output, exe.cycles, mem, exe.skipped))
+        return results
+
+    def test_counting_loop(self):
+        from compiler.benchmark import Generator
+        a = compiler.Assembler(testing=True)
+        bcode = a.assemble(Generator.man_loop(1000), read_from_file=True)
+        (slow, fast) = self.run_both(bcode, 100, [])
+        assert slow[:3] == fast[:3]
+        assert fast[1] == 5004 and fast[3] > 0
+
+    def test_multiply_divide(self):
+        c = compiler.ScriptCompiler(testing=True, mem_size=1000)
+        bcode = c.compile_to_bytecode("a = 0; b = 0; read(a); read(b); c = a * b; print(c); d = c / b; print(d);")
+        for test_input in [[123, 4000], [-7, 300], [0, 5], [9, -2]]:
+            (slow, fast) = self.run_both(bcode, 1000, test_input)
+            assert slow[:3] == fast[:3]
+        assert fast[3] > 0
+
+    def test_turned_off(self):
+        from compiler.benchmark import Generator
+        from compiler.engine import ExecutorEngine, CrossCheck, select
+        a = compiler.Assembler(testing=True, accelerate=False)
+        a.load(Generator.man_loop(100), read_from_file=True)
+        assert a.cycles == 504 and a.skipped == 0
+
+        c = compiler.ScriptCompiler(testing=True, test_input=[300, 7], accelerate=False)
+        c.compile("a = 0; b = 0; read(a); read(b); print(a * b);")
+        assert c.accelerate is False
+
+        words = compiler.Assembler().assemble(Generator.man_loop(100), read_from_file=True)
+        assert CrossCheck(select("executor", words), select("plain", words)).run([]) is None
+
+        class Broken(ExecutorEngine):
+            def run(self, inputs=None, *, trace=None):
+                result = super().run(inputs, trace=trace)
+                if trace is None:
+                    result.cycles += 1
+                return result
+
+        broken = Broken()
+        broken.load(words)
+        divergence = CrossCheck(select("plain", words), broken).run([])
+        assert divergence is not None and "without tracing" in divergence.what
+
+    def test_max_cycles(self):
+        from compiler.benchmark import Generator
+        a = compiler.Assembler(testing=True)
+        exe = Executor(testing=True, max_cycles=1000)
+        with self.assertRaises(ExecuteError):
+            exe.execute_bytecode(a.assemble(Generator.man_loop(1000), read_from_file=True), quiet=True)
+
+
+class TestPrefix(unittest.TestCase):
+    script = "foo = 13; bar = foo * 3; print(foo); print(bar); read(bar); print(bar);"
+
+    def test_same_run(self):
+        results = []
+        for partial_eval in [False, True]:
+            c = compiler.ScriptCompiler(testing=True, test_input=[5], partial_eval=partial_eval)
+            results.append((c.compile(self.script), c.cycles, c.prefix))
+        assert results[0][:2] == results[1][:2] == (["13", "39", "5"], results[0][1])
+        prefix = results[1][2]
+        assert prefix.output == [13, 39]
+        assert prefix.memory[prefix.start] == 901
+        assert prefix.memory[0] == 600 + prefix.start
+
+    def test_bytecode(self):
+        import tempfile
+        c = compiler.ScriptCompiler(testing=True)
+        with tempfile.TemporaryDirectory() as d:
+            script = os.path.join(d, "prefix.script")
+            with open(script, "w") as f:
+                f.write(self.script)
+            c.emit_from_file(script, os.path.join(d, "prefix.lmc"))
+            a = compiler.Assembler(testing=True, test_input=[5])
+            assert a.run(os.path.join(d, "prefix.lmc")) == ["13", "39", "5"]
+
+    def test_never_reads(self):
+        from compiler.prefix import PrefixEvaluator
+        a = compiler.Assembler(testing=True)
+        # loops forever without reading input
+        assert PrefixEvaluator(max_cycles=1000).evaluate(a.assemble("BRA 1\nBRA 1")) is None
+        # the first word is not a jump over the memory
+        assert PrefixEvaluator().evaluate(a.assemble("LDA 2\nHLT\nMEM 4")) is None
+
+
+class TestSourceMap(unittest.TestCase):
+    script = "count = 0;\nread(count);\nwhile (count) {\n    count = count - 1;\n}\nprint(count);"
+
+    def test_positions(self):
+        from compiler.tokenizer import Tokenizer
+        t = Tokenizer()
+        t.load(self.script)
+        tokens = t.tokenize()
+        assert [(tk.value, tk.line, tk.column) for tk in tokens[:4]] == \
+            [("count", 1, 1), ("=", 1, 7), ("0", 1, 9), (";", 1, 10)]
+        assert (tokens[14].value, tokens[14].line, tokens[14].column) == ("count", 4, 5)
+
+    def test_source_map(self):
+        c = compiler.ScriptCompiler(testing=True, test_input=[3])
+        c.compile_to_bytecode(self.script)
+        lines = [l.line for l in c.source_map.locations if l is not None]
+        assert sorted(set(lines)) == [2, 3, 4, 6]
+        assert c.source_map.lookup(0) is None
+        inp = [i for i, inst in enumerate(c.instructions) if inst.instruction == "INP"][0]
+        assert str(c.source_map.lookup(inp)) == "2:1 read ( count )"
+
+        # the code from the cache is moved with the statement
+        c.compile_to_bytecode("\n\n" + self.script)
+        assert str(c.source_map.lookup(inp)) == "4:1 read ( count )"
+
+    def test_profile(self):
+        c = compiler.ScriptCompiler(testing=True, test_input=[3])
+        (output, profiler) = c.profile(self.script)
+        assert output == ["0"]
+        assert sum([p.cycles for p in profiler.lines.values()]) == profiler.cycles == c.cycles
+        assert profiler.lines[4].cycles >= 3 and profiler.lines[4].reads >= 3
+
+
+class TestMultiCore(unittest.TestCase):
+    def test_tas(self):
+        exe = Executor(testing=True)
+        mem = [405, 902, 505, 902, 0, 0]
+        assert exe.execute_bytecode(mem) == ["0", "1"]
+
+    def test_spinlock(self):
+        from compiler.multicore import MultiCore
+        a = compiler.Assembler(testing=True)
+        with open("programs/spinlock.man", "r") as f:
+            bcode = a.assemble(f.read(), read_from_file=True)
+        m = MultiCore(3)
+        assert m.run(bcode) == [["300"]] * 3
+        assert sum([r.cycles for r in m.results]) >= 300 * 12
+        assert m.stats.phases["execute"].items == sum([r.cycles for r in m.results])
+
+    def test_core_error(self):
+        from compiler.multicore import MultiCore
+        with self.assertRaises(ExecuteError):
+            MultiCore(2).run([901, 0])
+
+
+class TestEngine(unittest.TestCase):
+    def test_engines_agree(self):
+        from compiler.engine import ENGINES, CrossCheck, select
+        a = compiler.Assembler(testing=True)
+        with open("programs/for-loop.man", "r") as f:
+            words = a.assemble(f.read(), read_from_file=True)
+
+        results = [select(name, words).run([]) for name in ENGINES]
+        assert all([r.output == results[0].output for r in results])
+        assert all([r.cycles == results[0].cycles for r in results])
+
+        assert select("auto", words).name == "simple"
+        assert select("auto", words, banked=True).name == "executor"
+        assert CrossCheck(select("simple", words), select("executor", words)).run([]) is None
+
+    def test_divergence(self):
+        from compiler.engine import ExecutorEngine, CrossCheck, select
+
+        class Broken(ExecutorEngine):
+            def run(self, inputs=None, *, trace=None):
+                self.words[3] = 105 # 'ADD 5' instead of 'ADD 6'
+                return super().run(inputs, trace=trace)
+
+        words = [901, 306, 901, 106, 902, 0, 0]
+        broken = Broken()
+        broken.load(words)
+        divergence = CrossCheck(select("simple", words), broken).run([2, 3])
+        assert divergence is not None and divergence.step == 4
+        assert divergence.first == ("simple", 4, 5) and divergence.second == ("executor", 4, 3)
+
+
 class TestCompiler(unittest.TestCase):
     def setUp(self):
         self.compiler = compiler.ScriptCompiler(testing=True)
@@ -163,5 +363,637 @@ class TestCompiler(unittest.TestCase):
         assert output[1] == "0"
         assert output[2] == "10"
 
+    def test_constant_folding(self):
+        script = """
+        x = 3 + 4 - 1;
+        y = x * 2 - 20;
+        print(x);
+        print(y);
+        """
+        output = self.compiler.compile(script)
+        assert output == ["6", "-8"]
+
+        unoptimized = compiler.ScriptCompiler(testing=True, opt_level=0)
+        unoptimized.compile("x = 3 + 4 - 1;\nprint(x);")
+        optimized = compiler.ScriptCompiler(testing=True)
+        optimized.compile("x = 3 + 4 - 1;\nprint(x);")
+        assert len(optimized.instructions) < len(unoptimized.instructions)
+
+    def test_static_branch_elimination(self):
+        script = """
+        yes = 1;
+        no = yes - 1;
+        if (no) {
+            print(1);
+        }
+        if (yes) {
+            print(2);
+        }
+        """
+        output = self.compiler.compile(script)
+        assert output == ["2"]
+        assert not any([i.instruction in ["BRZ", "BRP"] for i in self.compiler.instructions])
+
+    def test_dropped_block_declares(self):
+        for script in ["if (0) { z = 5; } print(z);",
+                "a = 0; read(a); if (0) { z = a + 1; if (1) { w = 3; } } print(z); print(w);",
+                "while (0) { z = 5; } print(z);",
+                "a = 3; while (a > 5) { z = a; a = a - 1; } print(z); print(a);"]:
+            outputs = []
+            for opt_level in [0, 2]:
+                c = compiler.ScriptCompiler(testing=True, test_input=[4], opt_level=opt_level)
+                outputs.append(c.compile(script))
+            assert outputs[0] == outputs[1]
+
+    def test_constants_after_branch(self):
+        script = """
+        x = 1;
+        y = 0;
+        read(y);
+        if (y) {
+            x = 2;
+        }
+        print(x);
+        """
+        output = self.compiler.compile(script)
+        assert output[0] == "2" # testing input is 7
+
+    def test_while(self):
+        script = """
+        i = 3;
+        total = 0;
+        read(i);
+        while (i) {
+            step = 10;
+            total = total + step;
+            i = i - 1;
+        }
+        print(total);
+        print(i);
+        """
+        for level in [0, 1, 2]:
+            c = compiler.ScriptCompiler(testing=True, test_input=4, opt_level=level)
+            output = c.compile(script)
+            assert output == ["40", "0"]
+
+    def test_while_rotated(self):
+        script = """
+        i = 0;
+        read(i);
+        while (i) {
+            i = i - 1;
+        }
+        """
+        c = compiler.ScriptCompiler(testing=True, test_input=10, opt_level=0)
+        c.compile(script)
+        branches = [i for i in c.instructions if i.instruction in ["BRA", "BRZ", "BRP"]]
+        # jump over memory, jump to the test, then the test at the bottom
+        assert [b.instruction for b in branches] == ["BRA", "BRA", "BRP", "BRZ", "BRA"]
+
+    def test_while_static_condition(self):
+        script = """
+        i = 0;
+        while (i) {
+            print(i);
+        }
+        print(1);
+        """
+        output = self.compiler.compile(script)
+        assert output == ["1"]
+        assert not any([i.instruction in ["BRZ", "BRP"] for i in self.compiler.instructions])
+
+    def test_compile_to_asm(self):
+        script = """
+        foo = 0;
+        read(foo);
+        while (foo) {
+            print(foo);
+            foo = foo - 1;
+        }
+        """
+        asm = self.compiler.compile_to_asm(script)
+        a = compiler.Assembler(testing=True, test_input=2)
+        assert a.load(asm, read_from_file=True) == ["2", "1"]
+
+        bcode = self.compiler.compile_to_bytecode(script)
+        assert a.execute_bytecode(bcode) == ["2", "1"]
+
+    def test_parallel_compile(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from compiler.cache import StatementCache
+
+        scripts = ["x = 0; read(x); y = x * {0} + {0}; print(y);".format(n) for n in range(8)]
+        cache = StatementCache()
+        def compile_script(script):
+            c = compiler.ScriptCompiler(testing=True, test_input=2, cache=cache)
+            return c.compile_to_asm(script)
+
+        first = [compile_script(s) for s in scripts]
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            assert list(pool.map(compile_script, scripts * 3)) == first * 3
+
+    def test_encode(self):
+        c = compiler.ScriptCompiler(testing=True)
+        bcode = c.compile_to_bytecode("a = 0; read(a); while (a > 0) { a = a - 1; print(a); }")
+        text = "\n".join([i.asm() for i in c.instructions])
+        assert bcode == compiler.Assembler().assemble(text)
+
+        from compiler.instruction import Instruction
+        a = compiler.Assembler()
+        assert a.encode([Instruction("LDA", adr=2), Instruction("OUT"), Instruction("MEM", adr="-4")]) \
+            == [502, 902, -4]
+        with self.assertRaises(ParseError):
+            a.encode([Instruction("LDA")])
+        with self.assertRaises(AssemblerError):
+            a.encode([Instruction("LDA", variable="a")])
+
+    def test_phase_stats(self):
+        c = compiler.ScriptCompiler(testing=True, trace_memory=True)
+        (output, stats) = c.compile_with_stats("foo = 13; print(foo);")
+        assert output == ["13"]
+
+        phases = [p["name"] for p in stats.to_dict()["phases"]]
+        assert phases == ["tokenize", "parse", "codegen", "merge_jumps", "optimize",
+            "bind_mem", "bind_jumps", "estimate", "assemble", "evaluate", "execute"]
+        assert stats.phases["tokenize"].items == 9
+        assert stats.phases["merge_jumps"].calls == 2
+        assert stats.phases["execute"].items == c.cycles
+        assert stats.phases["codegen"].peak_bytes > 0
+
+    def test_comparisons(self):
+        ops = ["==", "!=", "<", ">", "<=", ">="]
+        script = """
+        a = 0; b = 0; d = 0; read(a); read(b); read(d);
+        x = 0; if (a {0} b) {{ x = 1; }} print(x);
+        n = 0; while (a {0} b) {{ a = a + d; n = n + 1; }} print(n);
+        """
+        for op in ops:
+            for (a, b) in [(3, 5), (5, 3), (4, 4), (-2, 0)]:
+                d = { "<": 1, "<=": 1, ">": -1, ">=": -1, "==": 1, "!=": 1 if a < b else -1 }[op]
+                (x, n) = (eval("a {0} b".format(op)), 0)
+                while eval("a {0} b".format(op)):
+                    (a, n) = (a + d, n + 1)
+                for opt_level in [0, 2]:
+                    c = compiler.ScriptCompiler(testing=True, test_input=[a - d * n, b, d],
+                        opt_level=opt_level)
+                    assert c.compile(script.format(op)) == [str(int(x)), str(n)]
+
+    def test_comparison_branch(self):
+        c = compiler.ScriptCompiler(testing=True, test_input=[2, 3])
+        assert c.compile("a = 0; b = 0; read(a); read(b); if (a <= b) { print(a); }") == ["2"]
+        branches = [i.instruction for i in c.instructions if i.instruction in ["BRA", "BRZ", "BRP"]]
+        # one to jump over the memory, and one for the condition
+        assert branches == ["BRA", "BRP"]
+
+        with self.assertRaises(CompileError):
+            c.compile("a = 0; x = a < 2;")
+        with self.assertRaises(CompileError):
+            c.compile("a = 0; if ((a < 2)) { print(a); }")
+
+    def test_statement_cache(self):
+        script = """
+        foo = 10;
+        bar = 0;
+        read(bar);
+        bar = bar * 3 + foo;
+        print(bar);
+        print(foo);
+        """
+        c = compiler.ScriptCompiler(testing=True)
+        first = c.compile(script)
+        c.cache.hits = 0
+        assert c.compile(script) == first
+        assert c.cache.hits == 6
+
+        # only 'foo' and what reads it has to be generated again
+        c.cache.hits = 0
+        c.cache.misses = 0
+        output = c.compile(script.replace("10", "11"))
+        assert output == ["32", "11"]
+        assert c.cache.misses == 3
+
+class TestEstimate(unittest.TestCase):
+    def compile(self, script, opt_level):
+        c = compiler.ScriptCompiler(testing=True, test_input=[3, 5], opt_level=opt_level)
+        c.compile(script)
+        return c
+
+    def test_loop_free(self):
+        scripts = [
+            "a = 0; read(a); if (a > 4) { print(a); } b = a * 3; print(b);",
+            "def f(x) { return x + 1; } a = 0; read(a); b = f(a); c = f(b); d = f(c); print(d);"
+        ]
+        for script in scripts:
+            for opt_level in [0, 1, 2]:
+                c = self.compile(script, opt_level)
+                assert c.estimate.exact
+                assert c.estimate.best <= c.cycles <= c.estimate.worst
+
+        # the returns of a linked function are not loops
+        c = self.compile(scripts[1], 0)
+        assert c.estimate.best == c.estimate.worst == c.cycles
+
+    def test_while(self):
+        c = self.compile("i = 0; read(i); while (i) { print(i); i = i - 1; }", 2)
+        assert len(c.estimate.loops) == 1
+        loop = c.estimate.loops[0]
+        assert c.estimate.best + 3 * loop.best <= c.cycles <= c.estimate.worst + 3 * loop.worst
+        assert 0 < loop.best <= loop.worst
+
+    def test_never_halts(self):
+        c = compiler.ScriptCompiler(testing=True)
+        c.compile_to_asm("a = 1; while (1) { print(a); }")
+        assert c.estimate.best is None
+
+class TestFunctions(unittest.TestCase):
+    def setUp(self):
+        self.script = """
+        def add(a, b) {
+            sum = a + b;
+            return sum;
+        }
+        def sign(x) {
+            if (x) {
+                return 1;
+            }
+            return 0;
+        }
+        n = 0;
+        read(n);
+        print(add(n, n));
+        print(sign(n));
+        print(sign(add(n, 0)));
+        """
+
+    def linked_calls(self, c):
+        return len([i for i in c.instructions if i.instruction == "STA" and i.jump is not None])
+
+    def test_functions(self):
+        for level in [0, 1, 2]:
+            c = compiler.ScriptCompiler(testing=True, test_input=4, opt_level=level)
+            output = c.compile(self.script)
+            assert output == ["8", "1", "1"]
+
+    def test_inline(self):
+        c = compiler.ScriptCompiler(testing=True, test_input=4, opt_level=0)
+        c.compile(self.script)
+        assert self.linked_calls(c) == 4
+
+        # 'add' is small enough to inline, 'sign' is not
+        c = compiler.ScriptCompiler(testing=True, test_input=4)
+        c.compile(self.script)
+        assert self.linked_calls(c) == 2
+
+    def test_locals(self):
+        script = """
+        x = 5;
+        def f(a) {
+            x = a + 1;
+            return x;
+        }
+        print(f(1));
+        print(x);
+        """
+        output = compiler.ScriptCompiler(testing=True).compile(script)
+        assert output == ["2", "5"]
+
+    def test_recursion(self):
+        script = """
+        def f(a) {
+            return f(a);
+        }
+        print(f(1));
+        """
+        with self.assertRaises(CompileError):
+            compiler.ScriptCompiler(testing=True).compile(script)
+
+class TestBenchmark(unittest.TestCase):
+    def test_generators(self):
+        from compiler.benchmark import Generator, MEM_SIZE
+        c = compiler.ScriptCompiler(testing=True, test_input=3, mem_size=MEM_SIZE)
+        assert c.compile(Generator.nesting(4)) == ["2", "1", "0"]
+        assert c.compile(Generator.width(5)) == ["3"]
+        assert len(c.compile(Generator.statements(20))) == 5
+
+        a = compiler.Assembler(testing=True)
+        assert a.load(Generator.man_loop(10), read_from_file=True) == ["0"]
+        assert a.cycles == 10 * 5 + 4
+
+    def test_comparator(self):
+        from compiler.benchmark import Comparator
+        phase = lambda seconds: { "seconds": seconds, "items": 10 }
+        baseline = {
+            "cases": { "a_10": { "codegen": phase(0.010), "execute": phase(0.010) } },
+            "scaling": { "a": { "codegen": 1.0 } }
+        }
+        results = {
+            "cases": { "a_10": { "codegen": phase(0.011), "execute": phase(0.030) } },
+            "scaling": { "a": { "codegen": 1.9 } }
+        }
+        regressions = Comparator(baseline).compare(results)
+        assert len(regressions) == 2
+        assert regressions[0].startswith("a_10 execute")
+        assert regressions[1].startswith("a codegen")
+
+class TestBanked(unittest.TestCase):
+    def test_large_program(self):
+        from compiler.benchmark import Generator
+        script = Generator.statements(60)
+        expected = compiler.ScriptCompiler(testing=True, test_input=3, opt_level=0,
+            mem_size=10000).compile(script)
+
+        c = compiler.ScriptCompiler(testing=True, test_input=3, opt_level=0, banked=True)
+        assert c.compile(script) == expected
+        assert len(c.instructions) > 100
+        assert c.stats.phases["banks"].items > 0
+
+    def test_functions(self):
+        script = open("programs/functions.script").read()
+        for opt_level in [0, 2]:
+            expected = compiler.ScriptCompiler(testing=True, test_input=3,
+                opt_level=opt_level).compile(script)
+            c = compiler.ScriptCompiler(testing=True, test_input=3, opt_level=opt_level,
+                mem_size=12, banked=True)
+            assert c.compile(script) == expected
+
+class TestWatch(unittest.TestCase):
+    def test_rebuild(self):
+        import tempfile
+        from compiler.watch import Watcher
+        with tempfile.TemporaryDirectory() as d:
+            filename = os.path.join(d, "watched.script")
+            def save(source, stamp):
+                with open(filename, "w") as f:
+                    f.write(source)
+                os.utime(filename, ns=(stamp, stamp))
+
+            w = Watcher(filename, compiler=compiler.ScriptCompiler(testing=True, test_input=4))
+            save("a = 0; read(a); print(a);", 1)
+            assert w.check() == ["4"]
+            assert w.check() is None
+
+            save("a = 0; read(a); a = a + 1; print(a);", 2)
+            assert w.check() == ["5"]
+            assert w.compiler.cache.hits > 0
+
+            # only a comment, the last bytecode runs again
+            save("a = 0; read(a); a = a + 1; # one more\nprint(a);", 3)
+            assert w.check() == ["5"]
+
+            save("a = 0; print(b);", 4)
+            assert w.check() is None
+            assert w.builds == 3
+
+class TestRepl(unittest.TestCase):
+    def test_session(self):
+        from compiler.repl import Repl
+        for opt_level in [0, 2]:
+            r = Repl(testing=True, test_input=[4, 9], opt_level=opt_level)
+            assert r.enter("x = 5; y = x + 2;") == []
+            assert r.enter("print(y); read(x);") == ["7"]
+            assert r.enter("def f(a) { return a + y; }") == []
+            assert r.enter("w = f(x) + f(1); print(w);") == ["19"]
+
+            # a failed entry changes nothing
+            size = len(r.image)
+            with self.assertRaises(Exception):
+                r.enter("q = f(1, 2);")
+            assert len(r.image) == size
+
+            assert r.enter("read(x); if (x > y) { print(x); }") == ["9"]
+            assert r.variables()["w"] == 19
+
+class TestFuzz(unittest.TestCase):
+    def test_reference(self):
+        from compiler.fuzz import Reference
+        r = Reference([-7])
+        program = [("read", "a"), ("assign", "b", "a / 2 + 10 / 0"), ("print", "b"),
+            ("while", "k", 2, [("assign", "a", "a * 2"), ("print", "a")])]
+        assert r.run(program) == ["-3", "-14", "-28"]
+
+    def test_fuzzer(self):
+        from compiler.fuzz import Fuzzer
+        report = Fuzzer(seed=0).run(8)
+        assert report.programs == 8
+        assert len(report.failures) == 0, str(report)
+        assert report.cycles["O2"] <= report.cycles["O0"]
+
+    def test_shrink(self):
+        from compiler.fuzz import Fuzzer, FuzzFailure
+        class Broken(Fuzzer):
+            def run_setting(self, script, inputs, options):
+                (output, instructions, cycles) = super().run_setting(script, inputs, options)
+                if options["opt_level"] == 2:
+                    output = output[1:]
+                return (output, instructions, cycles)
+
+        settings = [("O0", { "opt_level": 0 }), ("O2", { "opt_level": 2 })]
+        report = Broken(seed=0, settings=settings).run(4)
+        assert len(report.failures) != 0
+        for f in report.failures:
+            assert f.setting == "O2"
+            assert f.script.count("print") == 1
+
+class TestArithmetic(unittest.TestCase):
+    def run_script(self, expr, inputs, opt_level=2):
+        c = compiler.ScriptCompiler(testing=True, test_input=inputs, opt_level=opt_level)
+        script = "a = 0; b = 0; read(a); read(b); x = {0}; print(x);".format(expr)
+        return int(c.compile(script)[0])
+
+    def test_mul_const(self):
+        for a in [-13, 0, 7, 250]:
+            assert self.run_script("a * 10", [a, 0]) == a * 10
+            assert self.run_script("3 * a", [a, 0]) == a * 3
+            assert self.run_script("a * 0", [a, 0], opt_level=0) == 0
+
+    def test_tree_expression(self):
+        expr = "(a + b) - (b - a) + ((a - b) + (a + b)) - (a + (b - (a + b)))"
+        for (a, b) in [(5, 3), (-4, 9), (0, 0)]:
+            expected = (a + b) - (b - a) + ((a - b) + (a + b)) - (a + (b - (a + b)))
+            for opt_level in [0, 1, 2]:
+                assert self.run_script(expr, [a, b], opt_level) == expected
+
+    def test_tree_loads(self):
+        from compiler.tokenizer import Tokenizer
+        from compiler.expression import ExpressionSolver
+        from compiler.memory import Memory
+        t = Tokenizer()
+        t.load("(a + b) - (c - d) + (a - (b + c))")
+        tokens = t.tokenize()
+
+        count = lambda asm: len([i for i in asm.get_instructions() if i.instruction in ["LDA", "STA"]])
+        rpn = ExpressionSolver().gen_runtime_expression(tokens, Memory(), result_var="x")
+        tree = ExpressionSolver().gen_tree_expression(tokens, Memory(), result_var="x")
+        assert count(tree) < count(rpn) * 2 // 3
+
+    def test_div_const(self):
+        assert self.run_script("a / 4", [17, 0]) == 4
+        assert self.run_script("a / 4", [-17, 0]) == -4
+        assert self.run_script("a / (0 - 3)", [10, 0]) == -3
+        assert self.run_script("a / 7", [999, 0], opt_level=0) == 142
+
+    def test_div_const_fits(self):
+        script = "a = 0; read(a); b = a / 7; c = a / 13; d = a / 25; print(b); print(c); print(d);"
+        for a in [500, -500, 6]:
+            c = compiler.ScriptCompiler(testing=True, test_input=[a])
+            assert c.compile(script) == [str(int(a / n)) for n in [7, 13, 25]]
+            assert len(c.instructions) <= 100
+        # with room for them, the divisions use the faster loops
+        c = compiler.ScriptCompiler(testing=True, test_input=[500], mem_size=1000)
+        c.compile(script)
+        assert not c.solver.arithmetic.compact and c.solver.arithmetic.expanded == 3
+
+    def test_mul_div_runtime(self):
+        assert self.run_script("a * b", [6, -7]) == -42
+        assert self.run_script("a * b", [-6, -7]) == 42
+        assert self.run_script("a / b", [-45, 6]) == -7
+        assert self.run_script("a / b", [45, 0]) == 0
+
+    def test_mul_chain_is_short(self):
+        from compiler.arithmetic import Arithmetic
+        # x * 10 == (x + x) * 5
+        assert Arithmetic.mul_chain(10) == ["add", 5]
+        assert Arithmetic.div_levels(500) == [1]
+
+
+class TestPeephole(unittest.TestCase):
+    def setUp(self):
+        self.compiler = compiler.ScriptCompiler(testing=True, test_input=[4, 5], opt_level=1)
+
+    def test_redundant_loads_and_stores(self):
+        script = """
+        foo = 0;
+        bar = 0;
+        read(foo);
+        read(bar);
+        foo = foo + bar + 1;
+        print(foo);
+        """
+        output = self.compiler.compile(script, report=True)
+        assert output[0] == "10"
+
+        instrs = self.compiler.instructions
+        for prev, curr in zip(instrs, instrs[1:]):
+            assert not (prev.instruction == "STA" and curr.instruction == "LDA" \
+                and prev.adr == curr.adr)
+
+        stats = self.compiler.peephole_stats
+        assert stats.instructions_saved > 0
+        assert stats.cycles_saved > 0
+        assert stats.cycles_after == self.compiler.cycles
+
+    def test_thread_jumps(self):
+        from compiler.instruction import Instruction, JumpFlag
+        from compiler.peephole import PeepholeOptimizer
+
+        first = Instruction("BRZ", jump="a")
+        middle = Instruction("BRA", jump="b")
+        middle.add_jump(JumpFlag("a"))
+        out = Instruction("OUT")
+        end = Instruction("HLT")
+        end.add_jump(JumpFlag("b"))
+
+        optimizer = PeepholeOptimizer()
+        optimizer.optimize([Instruction("INP"), first, out, middle, end])
+        assert first.jump == "b"
+        assert optimizer.stats.jumps_threaded == 1
+
+
+class TestDataFlow(unittest.TestCase):
+    def setUp(self):
+        from compiler.instruction import Instruction, JumpFlag
+        # INP; BRZ end; STA x; LDA x; OUT; BRA end; OUT (unreachable); end: HLT
+        self.end = Instruction("HLT")
+        self.end.add_jump(JumpFlag("end"))
+        self.code = [Instruction("INP"), Instruction("BRZ", jump="end"),
+            Instruction("STA", variable="x"), Instruction("LDA", variable="x"),
+            Instruction("OUT"), Instruction("BRA", jump="end"), Instruction("OUT"), self.end]
+
+    def test_cfg(self):
+        from compiler.cfg import ControlFlowGraph
+        cfg = ControlFlowGraph(self.code)
+        assert len(cfg.blocks) == 4
+        assert len(cfg.reachable()) == 3
+        assert cfg.blocks[3] in cfg.blocks[0].successors
+
+    def test_analyses(self):
+        from compiler.cfg import ControlFlowGraph
+        from compiler.dataflow import AC, Liveness, ReachingDefinitions, AvailableValues
+        cfg = ControlFlowGraph(self.code)
+        block = cfg.blocks[1]
+
+        live = Liveness(cfg).instruction_values(block)
+        assert "x" in live[0][2] # x is read right after it's stored
+
+        reaching = ReachingDefinitions(cfg).block_out[block]
+        assert ReachingDefinitions.definitions_of("x", reaching) == [self.code[2]]
+
+        available = AvailableValues(cfg).instruction_values(block)
+        assert AvailableValues.holds(available[1][1], AC, "x")
+
+    def test_global_optimizer(self):
+        from compiler.globalopt import GlobalOptimizer
+        optimizer = GlobalOptimizer()
+        code = optimizer.optimize(self.code)
+        assert [i.instruction for i in code] == ["INP", "BRZ", "OUT", "BRA", "HLT"]
+
+    def test_copy_propagation(self):
+        script = """
+        x = 0;
+        z = 0;
+        read(x);
+        y = x;
+        read(z);
+        print(y);
+        """
+        c = compiler.ScriptCompiler(testing=True, test_input=[3, 4])
+        output = c.compile(script)
+        assert output[0] == "3"
+        assert c.global_stats.copies_propagated > 0
+        # only the first input needs to be stored
+        assert len([i for i in c.instructions if i.instruction == "STA"]) == 1
+
+class TestOutline(unittest.TestCase):
+    def setUp(self):
+        statement = """
+        x = a * 7 + b * 3 - c;
+        print(x);
+        read(a);
+        """
+        self.script = "a = 0; b = 0; c = 0; read(a); read(b); read(c);" + statement * 6
+        self.inputs = list(range(1, 12))
+
+    def test_outliner(self):
+        from compiler.instruction import Instruction
+        from compiler.memory import Memory
+        from compiler.outline import Outliner
+
+        mem = Memory()
+        for name in ["a", "b"]:
+            mem.add_reference(name)
+        block = [Instruction("LDA", variable="a"), Instruction("ADD", variable="b"),
+            Instruction("ADD", variable="b"), Instruction("SUB", variable="a"), Instruction("OUT"),
+            Instruction("ADD", variable="a"), Instruction("ADD", variable="b"), Instruction("OUT")]
+        code = [Instruction("INP"), Instruction("STA", variable="a"), Instruction("STA", variable="b")]
+        for n in range(3):
+            code += [Instruction(i.instruction, variable=i.variable) for i in block]
+        code.append(Instruction("HLT"))
+
+        outliner = Outliner(mem, cycles_per_word=100)
+        result = outliner.optimize(code)
+        assert outliner.stats.subroutines == 1
+        assert outliner.stats.calls == 3
+        assert len(result) + len(mem.get()) < len(code) + 2
+
+    def test_program_fits(self):
+        c = compiler.ScriptCompiler(testing=True, test_input=self.inputs, opt_level=0)
+        with self.assertRaises(CompileError):
+            c.compile(self.script)
+
+        c = compiler.ScriptCompiler(testing=True, test_input=self.inputs)
+        output = c.compile(self.script)
+        assert c.outline_stats.subroutines > 0
+        assert output == ["10", "31", "38", "45", "52", "59"]
+
 if __name__ == "__main__":
     unittest.main()